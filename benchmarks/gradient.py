@@ -0,0 +1,55 @@
+"""
+Gradient evaluations per second of the log posterior against the number of
+observed quantiles M.
+
+Usage::
+
+    python benchmarks/gradient.py --M 3 10 30 100 300 --repeats 2000
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from bqme.distributions import Normal, Gamma
+from bqme.models import NormalQM
+
+
+def gradient_evals_per_second(model:NormalQM, M:int, N:int, repeats:int) -> float:
+    q = np.linspace(0.5 / M, 1. - 0.5 / M, M)
+    X = Normal(0., 1., name='x').ppf(q)
+    data = model._data_dict(N, list(q), list(X))
+    # Fixed_param sampler only creates the fit object, no sampling
+    fit = model.model.sampling(data=data, iter=1, chains=1,
+            algorithm='Fixed_param')
+    upar = fit.unconstrain_pars({'mu': 0.1, 'sigma': 1.1})
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fit.grad_log_prob(upar)
+    return repeats / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--M', type=int, nargs='+', default=[3, 10, 30, 100, 300])
+    parser.add_argument('--N', type=int, default=10000)
+    parser.add_argument('--repeats', type=int, default=2000)
+    parser.add_argument('--output', type=str, default=None,
+            help='write results as json to this file')
+    args = parser.parse_args()
+
+    model = NormalQM(Normal(0., 1., name='mu'), Gamma(1., 1., name='sigma'))
+    model.compile()
+    results = []
+    for M in args.M:
+        rate = gradient_evals_per_second(model, M, args.N, args.repeats)
+        results.append({'M': M, 'N': args.N, 'grad_evals_per_second': rate})
+        print(f'M={M:5d}  {rate:12.0f} gradient evaluations / s')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+"""
+Benchmark suite measuring each stage of a fit separately for all four model
+families:
+
+- code:        rendering of the stan code (QM.code)
+- compile:     compilation of the stan code without cache (QM.compile)
+- sampling:    wall time and ESS / second of QM.sampling
+- optimizing:  wall time of QM.optimizing with the stan and numpy backends
+- evaluation:  pdf/cdf/ppf evaluations / second of a fit object
+
+Results are written as json. Given a baseline file, every measurement is
+compared to the baseline and the script exits with a non-zero status if any
+of them regressed by more than the tolerance.
+
+Usage::
+
+    python benchmarks/suite.py --output results.json
+    python benchmarks/suite.py --stages code evaluation --M 3 30 --n-x 10 1000
+    python benchmarks/suite.py --baseline baseline.json --tolerance 0.25
+
+Stages that need stan (compile, sampling, optimizing) compile each model
+once, the compile stage always compiles without cache and takes minutes.
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+from bqme.distributions import Normal, Gamma, Lognormal, Weibull
+from bqme.models import QM, NormalQM, GammaQM, LognormalQM, WeibullQM
+
+STAGES = ['code', 'compile', 'sampling', 'optimizing', 'evaluation']
+
+# model constructor and the distribution the synthetic quantiles come from
+FAMILIES = {
+    'normal': (
+        lambda: NormalQM(Normal(0., 1., name='mu'), Gamma(1., 1., name='sigma')),
+        Normal(0.5, 1.5, name='x'),
+    ),
+    'gamma': (
+        lambda: GammaQM(Gamma(1., 1., name='alpha'), Gamma(1., 1., name='beta')),
+        Gamma(2., 1., name='x'),
+    ),
+    'lognormal': (
+        lambda: LognormalQM(Normal(1., 1., name='mu'), Lognormal(1., 1., name='sigma')),
+        Lognormal(0., 0.5, name='x'),
+    ),
+    'weibull': (
+        lambda: WeibullQM(Weibull(1., 1., name='alpha'), Weibull(1., 1., name='sigma')),
+        Weibull(1.5, 1., name='x'),
+    ),
+}
+
+
+def dataset(family:str, M:int, N:int) -> Tuple[int, List[float], List[float]]:
+    """ M equally spaced quantiles of the family's data distribution """
+    q = np.linspace(0.5 / M, 1. - 0.5 / M, M)
+    X = FAMILIES[family][1].ppf(q)
+    return N, list(q), list(X)
+
+
+def timeit(fn:Callable[[], object], repeats:int) -> float:
+    """ median wall time of fn in seconds """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def record(stage:str, family:str, metric:str, value:float, unit:str,
+        higher_is_better:bool, **params) -> Dict:
+    return {
+        'stage': stage,
+        'family': family,
+        'params': params,
+        'metric': metric,
+        'value': value,
+        'unit': unit,
+        'higher_is_better': higher_is_better,
+    }
+
+
+def bench_code(family:str, args:argparse.Namespace) -> List[Dict]:
+    # QM.code is memoized, a fresh model is rendered in every repeat
+    t = timeit(lambda: FAMILIES[family][0]().code, args.repeats)
+    return [record('code', family, 'time', t, 's', False)]
+
+
+def bench_compile(family:str, args:argparse.Namespace) -> List[Dict]:
+    model = FAMILIES[family][0]()
+    t = timeit(lambda: model.compile(cache=False), 1)
+    return [record('compile', family, 'time', t, 's', False)]
+
+
+def effective_sample_size(fit:object, names:List[str]) -> float:
+    """ smallest n_eff of the model parameters reported by stan """
+    summary = fit.summary(pars=names)
+    col = list(summary['summary_colnames']).index('n_eff')
+    return float(np.min(summary['summary'][:, col]))
+
+
+def bench_sampling(model:QM, family:str, args:argparse.Namespace) -> List[Dict]:
+    results = []
+    for M in args.M:
+        for N in args.N:
+            N_, q, X = dataset(family, M, N)
+            start = time.perf_counter()
+            fit = model.sampling(N_, q, X)
+            t = time.perf_counter() - start
+            ess = effective_sample_size(fit.stan_obj, model.parameter_names)
+            results += [
+                record('sampling', family, 'time', t, 's', False, M=M, N=N),
+                record('sampling', family, 'ess_per_second', ess / t, '1/s', True, M=M, N=N),
+            ]
+    return results
+
+
+def bench_optimizing(model:QM, family:str, args:argparse.Namespace) -> List[Dict]:
+    results = []
+    for backend in ['stan', 'numpy']:
+        if backend == 'stan' and model.model is None:
+            continue
+        for M in args.M:
+            for N in args.N:
+                data = dataset(family, M, N)
+                t = timeit(lambda: model.optimizing(*data, backend=backend), args.repeats)
+                results.append(record('optimizing', family, 'time', t, 's', False,
+                        M=M, N=N, backend=backend))
+    return results
+
+
+def bench_evaluation(model:QM, family:str, args:argparse.Namespace) -> List[Dict]:
+    # the laplace fit has the same evaluation code as a sampling fit and
+    # needs no compilation
+    np.random.seed(0)
+    fit = model.laplace(*dataset(family, args.M[0], args.N[0]), draws=args.draws)
+    lo, hi = FAMILIES[family][1].ppf([0.01, 0.99])
+    results = []
+    for n_x in args.n_x:
+        x = np.linspace(lo, hi, n_x)
+        q = np.linspace(0.01, 0.99, n_x)
+        for fn, arg in [('pdf', x), ('cdf', x), ('ppf', q)]:
+            for method in ['mean', 'full']:
+                t = timeit(lambda: getattr(fit, fn)(arg, method=method), args.repeats)
+                results.append(record('evaluation', family, 'evals_per_second',
+                        n_x * args.draws / t, '1/s', True,
+                        function=fn, method=method, n_x=n_x, draws=args.draws))
+    return results
+
+
+def run(args:argparse.Namespace) -> List[Dict]:
+    results = []
+    for family in args.families:
+        if 'code' in args.stages:
+            results += bench_code(family, args)
+        if 'compile' in args.stages:
+            results += bench_compile(family, args)
+        model = FAMILIES[family][0]()
+        if 'sampling' in args.stages or \
+                ('optimizing' in args.stages and not args.no_stan):
+            model.compile()
+        if 'sampling' in args.stages:
+            results += bench_sampling(model, family, args)
+        if 'optimizing' in args.stages:
+            results += bench_optimizing(model, family, args)
+        if 'evaluation' in args.stages:
+            results += bench_evaluation(model, family, args)
+    return results
+
+
+def _key(r:Dict) -> str:
+    return json.dumps([r['stage'], r['family'], r['metric'], r['params']], sort_keys=True)
+
+
+def compare(results:List[Dict], baseline:List[Dict], tolerance:float) -> List[Dict]:
+    """
+    relative change of every measurement present in both runs. A change is
+    a regression if it is worse than the baseline by more than tolerance.
+    """
+    base = {_key(r): r for r in baseline}
+    changes = []
+    for r in results:
+        b = base.get(_key(r))
+        if b is None or b['value'] == 0:
+            continue
+        ratio = r['value'] / b['value']
+        # ratio > 1 means slower for times, faster for rates
+        slowdown = 1. / ratio if r['higher_is_better'] else ratio
+        changes.append(dict(r, baseline=b['value'], slowdown=slowdown,
+                regression=slowdown > 1. + tolerance))
+    return changes
+
+
+def _label(r:Dict) -> str:
+    params = ' '.join(f'{k}={v}' for k, v in r['params'].items())
+    return f"{r['stage']:11s} {r['family']:10s} {r['metric']:17s} {params}"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stages', nargs='+', choices=STAGES,
+            default=['code', 'sampling', 'optimizing', 'evaluation'])
+    parser.add_argument('--families', nargs='+', choices=list(FAMILIES),
+            default=list(FAMILIES))
+    parser.add_argument('--M', type=int, nargs='+', default=[3, 10, 30])
+    parser.add_argument('--N', type=int, nargs='+', default=[100, 10000])
+    parser.add_argument('--n-x', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--draws', type=int, default=4000,
+            help='number of posterior draws of the evaluation stage')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--no-stan', action='store_true',
+            help='skip everything that needs a compiled model')
+    parser.add_argument('--output', type=str, default=None,
+            help='write results as json to this file')
+    parser.add_argument('--baseline', type=str, default=None,
+            help='json file of a previous run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+            help='relative slowdown w.r.t. the baseline counted as regression')
+    args = parser.parse_args()
+    if args.no_stan:
+        args.stages = [s for s in args.stages if s not in ['compile', 'sampling']]
+
+    results = run(args)
+    for r in results:
+        print(f"{_label(r)}  {r['value']:12.4g} {r['unit']}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'meta': {
+                    'python': platform.python_version(),
+                    'numpy': np.__version__,
+                    'platform': sys.platform,
+                    'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                },
+                'results': results,
+            }, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        changes = compare(results, baseline, args.tolerance)
+        print(f'\ncomparison to {args.baseline}:')
+        for c in changes:
+            flag = 'REGRESSION' if c['regression'] else ''
+            print(f"{_label(c)}  {c['slowdown']:6.2f}x slower {flag}")
+        if any(c['regression'] for c in changes):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,2 +1,31 @@
-from bqme.distributions import Normal, Gamma, Lognormal, Weibull
-from bqme.models import NormalQM, GammaQM, LognormalQM, WeibullQM
+"""
+The public classes are imported lazily on first attribute access, s.t.
+`import bqme` stays fast and free of side effects.
+"""
+import importlib
+
+_exports = {
+    'Normal': 'bqme.distributions',
+    'Gamma': 'bqme.distributions',
+    'Lognormal': 'bqme.distributions',
+    'Weibull': 'bqme.distributions',
+    'NormalQM': 'bqme.models',
+    'GammaQM': 'bqme.models',
+    'LognormalQM': 'bqme.models',
+    'WeibullQM': 'bqme.models',
+    'select_family': 'bqme.selection',
+    'select_family_batch': 'bqme.selection',
+}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name:str) -> object:
+    if name not in _exports:
+        raise AttributeError(f"module 'bqme' has no attribute '{name}'")
+    value = getattr(importlib.import_module(_exports[name]), name)
+    globals()[name] = value
+    return value
+
+def __dir__() -> list:
+    return sorted(list(globals()) + __all__)
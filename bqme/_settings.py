@@ -1,4 +1,12 @@
+import os
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 STAN_TEMPLATE_PATH = BASE_DIR / 'bqme' / 'stan_code_template.stan'
+STAN_TEMPLATE_STACKED_PATH = BASE_DIR / 'bqme' / 'stan_code_template_stacked.stan'
+
+# compiled stan models are pickled to this directory (see bqme.cache)
+CACHE_DIR = Path(os.environ.get(
+        'BQME_CACHE_DIR', Path.home() / '.cache' / 'bqme'
+    ))
+CACHE_MAX_BYTES = int(os.environ.get('BQME_CACHE_MAX_BYTES', 2 * 1024**3))
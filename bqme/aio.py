@@ -0,0 +1,143 @@
+"""
+asyncio support for QM.asampling and QM.aoptimizing.
+
+Every fit runs in its own process forked from the current one, s.t. the
+compiled stan model is shared without pickling and never used by two fits
+in the same process. The number of fits running at once is bounded per
+model, further fits wait for a free slot (backpressure). Cancelling the
+awaiting task or a timeout terminates the process of the fit.
+"""
+import asyncio
+import multiprocessing
+from typing import Dict, Tuple
+
+from bqme.models import _fit_worker, _init_worker
+
+
+def _run_child(model:'QM', task:Tuple, conn:'Connection') -> None:
+    _init_worker(model)
+    try:
+        conn.send(_fit_worker(task)[1])
+    finally:
+        conn.close()
+
+async def _join(process:'Process', terminated:bool, grace:float=5.) -> None:
+    """
+    waits for the exit of process without blocking the event loop. A
+    terminated process still alive after grace seconds is killed.
+    """
+    waited = 0.
+    try:
+        while process.is_alive():
+            if terminated and waited > grace:
+                process.kill()
+            await asyncio.sleep(0.01)
+            waited += 0.01
+    except asyncio.CancelledError:
+        # cancelled while waiting, the process must not outlive the fit
+        process.kill()
+        process.join()
+        raise
+    process.join()
+
+
+class AsyncExecutor:
+    """
+    Runs the fits of one model concurrently in forked processes.
+
+    Parameters
+    ----------
+    model : QM
+        compiled model
+    max_workers : int, default: None
+        number of fits running at once, defaults to os.cpu_count()
+    max_pending : int, default: None
+        number of fits waiting for a free slot. If exceeded, `run` raises
+        RuntimeError immediately, e.g. to reject requests of a service.
+        None means no limit.
+    """
+    def __init__(self, model:'QM', max_workers:int=None, max_pending:int=None) -> None:
+        self.model = model
+        self.max_workers = max_workers or multiprocessing.cpu_count()
+        self.max_pending = max_pending
+        self.pending = 0
+        self.running = 0
+        self._semaphore = None
+        self._loop = None
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(max_workers={self.max_workers}, max_pending={self.max_pending})'
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # semaphores are bound to the event loop they are used in
+        loop = asyncio.get_event_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+            self._loop = loop
+        return self._semaphore
+
+    async def run(self,
+            method:str,
+            dataset:Tuple,
+            kwargs:Dict,
+            timeout:float=None
+        ) -> object:
+        """
+        stan output of model.model.<method> for dataset (N, q, X). Raises
+        the exception of the fit, asyncio.TimeoutError if the fit takes
+        longer than timeout seconds (the wait for a slot does not count).
+        """
+        semaphore = self._get_semaphore()
+        if self.max_pending is not None and semaphore.locked() \
+                and self.pending >= self.max_pending:
+            raise RuntimeError(f'{self.pending} fits are waiting already, at most {self.max_pending} allowed.')
+        self.pending += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self.pending -= 1
+        self.running += 1
+        try:
+            out = await self._run_process(method, dataset, kwargs, timeout)
+        finally:
+            self.running -= 1
+            semaphore.release()
+        if isinstance(out, Exception):
+            raise out
+        return out
+
+    async def _run_process(self,
+            method:str,
+            dataset:Tuple,
+            kwargs:Dict,
+            timeout:float
+        ) -> object:
+        loop = asyncio.get_event_loop()
+        ctx = multiprocessing.get_context('fork')
+        receiver, sender = ctx.Pipe(duplex=False)
+        task = (0, method, dataset, kwargs, None, None)
+        process = ctx.Process(target=_run_child,
+                args=(self.model, task, sender), daemon=True)
+        process.start()
+        sender.close()
+        readable = loop.create_future()
+        def on_readable():
+            if not readable.done():
+                readable.set_result(None)
+        loop.add_reader(receiver.fileno(), on_readable)
+        terminated = False
+        try:
+            await asyncio.wait_for(readable, timeout)
+            try:
+                return receiver.recv()
+            except EOFError:
+                return RuntimeError(f'fit process exited with code {process.exitcode}.')
+        except BaseException:
+            # cancelled or timed out
+            process.terminate()
+            terminated = True
+            raise
+        finally:
+            loop.remove_reader(receiver.fileno())
+            receiver.close()
+            await _join(process, terminated)
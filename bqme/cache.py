@@ -0,0 +1,205 @@
+import hashlib
+import os
+import pickle
+import platform
+import sys
+import sysconfig
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict
+
+from bqme._settings import CACHE_DIR, CACHE_MAX_BYTES
+
+
+def _toolchain_signature() -> str:
+    """
+    pystan version, C++ compiler and python version, i.e. everything
+    besides the stan code that changes the compiled binary
+    """
+    import pystan
+    compiler = sysconfig.get_config_var('CXX') or \
+            sysconfig.get_config_var('CC') or ''
+    return ';'.join([
+            f'pystan={pystan.__version__}',
+            f'compiler={compiler}',
+            f'python={platform.python_version()}',
+            f'platform={sys.platform}',
+        ])
+
+
+def _lock_file(f:'file', blocking:bool=True) -> bool:
+    """
+    exclusive lock of an open file, fcntl on posix and msvcrt on windows.
+    Returns False if blocking is False and the file is locked elsewhere.
+    """
+    if os.name == 'nt':
+        import msvcrt
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                return True
+            except OSError:
+                if not blocking:
+                    return False
+                time.sleep(0.1)
+    import fcntl
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+    except BlockingIOError:
+        return False
+    return True
+
+def _unlock_file(f:'file') -> None:
+    if os.name == 'nt':
+        import msvcrt
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class ModelCache:
+    """
+    Content-addressed cache of compiled stan models.
+
+    Models are pickled to `directory` under the hash of their stan code and
+    the toolchain used for compilation. Access times are tracked via the
+    file modification time and the least recently used models are removed
+    once the directory grows beyond `max_bytes`. Compilation of a key
+    happens under an exclusive file lock, s.t. concurrent processes compile
+    each distinct model at most once.
+
+    Parameters
+    ----------
+    directory : str or Path, default: bqme._settings.CACHE_DIR
+        directory of the pickled models (env variable BQME_CACHE_DIR)
+    max_bytes : int, default: bqme._settings.CACHE_MAX_BYTES
+        size bound of the directory (env variable BQME_CACHE_MAX_BYTES)
+    """
+    suffix = '.pkl'
+
+    def __init__(self, directory:str or Path=None, max_bytes:int=None) -> None:
+        self.directory = Path(directory if directory is not None else CACHE_DIR)
+        self.max_bytes = max_bytes if max_bytes is not None else CACHE_MAX_BYTES
+        self._memory: Dict[str, object] = {}
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(directory="{self.directory}", max_bytes={self.max_bytes})'
+
+    def key(self, code:str) -> str:
+        """ hash of the stan code and the toolchain """
+        content = code + '\n' + _toolchain_signature()
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def get(self, code:str, compile_fn:Callable[[], object]) -> object:
+        """
+        Returns the compiled model for `code`. `compile_fn` is only called
+        if neither this process nor the on-disk cache has the model yet.
+        """
+        key = self.key(code)
+        if key in self._memory:
+            return self._memory[key]
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / (key + self.suffix)
+        with self._lock(key):
+            model = self._load(path)
+            if model is None:
+                model = compile_fn()
+                self._store(path, model)
+        self._evict()
+        self._memory[key] = model
+        return model
+
+    def clear(self) -> None:
+        """ removes all pickled models """
+        self._memory.clear()
+        if not self.directory.exists():
+            return
+        with self._lock('evict'):
+            for path in self.directory.glob('*' + self.suffix):
+                path.unlink()
+            self._remove_locks()
+
+    def size(self) -> int:
+        """ total size of the pickled models in bytes """
+        return sum(p.stat().st_size for p in self.directory.glob('*' + self.suffix))
+
+    @contextmanager
+    def _lock(self, name:str) -> None:
+        with open(self.directory / f'.{name}.lock', 'w') as f:
+            _lock_file(f)
+            try:
+                yield
+            finally:
+                _unlock_file(f)
+
+    def _remove_locks(self) -> None:
+        """
+        removes the lock files of keys without model, i.e. of evicted
+        models, unless they are held by a compiling process. Called under
+        the evict lock.
+        """
+        for lock in self.directory.glob('.*.lock'):
+            key = lock.name[1:-len('.lock')]
+            if key == 'evict' or (self.directory / (key + self.suffix)).exists():
+                continue
+            with open(lock, 'a') as f:
+                if not _lock_file(f, blocking=False):
+                    continue
+                try:
+                    # a process that opened the file just now may compile
+                    # the key a second time, which is harmless
+                    lock.unlink()
+                finally:
+                    _unlock_file(f)
+
+    def _load(self, path:Path) -> object:
+        if not path.exists():
+            return None
+        try:
+            with open(path, 'rb') as f:
+                model = pickle.load(f)
+        except Exception:
+            # truncated or written by an incompatible version, recompile
+            return None
+        os.utime(path)  # mark as recently used
+        return model
+
+    def _store(self, path:Path, model:object) -> None:
+        tmp = path.with_suffix(f'.{os.getpid()}.tmp')
+        with open(tmp, 'wb') as f:
+            pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    def _evict(self) -> None:
+        """ removes least recently used models until size <= max_bytes """
+        with self._lock('evict'):
+            paths = sorted(
+                    self.directory.glob('*' + self.suffix),
+                    key=lambda p: p.stat().st_mtime,
+                )
+            total = sum(p.stat().st_size for p in paths)
+            # the most recently used model is always kept
+            for path in paths[:-1]:
+                if total <= self.max_bytes:
+                    break
+                total -= path.stat().st_size
+                path.unlink()
+            self._remove_locks()
+
+
+_default_cache = None
+
+def default_cache() -> ModelCache:
+    """ cache used by QM.compile if no other cache is given """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ModelCache()
+    return _default_cache
+
+def set_default_cache(cache:ModelCache) -> None:
+    """ replaces the cache used by QM.compile, e.g. to change the directory """
+    global _default_cache
+    _default_cache = cache
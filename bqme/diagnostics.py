@@ -0,0 +1,122 @@
+"""
+Convergence diagnostics of stan sampling fits.
+"""
+from typing import Dict, List
+
+import numpy as np
+
+
+def divergences(stan_fit:'StanFit4Model') -> int:
+    """ number of divergent transitions after warmup over all chains """
+    return sum(int(np.sum(params['divergent__']))
+            for params in stan_fit.get_sampler_params(inc_warmup=False))
+
+def e_bfmi(stan_fit:'StanFit4Model') -> np.ndarray:
+    """
+    energy Bayesian fraction of missing information per chain. Values
+    below 0.3 indicate that the adaptation does not fit the posterior.
+    """
+    ret = []
+    for params in stan_fit.get_sampler_params(inc_warmup=False):
+        energy = np.asarray(params['energy__'], dtype=float)
+        ret.append(np.sum(np.diff(energy)**2) / np.sum((energy - energy.mean())**2))
+    return np.array(ret)
+
+def chains(stan_fit:'StanFit4Model', names:List[str]) -> np.ndarray:
+    """
+    samples after warmup in the order of the chains, shape
+    (#parameters, #draws per chain, #chains)
+    """
+    extracted = stan_fit.extract(names, permuted=False)
+    if isinstance(extracted, np.ndarray):
+        # older pystan: all flat parameters, shape (#draws, #chains, #flatnames)
+        flatnames = list(stan_fit.flatnames)
+        extracted = {n: extracted[:, :, flatnames.index(n)] for n in names}
+    return np.array([np.asarray(extracted[n], dtype=float).reshape(
+            len(extracted[n]), -1) for n in names])
+
+def _split_chains(x:np.ndarray) -> np.ndarray:
+    """ first and second half of every chain as separate chains """
+    n = x.shape[0] // 2
+    return np.concatenate([x[:n], x[-n:]], axis=1)
+
+def _z_scale(x:np.ndarray) -> np.ndarray:
+    """ normal scores of the ranks over all chains """
+    from scipy.stats import rankdata
+    from scipy.special import ndtri
+    ranks = rankdata(x, method='average').reshape(x.shape)
+    return ndtri((ranks - 0.375) / (x.size + 0.25))
+
+def _rhat_basic(x:np.ndarray) -> float:
+    n = x.shape[0]
+    within = np.mean(np.var(x, axis=0, ddof=1))
+    between = n * np.var(np.mean(x, axis=0), ddof=1)
+    if within == 0.:
+        return np.nan
+    return float(np.sqrt(((n - 1) / n * within + between / n) / within))
+
+def _autocovariance(x:np.ndarray) -> np.ndarray:
+    """ autocovariance of each chain (column) via fft """
+    n = x.shape[0]
+    x = x - x.mean(axis=0)
+    size = 2**int(np.ceil(np.log2(2 * n)))
+    f = np.fft.rfft(x, size, axis=0)
+    return np.fft.irfft(f * np.conj(f), size, axis=0)[:n] / n
+
+def _ess(x:np.ndarray) -> float:
+    """
+    effective sample size of the draws x with shape (#draws, #chains),
+    using Geyer's initial monotone sequence of the autocorrelations
+    """
+    n, m = x.shape
+    acov = _autocovariance(x)
+    mean_var = np.mean(acov[0]) * n / (n - 1)
+    var_plus = mean_var * (n - 1) / n
+    if m > 1:
+        var_plus += np.var(np.mean(x, axis=0), ddof=1)
+    if var_plus == 0.:
+        return np.nan
+    rho = 1. - (mean_var - np.mean(acov, axis=1)) / var_plus
+    rho[0] = 1.
+    # truncate at the first negative sum of an even and odd lag
+    pairs = rho[:n - n % 2].reshape(-1, 2).sum(axis=1)
+    negative = np.flatnonzero(pairs < 0.)
+    pairs = pairs[:negative[0] if len(negative) else len(pairs)]
+    pairs = np.minimum.accumulate(pairs)
+    tau = -1. + 2. * np.sum(pairs)
+    return float(n * m / max(tau, 1. / np.log10(n * m)))
+
+def rhat(x:np.ndarray) -> float:
+    """
+    rank normalized split R-hat of the draws x with shape (#draws, #chains),
+    the maximum of the bulk and the tail (folded draws) R-hat. Values
+    close to 1 (e.g. below 1.01) indicate that the chains have mixed.
+    """
+    split = _split_chains(x)
+    folded = np.abs(split - np.median(split))
+    return max(_rhat_basic(_z_scale(split)), _rhat_basic(_z_scale(folded)))
+
+def ess_bulk(x:np.ndarray) -> float:
+    """ effective sample size of the rank normalized split chains """
+    return _ess(_z_scale(_split_chains(x)))
+
+def ess_tail(x:np.ndarray) -> float:
+    """
+    effective sample size of the 5% and 95% quantiles, the minimum of the
+    two
+    """
+    split = _split_chains(x)
+    q05, q95 = np.quantile(split, [0.05, 0.95])
+    return min(_ess((split <= q05).astype(float)),
+            _ess((split <= q95).astype(float)))
+
+def summary(x:np.ndarray, names:List[str]) -> Dict[str, Dict[str, float]]:
+    """
+    rhat, ess_bulk and ess_tail per parameter of the draws x with shape
+    (#parameters, #draws per chain, #chains), see `chains`
+    """
+    return {
+        'rhat': {n: rhat(x_) for n, x_ in zip(names, x)},
+        'ess_bulk': {n: ess_bulk(x_) for n, x_ in zip(names, x)},
+        'ess_tail': {n: ess_tail(x_) for n, x_ in zip(names, x)},
+    }
@@ -1,23 +1,47 @@
 from typing import Dict, Tuple, List
 
 import numpy as np
-from scipy.stats import norm, gamma, lognorm, weibull_min
+from scipy.special import digamma, gammainc, gammaln, ndtr
 
 from bqme.variables import ContinuousVariable, PositiveContinuousVariable
 from bqme.variables import Variable
 
 
+def _bounds(lower:float, upper:float) -> str:
+    """ stan constraint string, e.g. '<lower=0>' """
+    l = f'lower={lower}' if lower > float('-inf') else ''
+    r = f'upper={upper}' if upper < float('inf') else ''
+    if l and r:
+        return f'<{l}, {r}>'
+    elif l or r:
+        return f'<{l if l else r}>'
+    return ''
+
+
 class Distribution:
     """
     Base class for all distribution
     Key and values of `parameters_dict` needs the same order as the 
     input to the distribution in stan.
+    Parameters can be arrays, which represents a distribution for each
+    element of the broadcasted parameters. pdf, cdf, ... then broadcast
+    the parameters against x.
     """
     def __init__(self,
             parameters_dict: Dict[str, Variable],
             name: str) -> None:
         self.name = name
         self.parameters_dict = parameters_dict
+        self._frozen_distribution = None
+        self.shape  # raises ValueError if the parameters do not broadcast
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        """ broadcasted shape of the parameters, () for scalar parameters """
+        try:
+            return np.broadcast(*[p.value for p in self.parameters_dict.values()]).shape
+        except ValueError:
+            raise ValueError(f'parameters of "{self.name}" have shapes that cannot be broadcasted: {[np.shape(p.value) for p in self.parameters_dict.values()]}.')
 
     def __str__(self) -> str:
         params = {name:param.value for name, param in 
@@ -35,34 +59,110 @@ class Distribution:
         """
         raise NotImplementedError
 
-    def _stan_code(self) -> Dict[str, str]:
-        #real is hard coded
+    @classmethod
+    def moment_match(cls, samples:np.ndarray, name:str) -> 'Distribution':
+        """
+        Distribution of this family matching the moments of samples, e.g.
+        to use a posterior as prior. Should be overridden by all subclasses.
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def _frozen(*parameters:np.ndarray) -> 'rv_frozen':
+        """
+        Frozen scipy distribution. Should be overridden by all subclasses.
+        Parameters can be arrays, which allows evaluating many parameter
+        sets in one broadcasted call.
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def _logpdf_grad(x:np.ndarray, *parameters:np.ndarray) -> Tuple[np.ndarray, ...]:
+        """
+        logpdf and its derivatives w.r.t. x and each parameter, i.e.
+        (logpdf, dx, dparameter1, dparameter2, ...). Should be overridden by
+        all subclasses.
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def _cdf_grad(x:np.ndarray, *parameters:np.ndarray) -> Tuple[np.ndarray, ...]:
+        """
+        cdf and its derivatives w.r.t. each parameter, i.e.
+        (cdf, dparameter1, dparameter2, ...). Should be overridden by all
+        subclasses.
+        """
+        raise NotImplementedError
+
+    def _stan_code(self,
+            priors_as_data:bool=False,
+            size:str=None
+        ) -> Dict[str, str]:
+        #real is hard coded, vector of length size if given
+        if self.shape != ():
+            raise ValueError(f'stan code needs scalar parameters, "{self.name}" has parameters of shape {self.shape}.')
 
         #parameter initialization
         lower, upper = self.domain()
-        parameter = f'real$ {self.name};'
-        l = f'lower={lower}' if lower > float('-inf') else ''
-        r = f'upper={upper}' if upper < float('inf') else ''
-        if l and r:
-            parameter = parameter.replace('$', f'<{l}, {r}>')
-        elif l or r:
-            parameter = parameter.replace('$', f'<{l if l else r}>')
+        if size is None:
+            parameter = f'real{_bounds(lower, upper)} {self.name};'
         else:
-            parameter = parameter.replace('$', '')
+            parameter = f'vector{_bounds(lower, upper)}[{size}] {self.name};'
 
         #prior
-        values = ", ".join([
-            str(param.value) for param in self.parameters_dict.values()
-            ])
+        if priors_as_data:
+            names = self.data_names()
+            values = ", ".join(names.values())
+            data = '\n    '.join([
+                f'real{_bounds(param.lower, param.upper)} {names[key]};'
+                for key, param in self.parameters_dict.items()
+                ])
+        else:
+            values = ", ".join([
+                str(param.value) for param in self.parameters_dict.values()
+                ])
         prior = f'{self.name} ~ {self.__class__.__name__.lower()}({values});'
 
-        return {'parameter':parameter, 'prior':prior}
+        code = {'parameter':parameter, 'prior':prior}
+        if priors_as_data:
+            code['data'] = data
+        return code
 
 
-    def code(self) -> Dict[str, str]:
-        return self._stan_code()
+    def code(self, priors_as_data:bool=False, size:str=None) -> Dict[str, str]:
+        """
+        Stan code snippets of the distribution used as prior.
+        If `priors_as_data` is True the values of the parameters are not
+        hard coded into the prior but declared as data (see `data_names`).
+        If `size` is given, the parameter is a vector of that size with
+        independent priors.
+        """
+        return self._stan_code(priors_as_data, size)
+
+    def data_names(self) -> Dict[str, str]:
+        """ names of the parameters if they are passed as stan data """
+        return {key: f'{self.name}_{key}' for key in self.parameters_dict}
+
+    def data(self) -> Dict[str, float]:
+        """ values of the parameters if they are passed as stan data """
+        names = self.data_names()
+        return {names[key]: param.value
+                for key, param in self.parameters_dict.items()}
+
 
+    @property
+    def _distribution(self) -> 'rv_frozen':
+        """
+        frozen scipy distribution, created on first evaluation s.t. scipy.stats
+        is not imported by model definitions alone
+        """
+        if self._frozen_distribution is None:
+            self._frozen_distribution = self._frozen(
+                    *[p.value for p in self.parameters_dict.values()])
+        return self._frozen_distribution
 
+    # x is broadcasted against the parameters, e.g. pass x[:, None] to
+    # evaluate all x for parameters of shape (K,)
     def pdf(self, x:List[float]) -> np.ndarray:
         return self._distribution.pdf(x)
 
@@ -91,9 +191,9 @@ class Normal(Distribution):
 
     Parameters
     ----------
-    mu : float
+    mu : float or array_like
         location of the normal
-    sigma : float
+    sigma : float or array_like
         standard deviation of the normal
     name : str
 
@@ -103,6 +203,8 @@ class Normal(Distribution):
     Normal(mu=0, sigma=1, name="mu")
     >>> Normal(0, 1, name='mu').code()
     {'parameter': 'real mu;', 'prior': 'mu ~ normal(0, 1);'}
+    >>> Normal([0., 1.], 1., name='x').cdf(0.)
+    array([0.5       , 0.15865525])
     """
     def __init__(self,
             mu: float,
@@ -111,13 +213,33 @@ class Normal(Distribution):
         self.mu = ContinuousVariable(mu, name='mu')
         self.sigma = PositiveContinuousVariable(sigma, name='sigma')
         self.name = name
-        self._distribution = norm(loc=self.mu.value, scale=self.sigma.value)
         parameters_dict = {'mu': self.mu, 'sigma': self.sigma}
         super().__init__(parameters_dict, self.name)
 
     def domain(self) -> Tuple[float, float]:
         return (float('-inf'), float('inf'))
 
+    @classmethod
+    def moment_match(cls, samples:np.ndarray, name:str) -> 'Normal':
+        return cls(float(np.mean(samples)), float(np.std(samples)), name=name)
+
+    @staticmethod
+    def _frozen(mu:np.ndarray, sigma:np.ndarray) -> 'rv_frozen':
+        from scipy.stats import norm
+        return norm(loc=mu, scale=sigma)
+
+    @staticmethod
+    def _logpdf_grad(x:np.ndarray, mu:np.ndarray, sigma:np.ndarray) -> Tuple[np.ndarray, ...]:
+        z = (x - mu) / sigma
+        logpdf = -0.5 * z**2 - np.log(sigma) - 0.5 * np.log(2. * np.pi)
+        return logpdf, -z / sigma, z / sigma, (z**2 - 1.) / sigma
+
+    @staticmethod
+    def _cdf_grad(x:np.ndarray, mu:np.ndarray, sigma:np.ndarray) -> Tuple[np.ndarray, ...]:
+        z = (x - mu) / sigma
+        pdf = np.exp(-0.5 * z**2) / np.sqrt(2. * np.pi)
+        return ndtr(z), -pdf / sigma, -pdf * z / sigma
+
 
 
 class Gamma(Distribution):
@@ -126,9 +248,9 @@ class Gamma(Distribution):
 
     Parameters
     ----------
-    alpha : float
+    alpha : float or array_like
         shape of the Gamma
-    beta : float
+    beta : float or array_like
         rate of the Gamma
     name : str
 
@@ -146,13 +268,39 @@ class Gamma(Distribution):
         self.alpha = PositiveContinuousVariable(alpha, name='alpha')
         self.beta = PositiveContinuousVariable(beta, name='beta')
         self.name = name
-        self._distribution = gamma(a=self.alpha.value, scale=1./self.beta.value)
         parameters_dict = {'alpha':self.alpha, 'beta':self.beta}
         super().__init__(parameters_dict, self.name)
 
     def domain(self) -> Tuple[float, float]:
         return (0, float('inf'))
 
+    @classmethod
+    def moment_match(cls, samples:np.ndarray, name:str) -> 'Gamma':
+        mean, var = np.mean(samples), np.var(samples)
+        return cls(float(mean**2 / var), float(mean / var), name=name)
+
+    @staticmethod
+    def _frozen(alpha:np.ndarray, beta:np.ndarray) -> 'rv_frozen':
+        from scipy.stats import gamma
+        return gamma(a=alpha, scale=1./beta)
+
+    @staticmethod
+    def _logpdf_grad(x:np.ndarray, alpha:np.ndarray, beta:np.ndarray) -> Tuple[np.ndarray, ...]:
+        logx, logbeta = np.log(x), np.log(beta)
+        logpdf = alpha * logbeta - gammaln(alpha) + (alpha - 1.) * logx - beta * x
+        dx = (alpha - 1.) / x - beta
+        dalpha = logbeta - digamma(alpha) + logx
+        return logpdf, dx, dalpha, alpha / beta - x
+
+    @staticmethod
+    def _cdf_grad(x:np.ndarray, alpha:np.ndarray, beta:np.ndarray) -> Tuple[np.ndarray, ...]:
+        cdf = gammainc(alpha, beta * x)
+        # no closed form w.r.t. the shape, central difference instead
+        h = 1e-6 * alpha
+        dalpha = (gammainc(alpha + h, beta * x) - gammainc(alpha - h, beta * x)) / (2. * h)
+        logpdf = alpha * np.log(beta) - gammaln(alpha) + (alpha - 1.) * np.log(x) - beta * x
+        return cdf, dalpha, x * np.exp(logpdf) / beta
+
 
 class Lognormal(Distribution):
     """
@@ -160,9 +308,9 @@ class Lognormal(Distribution):
 
     Parameters
     ----------
-    mu : float
+    mu : float or array_like
         log(rv) has loc mu
-    sigma : float
+    sigma : float or array_like
         log(rv) has scale sigma
     name : str
 
@@ -180,14 +328,36 @@ class Lognormal(Distribution):
         self.mu = ContinuousVariable(mu, name='mu')
         self.sigma = PositiveContinuousVariable(sigma, name='sigma')
         self.name = name
-        # for lognorm parameterization see scipy documentation
-        self._distribution = lognorm(s=self.sigma.value, scale=np.exp(self.mu.value))
         parameters_dict = {'mu':self.mu, 'sigma':self.sigma}
         super().__init__(parameters_dict, self.name)
 
     def domain(self) -> Tuple[float, float]:
         return (0, float('inf'))
 
+    @classmethod
+    def moment_match(cls, samples:np.ndarray, name:str) -> 'Lognormal':
+        log_samples = np.log(samples)
+        return cls(float(np.mean(log_samples)), float(np.std(log_samples)), name=name)
+
+    @staticmethod
+    def _frozen(mu:np.ndarray, sigma:np.ndarray) -> 'rv_frozen':
+        from scipy.stats import lognorm
+        # for lognorm parameterization see scipy documentation
+        return lognorm(s=sigma, scale=np.exp(mu))
+
+    @staticmethod
+    def _logpdf_grad(x:np.ndarray, mu:np.ndarray, sigma:np.ndarray) -> Tuple[np.ndarray, ...]:
+        logx = np.log(x)
+        z = (logx - mu) / sigma
+        logpdf = -logx - 0.5 * z**2 - np.log(sigma) - 0.5 * np.log(2. * np.pi)
+        return logpdf, -(1. + z / sigma) / x, z / sigma, (z**2 - 1.) / sigma
+
+    @staticmethod
+    def _cdf_grad(x:np.ndarray, mu:np.ndarray, sigma:np.ndarray) -> Tuple[np.ndarray, ...]:
+        z = (np.log(x) - mu) / sigma
+        pdf = np.exp(-0.5 * z**2) / np.sqrt(2. * np.pi)
+        return ndtr(z), -pdf / sigma, -pdf * z / sigma
+
 
 class Weibull(Distribution):
     """
@@ -195,9 +365,9 @@ class Weibull(Distribution):
 
     Parameters
     ----------
-    alpha : float
+    alpha : float or array_like
         shape of the weibull
-    sigma : float
+    sigma : float or array_like
         scale of the weibull - equivalent to 1/rate
     name : str
 
@@ -215,9 +385,37 @@ class Weibull(Distribution):
         self.alpha = PositiveContinuousVariable(alpha, name='alpha')
         self.sigma = PositiveContinuousVariable(sigma, name='sigma')
         self.name = name
-        self._distribution = weibull_min(c=self.alpha.value, scale=self.sigma.value)
         parameters_dict = {'alpha':self.alpha, 'sigma':self.sigma}
         super().__init__(parameters_dict, self.name)
 
     def domain(self) -> Tuple[float, float]:
         return (0, float('inf'))
+
+    @classmethod
+    def moment_match(cls, samples:np.ndarray, name:str) -> 'Weibull':
+        # log of a weibull is gumbel distributed with scale 1/alpha
+        log_samples = np.log(samples)
+        alpha = np.pi / (np.sqrt(6.) * np.std(log_samples))
+        sigma = np.exp(np.mean(log_samples) + np.euler_gamma / alpha)
+        return cls(float(alpha), float(sigma), name=name)
+
+    @staticmethod
+    def _frozen(alpha:np.ndarray, sigma:np.ndarray) -> 'rv_frozen':
+        from scipy.stats import weibull_min
+        return weibull_min(c=alpha, scale=sigma)
+
+    @staticmethod
+    def _logpdf_grad(x:np.ndarray, alpha:np.ndarray, sigma:np.ndarray) -> Tuple[np.ndarray, ...]:
+        logxs = np.log(x) - np.log(sigma)
+        t = np.exp(alpha * logxs)  # (x/sigma)**alpha
+        logpdf = np.log(alpha) - np.log(sigma) + (alpha - 1.) * logxs - t
+        dx = (alpha - 1. - alpha * t) / x
+        dalpha = 1. / alpha + logxs * (1. - t)
+        return logpdf, dx, dalpha, alpha * (t - 1.) / sigma
+
+    @staticmethod
+    def _cdf_grad(x:np.ndarray, alpha:np.ndarray, sigma:np.ndarray) -> Tuple[np.ndarray, ...]:
+        logxs = np.log(x) - np.log(sigma)
+        t = np.exp(alpha * logxs)
+        survival = np.exp(-t)
+        return -np.expm1(-t), survival * t * logxs, -survival * t * alpha / sigma
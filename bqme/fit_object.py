@@ -1,15 +1,27 @@
-from typing import Dict, List
+import json
+import warnings
+from pathlib import Path
+from typing import Dict, List, Tuple
 
 import numpy as np
 
+from bqme import instrumentation
+from bqme.predictive import PosteriorPredictive
+
 class FitObject:
     """
     Base class for the fit object
     """
+    __slots__ = ()
+    # attributes that are never model parameters, e.g. while unpickling
+    _reserved = ('model', 'stan_obj', 'opt', 'stats')
+
     def __getattr__(self, attr:str) -> np.ndarray:
         """
         allows to extract model parameters from fit object as attributes
         """
+        if attr.startswith('_') or attr in self._reserved:
+            raise AttributeError( f"Object '{self.__class__.__name__}' has no attribute '{attr}'")
         try:
             ret = self._access_parameter(attr)
         except self._catch_error_access_parameter:
@@ -17,10 +29,37 @@ class FitObject:
         return ret
 
     def _get_samples(self) -> np.ndarray:
-        names = self.model.parameters_dict.keys()
+        names = self.model.parameter_names
         # return shape (#parameters, #samples) - #samples is one for MAP
         return np.array([self._access_parameter(name) for name in names])
 
+    def _init_values(self, random_draw:bool=False) -> Dict[str, float]:
+        """
+        parameter values used to warm start another fit: the median of the
+        samples or, if random_draw, a random sample
+        """
+        samples = np.asarray(self._get_samples(), dtype=float)
+        samples = samples.reshape(len(samples), -1)
+        if random_draw:
+            values = samples[:, np.random.randint(samples.shape[1])]
+        else:
+            values = np.median(samples, axis=1)
+        return dict(zip(self.model.parameter_names, map(float, values)))
+
+    def posterior_predictive(self, table_size:int=1024) -> PosteriorPredictive:
+        """
+        Posterior predictive distribution, i.e. the mixture of the model
+        distribution over the posterior samples. Its ppf gives the quantiles
+        of the posterior predictive, unlike ppf(q, method='mean').
+        """
+        return PosteriorPredictive(self.model._distribution,
+                self._get_samples(), table_size=table_size,
+                weights=self._weights())
+
+    def _weights(self) -> np.ndarray or None:
+        """ normalized weights of the samples, None for equal weights """
+        return None
+
     def pdf(self, x:float or List[float], method:str='mean') -> np.ndarray:
         """
         Calculates the pdf of x using posterior samples or MAP estimate
@@ -37,7 +76,7 @@ class FitObject:
         -------
         ret : ndarray
         """
-        f = lambda dist, param, x: dist(*param, name='a').pdf(x)
+        f = lambda dist, param, x: dist._frozen(*param).pdf(x)
         return self._apply(f, x, method)
 
     def cdf(self, x:float or List[float], method:str='mean') -> np.ndarray:
@@ -56,7 +95,43 @@ class FitObject:
         -------
         ret : ndarray
         """
-        f = lambda dist, param, x: dist(*param, name='a').cdf(x)
+        f = lambda dist, param, x: dist._frozen(*param).cdf(x)
+        return self._apply(f, x, method)
+
+    def logpdf(self, x:float or List[float], method:str='mean') -> np.ndarray:
+        """
+        Calculates the log of the pdf of x using posterior samples or MAP estimate
+
+        Parameters
+        ----------
+        x : float or List[float]
+            points where the logpdf should be evaluated
+        method: str, default: 'mean'
+            see `pdf`. Note that 'mean' averages the log values.
+
+        Returns
+        -------
+        ret : ndarray
+        """
+        f = lambda dist, param, x: dist._frozen(*param).logpdf(x)
+        return self._apply(f, x, method)
+
+    def logcdf(self, x:float or List[float], method:str='mean') -> np.ndarray:
+        """
+        Calculates the log of the cdf of x using posterior samples or MAP estimate
+
+        Parameters
+        ----------
+        x : float or List[float]
+            points where the logcdf should be evaluated
+        method: str, default: 'mean'
+            see `cdf`. Note that 'mean' averages the log values.
+
+        Returns
+        -------
+        ret : ndarray
+        """
+        f = lambda dist, param, x: dist._frozen(*param).logcdf(x)
         return self._apply(f, x, method)
 
     def ppf(self, q:float or List[float], method:str='full') -> np.ndarray:
@@ -75,7 +150,7 @@ class FitObject:
         -------
         ret : ndarray
         """
-        f = lambda dist, param, q: dist(*param, name='a').ppf(q)
+        f = lambda dist, param, q: dist._frozen(*param).ppf(q)
         return self._apply(f, q, method)
 
 
@@ -84,42 +159,510 @@ class FitObjectSampling(FitObject):
     Fit object using posterior samples of the model.
     This is an extension of the 'StanFit4Model'-type by composition.
     """
+    __slots__ = ('model', 'stan_obj', '_samples', 'stats')
+    _catch_error_access_parameter = ValueError
+
     def __init__(self, model:'QM', stan_fit_object:'StanFit4Model') -> None:
         self.model = model
         self.stan_obj = stan_fit_object
-        self._catch_error_access_parameter = ValueError
+        self._samples = None
+        self.stats = instrumentation.Stats()  # see bqme.instrumentation
 
     def _access_parameter(self, attr:str) -> np.ndarray:
-        return self.stan_obj.extract(attr)[attr]
+        names = self.model.parameter_names
+        if attr in names:
+            return self._get_samples()[names.index(attr)]
+        return self._extract(attr)[attr]
+
+    def _extract(self, pars:str or List[str]) -> Dict[str, np.ndarray]:
+        start = instrumentation.start()
+        extracted = self.stan_obj.extract(pars)
+        instrumentation.stop(self.stats, 'extract', start, self, extract_calls=1)
+        return extracted
+
+    def _get_samples(self) -> np.ndarray:
+        """
+        posterior samples of the model parameters with shape
+        (#parameters, #samples). They are extracted from the stan fit once,
+        on first use, and are read-only afterwards.
+        """
+        if self._samples is None:
+            names = self.model.parameter_names
+            extracted = self._extract(names)
+            samples = np.ascontiguousarray([extracted[n] for n in names],
+                    dtype=float)
+            samples.flags.writeable = False
+            self._samples = samples
+        return self._samples
+
+    def _adaptation(self) -> Dict[str, object] or None:
+        """
+        stepsize and diagonal inverse metric adapted by stan, averaged over
+        the chains, and the number of chains. None if unknown.
+        """
+        if self.stan_obj is None:
+            return None
+        stepsize = self.stan_obj.get_stepsize()
+        return {
+            'stepsize': float(np.mean(stepsize)),
+            'inv_metric': np.mean(self.stan_obj.get_inv_metric(as_dict=False), axis=0),
+            'chains': len(stepsize),
+        }
+
+    def _last_positions(self) -> List[Dict[str, float]] or None:
+        """ last sample of each chain, used to continue the chains """
+        if self.stan_obj is None:
+            return None
+        names = self.model.parameter_names
+        return [{n: float(np.squeeze(pos[n])) for n in names}
+                for pos in self.stan_obj.get_last_position()]
+
+    def update(self,
+            N:int,
+            q:Tuple[float,...],
+            X:Tuple[float,...],
+            warmup:int=None,
+            draws:int=None,
+            carry_prior:bool=False,
+            **kwargs
+        ) -> 'FitObjectSampling':
+        """
+        Refits the model to a new quantile snapshot starting from this fit.
+        The chains start at their last positions (or at random samples of
+        this fit) and reuse the adapted stepsize and inverse metric, s.t.
+        little or no warmup is needed.
+
+        Parameters
+        ----------
+        N, q, X :
+            number of samples, observed quantile levels and quantile values
+            of the new snapshot
+        warmup : int, default: None
+            warmup iterations. None means no warmup if the adaptation of
+            this fit is known (without adaptation, as the adapted values
+            are used), otherwise stan's default. With warmup > 0 stan
+            adapts, starting from the values of this fit.
+        draws : int, default: None
+            samples per chain, default: as many as this fit
+        carry_prior : bool, default: False
+            if True the posterior of this fit, moment matched to the prior
+            families, is used as prior of the new fit (see
+            QM.posterior_as_prior). This assumes that the snapshots are
+            independent data.
+        kwargs :
+            passed to StanModel.sampling
+        """
+        adaptation = self._adaptation()
+        model = self.model.posterior_as_prior(self) if carry_prior else self.model
+        kwargs.setdefault('chains', adaptation['chains'] if adaptation else 4)
+        if draws is None:
+            draws = self._get_samples().shape[1] // kwargs['chains']
+        if adaptation is not None:
+            warmup = 0 if warmup is None else warmup
+            control = dict(kwargs.pop('control', None) or {})
+            control.setdefault('stepsize', adaptation['stepsize'])
+            control.setdefault('inv_metric', adaptation['inv_metric'])
+            if warmup == 0:
+                control.setdefault('adapt_engaged', False)
+            kwargs['control'] = control
+        if warmup is not None:
+            kwargs['warmup'] = warmup
+        # stan's default warmup is half of iter
+        kwargs.setdefault('iter', (draws if warmup is None else warmup) + draws)
+        init = self._last_positions()
+        if init is None or len(init) != kwargs['chains']:
+            init = self
+        return model.sampling(N, q, X, init=init, **kwargs)
+
+    def loo(self,
+            N:int=None,
+            q:Tuple[float,...]=None,
+            X:Tuple[float,...]=None,
+            r_eff:float=1.
+        ) -> 'LOO':
+        """
+        Leave-one-quantile-out cross-validation by PSIS-LOO (see bqme.loo)
+        without refits. Returns the elpd, the pointwise elpd, influence
+        (p_loo) and pareto k per quantile.
+
+        Parameters
+        ----------
+        N, q, X : default: None
+            data of the fit. If not given, the pointwise log likelihood
+            `log_lik` of the stan fit is used, otherwise it is computed with
+            numpy from the samples, e.g. for fits without stan fit.
+        r_eff : float, default: 1.
+            relative efficiency of the samples, see bqme.psis.psis
+        """
+        from bqme.loo import loo, pointwise_log_likelihood
+        if N is None:
+            if self.stan_obj is None:
+                raise ValueError(f'{self.__class__.__name__} has no stan fit, pass N, q and X.')
+            log_lik = self._extract('log_lik')['log_lik']
+        else:
+            log_lik = pointwise_log_likelihood(self.model, self._get_samples(), N, q, X)
+        weights = self._weights()
+        with np.errstate(divide='ignore'):
+            log_weights = None if weights is None else np.log(weights)
+        return loo(log_lik, log_weights, r_eff)
+
+    def reweight(self, model:'QM', r_eff:float=1.) -> 'FitObjectWeighted':
+        """
+        Posterior of `model`, which differs from the model of this fit only
+        in the values of the priors, by Pareto smoothed importance sampling
+        (see bqme.psis) of the samples of this fit. The importance weights
+        are the ratios of the new and the old prior densities. Warns if the
+        pareto k of the weights indicates that `model` should be refitted.
+
+        Parameters
+        ----------
+        model : QM
+            model of the same class with other prior values
+        r_eff : float, default: 1.
+            relative efficiency of the samples, see bqme.psis.psis
+        """
+        from bqme.psis import psis, k_threshold
+        old = self.model
+        if model.__class__ is not old.__class__ or \
+                [p.__class__ for p in model.parameters_dict.values()] != \
+                [p.__class__ for p in old.parameters_dict.values()]:
+            raise ValueError(f'{model} differs from {old} in more than the prior values.')
+        samples = self._get_samples()
+        log_weights = np.zeros(samples.shape[1])
+        if self._weights() is not None:
+            log_weights = np.log(self._weights())
+        for sample, new_prior, old_prior in zip(samples,
+                model.parameters_dict.values(), old.parameters_dict.values()):
+            log_weights += new_prior.logpdf(sample) - old_prior.logpdf(sample)
+        log_weights, k = psis(log_weights, r_eff)
+        if k > k_threshold(len(log_weights)):
+            warnings.warn(f'pareto k of the importance weights is {k:.2f}, the reweighted fit is unreliable, refit the model instead.', RuntimeWarning)
+        return FitObjectWeighted(model, samples, np.exp(log_weights), k)
+
+    def detach(self, dtype:np.dtype=np.float64, thin:int=1) -> 'FitObjectDraws':
+        """
+        Compact copy of the fit without the stan fit: only the samples of
+        the model parameters are kept in one contiguous array.
+
+        Parameters
+        ----------
+        dtype : np.dtype, default: np.float64
+            e.g. np.float32 to halve the memory
+        thin : int, default: 1
+            keep every thin-th sample
+        """
+        samples = np.array(self._get_samples()[:, ::thin], dtype=dtype, order='C')
+        return FitObjectDraws(self.model, samples, self._adaptation())
+
+    def save(self, path:str or Path, compressed:bool=False) -> None:
+        """ saves the samples of the model parameters, see `save_fits` """
+        save_fits(path, [self], compressed)
 
     def _apply(self,
             f:'function',
             x:float or List[float],
             method: str
         ) -> np.ndarray:
-        """applys pdf, cdf, ... for each sample to x"""
-        posterior_samples = self._get_samples().T
+        """
+        applys pdf, cdf, ... for all samples to x in one broadcasted call,
+        returns shape (#samples, #x) before the reduction
+        """
+        # (#parameters, #samples, 1) broadcasted against x of shape (1, #x)
+        posterior_samples = self._get_samples()[:, :, None]
         dist = self.model._distribution
-        l = 1 if (type(x)==float or type(x)==int) else len(x)
-        ret = np.zeros((posterior_samples.shape[0], l))
-        for i, sample in enumerate(posterior_samples):
-            ret[i] = f(dist, sample, x)
+        start = instrumentation.start()
+        ret = f(dist, posterior_samples, np.reshape(x, (1, -1)))
+        instrumentation.stop(self.stats, 'evaluate', start, self,
+                evaluations=ret.size)
+        weights = self._weights()
         if method == 'mean':
-            ret = np.mean(ret, axis=0)
+            ret = np.average(ret, axis=0, weights=weights)
         elif method == 'median':
-            ret = np.median(ret, axis=0)
+            ret = np.median(ret, axis=0) if weights is None \
+                    else _weighted_median(ret, weights)
+        elif weights is not None:
+            # full matrix of equally weighted rows, resampled by the weights
+            ret = ret[_resample(weights)]
         #else return full matrix
         return ret.squeeze()
 
 
+class FitObjectSamplingStacked(FitObjectSampling):
+    """
+    Fit object of dataset `index` of a stacked stan fit (see
+    QM.sampling_stacked). Parameters of the stacked fit have shape
+    (#samples, K) and are restricted to column index, U to the entries of
+    the dataset.
+    """
+    __slots__ = ('index', 'entries')
+
+    def __init__(self,
+            model:'QM',
+            stan_fit_object:'StanFit4Model',
+            index:int,
+            entries:slice,
+            samples:np.ndarray=None
+        ) -> None:
+        super().__init__(model, stan_fit_object)
+        self.index = index
+        self.entries = entries
+        if samples is not None:
+            samples = np.ascontiguousarray(samples, dtype=float)
+            samples.flags.writeable = False
+            self._samples = samples
+
+    def _access_parameter(self, attr:str) -> np.ndarray:
+        names = self.model.parameter_names
+        if attr in names:
+            return self._get_samples()[names.index(attr)]
+        value = self._extract(attr)[attr]
+        return value[:, self.entries] if attr == 'U' else value[:, self.index]
+
+    # adaptation and positions of a stacked fit belong to all datasets
+    def _adaptation(self) -> None:
+        return None
+
+    def _last_positions(self) -> None:
+        return None
+
+    def _get_samples(self) -> np.ndarray:
+        if self._samples is None:
+            names = self.model.parameter_names
+            extracted = self._extract(names)
+            self._samples = np.ascontiguousarray(
+                    [extracted[n][:, self.index] for n in names], dtype=float)
+            self._samples.flags.writeable = False
+        return self._samples
+
+
+class FitObjectDraws(FitObjectSampling):
+    """
+    Fit object of posterior samples without a stan fit, e.g. a detached
+    fit (see FitObjectSampling.detach) or a fit loaded from disk (see
+    load_fits). It has the API of FitObjectSampling.
+
+    Parameters
+    ----------
+    model : QM
+    samples : ndarray
+        samples of the model parameters with shape (#parameters, #samples).
+        Float32 and memory-mapped arrays are kept as they are.
+    adaptation : dict, default: None
+        stepsize and inverse metric of the original stan fit, used by
+        `update`
+    """
+    __slots__ = ('adaptation',)
+    _catch_error_access_parameter = KeyError
+
+    def __init__(self,
+            model:'QM',
+            samples:np.ndarray,
+            adaptation:Dict[str, object]=None
+        ) -> None:
+        super().__init__(model, None)
+        self.adaptation = adaptation
+        samples = np.asarray(samples)
+        if samples.dtype not in (np.float32, np.float64):
+            samples = samples.astype(float)
+        if samples.flags.writeable:
+            samples = samples.view()  # read-only view, the input stays writeable
+            samples.flags.writeable = False
+        self._samples = samples
+
+    def _access_parameter(self, attr:str) -> np.ndarray:
+        names = self.model.parameter_names
+        if attr not in names:
+            raise KeyError(attr)
+        return self._samples[names.index(attr)]
+
+    def _adaptation(self) -> Dict[str, object] or None:
+        return self.adaptation
+
+
+class FitObjectAdaptive(FitObjectDraws):
+    """
+    Fit object of the adaptive mode of QM.sampling, which samples in chunks
+    until convergence. It has the API of FitObjectSampling, the samples of
+    all chunks are kept without the stan fits.
+
+    Parameters
+    ----------
+    model : QM
+    samples : ndarray
+        samples of the model parameters with shape (#parameters, #samples),
+        chain after chain
+    adaptation : dict
+        stepsize and inverse metric of the chains
+    convergence : dict
+        'rhat', 'ess_bulk' and 'ess_tail' per parameter, 'converged',
+        'stopped' ('converged', 'iter' or 'time_budget'), 'draws' and
+        'iterations' per chain and 'seconds'
+    """
+    __slots__ = ('convergence',)
+
+    def __init__(self,
+            model:'QM',
+            samples:np.ndarray,
+            adaptation:Dict[str, object],
+            convergence:Dict[str, object]
+        ) -> None:
+        super().__init__(model, np.ascontiguousarray(samples, dtype=float), adaptation)
+        self.convergence = convergence
+
+
+class FitObjectVariational(FitObjectDraws):
+    """
+    Fit object using samples of the variational approximation of the
+    posterior (see QM.variational). It has the API of FitObjectSampling,
+    but no stan fit.
+
+    Parameters
+    ----------
+    model : QM
+    samples : ndarray
+        samples of the model parameters with shape (#parameters, #samples)
+    algorithm : str
+        'meanfield' or 'fullrank'
+    elbo_iterations : ndarray
+        iterations at which the ELBO was evaluated
+    elbo : ndarray
+        ELBO at these iterations
+    converged : bool
+        True if the relative change of the ELBO fell below the tolerance
+        before the maximum number of iterations
+    """
+    __slots__ = ('algorithm', 'elbo_iterations', 'elbo', 'converged')
+
+    def __init__(self,
+            model:'QM',
+            samples:np.ndarray,
+            algorithm:str,
+            elbo_iterations:np.ndarray,
+            elbo:np.ndarray,
+            converged:bool
+        ) -> None:
+        super().__init__(model, np.ascontiguousarray(samples, dtype=float))
+        self.algorithm = algorithm
+        self.elbo_iterations = elbo_iterations
+        self.elbo = elbo
+        self.converged = converged
+
+
+class FitObjectWeighted(FitObjectDraws):
+    """
+    Fit object of weighted posterior samples, e.g. of an importance
+    reweighted fit (see FitObjectSampling.reweight). It has the API of
+    FitObjectSampling, pdf, cdf, ... take the weights into account. The
+    model parameters as attributes (e.g. fit.mu) are the unweighted
+    samples, their weights are `weights`.
+
+    Parameters
+    ----------
+    model : QM
+    samples : ndarray
+        samples of the model parameters with shape (#parameters, #samples)
+    weights : ndarray
+        weights of the samples, normalized to sum to one
+    pareto_k : float
+        pareto k diagnostic of the weights, see bqme.psis
+    """
+    __slots__ = ('weights', 'pareto_k')
+
+    def __init__(self,
+            model:'QM',
+            samples:np.ndarray,
+            weights:np.ndarray,
+            pareto_k:float=None
+        ) -> None:
+        super().__init__(model, samples)
+        self.weights = np.asarray(weights, dtype=float) / np.sum(weights)
+        self.pareto_k = pareto_k
+
+    def _weights(self) -> np.ndarray:
+        return self.weights
+
+    def _init_values(self, random_draw:bool=False) -> Dict[str, float]:
+        samples = np.asarray(self._get_samples(), dtype=float)
+        if random_draw:
+            values = samples[:, np.random.choice(len(self.weights), p=self.weights)]
+        else:
+            values = _weighted_median(samples.T, self.weights)
+        return dict(zip(self.model.parameter_names, map(float, values)))
+
+    def detach(self, dtype:np.dtype=np.float64, thin:int=1) -> 'FitObjectDraws':
+        """ equally weighted fit object of samples resampled by the weights """
+        samples = self._get_samples()[:, _resample(self.weights)]
+        return FitObjectDraws(self.model,
+                np.array(samples[:, ::thin], dtype=dtype, order='C'))
+
+    def effective_sample_size(self) -> float:
+        """ effective sample size of the weights, 1 / sum(weights**2) """
+        return float(1. / np.sum(self.weights**2))
+
+
+def _weighted_median(a:np.ndarray, weights:np.ndarray) -> np.ndarray:
+    """ weighted median along the first axis """
+    order = np.argsort(a, axis=0)
+    cumulative = np.cumsum(weights[order], axis=0)
+    index = np.argmax(cumulative >= 0.5, axis=0)
+    return np.take_along_axis(a, order, axis=0)[index, np.arange(a.shape[1])] \
+            if a.ndim > 1 else a[order][index]
+
+def _resample(weights:np.ndarray) -> np.ndarray:
+    """
+    indices of len(weights) samples drawn by their weights, systematic
+    resampling (stratified with a single uniform)
+    """
+    n = len(weights)
+    positions = (np.random.uniform() + np.arange(n)) / n
+    cumulative = np.cumsum(weights)
+    cumulative[-1] = 1.
+    return np.searchsorted(cumulative, positions)
+
+
+class FitObjectLaplace(FitObjectDraws):
+    """
+    Fit object using samples of the Laplace approximation of the posterior
+    (see QM.laplace). It has the API of FitObjectSampling, but no stan fit.
+
+    Parameters
+    ----------
+    model : QM
+    samples : ndarray
+        samples of the model parameters with shape (#parameters, #samples)
+    mode : ndarray
+        mode of the posterior in unconstrained space
+    covariance : ndarray
+        covariance of the gaussian approximation in unconstrained space
+    log_evidence : float
+        Laplace approximation of the log marginal likelihood
+    """
+    __slots__ = ('mode', 'covariance', 'log_evidence')
+
+    def __init__(self,
+            model:'QM',
+            samples:np.ndarray,
+            mode:np.ndarray,
+            covariance:np.ndarray,
+            log_evidence:float
+        ) -> None:
+        super().__init__(model, np.ascontiguousarray(samples, dtype=float))
+        self.mode = mode
+        self.covariance = covariance
+        self.log_evidence = log_evidence
+
+
 class FitObjectOptimizing(FitObject):
     """
     Fit object using MAP estimate of the model
     """
+    __slots__ = ('model', 'opt', 'stats')
+    _catch_error_access_parameter = KeyError
+
     def __init__(self, model:'QM', opt_parameters:Dict) -> None:
         self.model = model
         self.opt = opt_parameters
-        self._catch_error_access_parameter = KeyError
+        self.stats = instrumentation.Stats()  # see bqme.instrumentation
 
     def _access_parameter(self, attr:str) -> np.ndarray:
         return self.opt[attr]
@@ -132,5 +675,83 @@ class FitObjectOptimizing(FitObject):
         """applys pdf, cdf, ... to x"""
         map_estimate = self._get_samples()
         dist = self.model._distribution
-        l = 1 if (type(x)==float or type(x)==int) else len(x)
-        return f(dist, map_estimate, x)
+        start = instrumentation.start()
+        ret = f(dist, map_estimate, x)
+        instrumentation.stop(self.stats, 'evaluate', start, self,
+                evaluations=np.size(ret))
+        return ret
+
+
+def _model_spec(model:'QM') -> Dict:
+    """ json serializable description of a model, see _model_from_spec """
+    priors = []
+    for p in model.parameters_dict.values():
+        values = {k: v.value if isinstance(v.value, (int, float)) else float(v.value)
+                for k, v in p.parameters_dict.items()}
+        priors.append({'distribution': p.__class__.__name__,
+                'parameters': values, 'name': p.name})
+    return {'model': model.__class__.__name__, 'priors': priors,
+            'priors_as_data': model.priors_as_data}
+
+def _model_from_spec(spec:Dict) -> 'QM':
+    from bqme import distributions, models
+    priors = [getattr(distributions, p['distribution'])(**p['parameters'], name=p['name'])
+            for p in spec['priors']]
+    return getattr(models, spec['model'])(*priors, priors_as_data=spec['priors_as_data'])
+
+def save_fits(path:str or Path,
+        fits:List[FitObjectSampling],
+        compressed:bool=False
+    ) -> None:
+    """
+    Saves the samples of the model parameters of fits of the same model
+    with the same number of samples as one array of shape
+    (#fits, #parameters, #samples) and the description of the model.
+
+    A path ending in '.npz' writes a single npz file, compressed if
+    compressed is True. Otherwise the samples are written to path.npy and
+    the description to path.json, which allows to open the samples
+    memory-mapped (see `load_fits`). Weighted fits are saved as samples
+    resampled by their weights.
+    """
+    path = Path(path)
+    if compressed and path.suffix != '.npz':
+        raise ValueError('only npz files can be compressed.')
+    model = fits[0].model
+    samples = np.stack([(fit.detach() if fit._weights() is not None else fit)._get_samples()
+            for fit in fits])
+    meta = json.dumps({'format': 1, 'model': _model_spec(model),
+            'parameter_names': model.parameter_names})
+    if path.suffix == '.npz':
+        savez = np.savez_compressed if compressed else np.savez
+        savez(path, samples=samples, meta=np.array(meta))
+    else:
+        np.save(path.with_suffix('.npy'), samples)
+        path.with_suffix('.json').write_text(meta)
+
+def load_fits(path:str or Path,
+        model:'QM'=None,
+        mmap_mode:str=None
+    ) -> List[FitObjectDraws]:
+    """
+    Loads fits saved by `save_fits`. If model is None, it is rebuilt from
+    the saved description. With mmap_mode='r' (npy format only) the
+    samples are not read into memory, every fit is a view into the
+    memory-mapped file.
+    """
+    path = Path(path)
+    if path.suffix == '.npz':
+        with np.load(path) as f:
+            samples, meta = f['samples'], json.loads(str(f['meta']))
+    else:
+        samples = np.load(path.with_suffix('.npy'), mmap_mode=mmap_mode)
+        meta = json.loads(path.with_suffix('.json').read_text())
+    if model is None:
+        model = _model_from_spec(meta['model'])
+    if model.parameter_names != meta['parameter_names']:
+        raise ValueError(f'parameters of the model {model.parameter_names} do not match the saved parameters {meta["parameter_names"]}.')
+    return [FitObjectDraws(model, s) for s in samples]
+
+def load_fit(path:str or Path, model:'QM'=None, mmap_mode:str=None) -> FitObjectDraws:
+    """ loads a single fit saved by FitObjectSampling.save """
+    return load_fits(path, model, mmap_mode)[0]
@@ -0,0 +1,147 @@
+"""
+Deterministic grid approximation of the posterior of a QM model. The log
+posterior of the order statistics (see bqme.orderstatistics) is evaluated
+on a grid in unconstrained parameter space, all points of a refinement step
+in one vectorized call. Needs no stan compilation.
+"""
+from itertools import product
+from typing import Dict, Tuple
+
+import numpy as np
+
+from bqme.orderstatistics import OrderStatistics, constrain
+
+
+class GridPosterior:
+    """
+    Posterior on the cells of an adaptively refined grid in unconstrained
+    space. The posterior density is taken as constant in each cell.
+
+    Parameters
+    ----------
+    model : QM
+    z : ndarray
+        cell centers in unconstrained space, shape (#parameters, #cells)
+    half_width : ndarray
+        half widths of the cells, shape (#parameters, #cells)
+    log_density : ndarray
+        unnormalized log posterior density in unconstrained space at the
+        cell centers, shape (#cells,)
+    """
+    def __init__(self,
+            model:'QM',
+            z:np.ndarray,
+            half_width:np.ndarray,
+            log_density:np.ndarray
+        ) -> None:
+        self.model = model
+        self.z = z
+        self.half_width = half_width
+        self.log_density = log_density
+        log_mass = log_density + np.sum(np.log(2. * half_width), axis=0)
+        top = np.max(log_mass)
+        mass = np.exp(log_mass - top)
+        # log of the integral over the grid of likelihood times prior
+        self.log_evidence = float(top + np.log(np.sum(mass)))
+        self.weights = mass / np.sum(mass)
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({self.model}, cells={len(self.weights)})'
+
+    def _constrain(self, z:np.ndarray) -> np.ndarray:
+        priors = self.model.parameters_dict.values()
+        return np.array([constrain(zi, *p.domain())[0] for zi, p in zip(z, priors)])
+
+    @property
+    def theta(self) -> np.ndarray:
+        """ cell centers as model parameters, shape (#parameters, #cells) """
+        return self._constrain(self.z)
+
+    def mean(self) -> Dict[str, float]:
+        """ posterior mean of the model parameters """
+        return dict(zip(self.model.parameter_names,
+                map(float, self.theta @ self.weights)))
+
+    def sample(self, draws:int=1000) -> np.ndarray:
+        """
+        samples of the model parameters with shape (#parameters, draws):
+        cells drawn by their mass, uniform within the cell
+        """
+        index = np.random.choice(len(self.weights), size=draws, p=self.weights)
+        u = np.random.uniform(-1., 1., size=(len(self.z), draws))
+        z = self.z[:, index] + u * self.half_width[:, index]
+        return self._constrain(z)
+
+    def fit(self, draws:int=1000) -> 'FitObjectDraws':
+        """ fit object of `sample(draws)` with the API of FitObjectSampling """
+        from bqme.fit_object import FitObjectDraws
+        return FitObjectDraws(self.model, np.ascontiguousarray(self.sample(draws)))
+
+
+def _cells(lower:np.ndarray, upper:np.ndarray, size:int) -> Tuple[np.ndarray, np.ndarray]:
+    """ centers and half widths of a regular grid of size^P cells """
+    h = (upper - lower) / (2. * size)
+    axes = [np.linspace(lo + hi_, up - hi_, size) for lo, up, hi_ in zip(lower, upper, h)]
+    z = np.array([a.ravel() for a in np.meshgrid(*axes, indexing='ij')])
+    return z, np.repeat(h[:, None], z.shape[1], axis=1)
+
+def _log_density(os:OrderStatistics, z:np.ndarray) -> np.ndarray:
+    """ log posterior (with jacobian) at z of shape (#parameters, n) """
+    with np.errstate(all='ignore'):
+        lp = os.log_posterior(z[:, None, :], jacobian=True)[0]
+    return np.where(np.isfinite(lp), lp, -np.inf)
+
+def grid_posterior(model:'QM',
+        N:int,
+        q:Tuple[float,...],
+        X:Tuple[float,...],
+        z_mode:np.ndarray,
+        scale:np.ndarray,
+        size:int=32,
+        refine:int=3,
+        width:float=6.,
+        tol:float=1e-6,
+        max_expand:int=5
+    ) -> GridPosterior:
+    """
+    Grid approximation of the posterior, see QM.grid.
+
+    The initial grid of size^P cells spans z_mode +- width * scale. While
+    the density at a border of the grid exceeds tol times its maximum, the
+    grid is extended on that side by half its width. Then, `refine` times,
+    every cell holding more than the average mass of the initial grid is
+    split into 2^P cells.
+    """
+    os = OrderStatistics(model, [(N, q, X)])
+    P = len(z_mode)
+    lower, upper = z_mode - width * scale, z_mode + width * scale
+    for _ in range(max_expand + 1):
+        z, h = _cells(lower, upper, size)
+        lp = _log_density(os, z)
+        relative = np.exp(lp - np.max(lp)).reshape((size,) * P)
+        extend = False
+        for j in range(P):
+            edges = np.moveaxis(relative, j, 0)
+            step = 0.5 * (upper[j] - lower[j])
+            if np.max(edges[0]) > tol:
+                lower[j] -= step
+                extend = True
+            if np.max(edges[-1]) > tol:
+                upper[j] += step
+                extend = True
+        if not extend:
+            break
+    offsets = np.array(list(product([-0.5, 0.5], repeat=P))).T
+    threshold = 1. / size**P
+    for _ in range(refine):
+        mass = np.exp(lp - np.max(lp) + np.sum(np.log(2. * h), axis=0))
+        split = mass / np.sum(mass) > threshold
+        if not split.any():
+            break
+        # 2^P children of each split cell, evaluated in one call
+        z_new = (z[:, split, None] + offsets[:, None, :] * h[:, split, None]).reshape(P, -1)
+        h_new = np.repeat(0.5 * h[:, split], 2**P, axis=1)
+        z = np.concatenate([z[:, ~split], z_new], axis=1)
+        h = np.concatenate([h[:, ~split], h_new], axis=1)
+        lp = np.concatenate([lp[~split], _log_density(os, z_new)])
+    return GridPosterior(model, z, h, lp)
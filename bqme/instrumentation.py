@@ -0,0 +1,110 @@
+"""
+Opt-in timings and counters of the stages of a fit.
+
+Models and fit objects carry a `stats` attribute (see `Stats`), which
+accumulates the wall time per stage and counters such as gradient
+evaluations or extract calls, while instrumentation is enabled. Every
+recorded stage is also passed as an `Event` to the registered callbacks,
+e.g. to export them to a metrics system.
+
+Stages recorded on the model: 'render' (stan code from the template),
+'compile' (including loading from the cache) and 'grid' (see QM.grid).
+Stages recorded on the fit objects: 'sampling', 'optimizing', 'laplace',
+'variational', 'extract' and 'evaluate' (pdf, cdf, ...).
+
+Examples
+--------
+>>> from bqme import instrumentation
+>>> from bqme.distributions import Normal, Gamma
+>>> from bqme.models import NormalQM
+>>> events = []
+>>> instrumentation.register(events.append)
+>>> instrumentation.enable()
+>>> model = NormalQM(Normal(0., 1., name='mu'), Gamma(1., 1., name='sigma'))
+>>> code = model.code
+>>> [event.stage for event in events]
+['render']
+>>> list(model.stats.timings)
+['render']
+>>> instrumentation.disable()
+>>> instrumentation.unregister(events.append)
+
+Instrumentation is disabled by default. Disabled, the instrumented code
+paths only check a module flag and neither time nor count anything.
+"""
+import time
+from typing import Callable, Dict, List, NamedTuple
+
+_enabled = False
+_callbacks: List[Callable[['Event'], None]] = []
+
+
+class Event(NamedTuple):
+    """ a recorded stage, passed to the callbacks """
+    stage: str
+    seconds: float
+    counters: Dict[str, int]
+    source: object  # model or fit object the stage was recorded on
+
+
+class Stats:
+    """ accumulated timings (seconds per stage) and counters """
+    def __init__(self) -> None:
+        self.timings: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(timings={self.timings}, counters={self.counters})'
+
+    def record(self, stage:str, seconds:float, source:object=None, **counters:int) -> None:
+        self.timings[stage] = self.timings.get(stage, 0.) + seconds
+        for name, value in counters.items():
+            self.counters[name] = self.counters.get(name, 0) + value
+        event = Event(stage, seconds, counters, source)
+        for callback in list(_callbacks):
+            callback(event)
+
+
+def enable() -> None:
+    global _enabled
+    _enabled = True
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+
+def is_enabled() -> bool:
+    return _enabled
+
+def register(callback:Callable[[Event], None]) -> None:
+    """ callback is called with an Event for every recorded stage """
+    _callbacks.append(callback)
+
+def unregister(callback:Callable[[Event], None]) -> None:
+    _callbacks.remove(callback)
+
+
+def start() -> float or None:
+    """ start time of a stage, None if instrumentation is disabled """
+    return time.perf_counter() if _enabled else None
+
+def stop(stats:Stats, stage:str, start:float or None, source:object=None,
+        **counters:int) -> None:
+    """ records the stage started at `start`, no-op if start is None """
+    if start is None:
+        return
+    stats.record(stage, time.perf_counter() - start, source, **counters)
+
+
+def sampler_counters(stan_fit:'StanFit4Model') -> Dict[str, int]:
+    """ gradient evaluations, divergences and draws of a NUTS fit """
+    full = stan_fit.get_sampler_params(inc_warmup=True)
+    post = stan_fit.get_sampler_params(inc_warmup=False)
+    grads = sum(int(sum(c['n_leapfrog__'])) for c in full)
+    grads_post = sum(int(sum(c['n_leapfrog__'])) for c in post)
+    return {
+        'gradient_evaluations': grads,
+        'warmup_gradient_evaluations': grads - grads_post,
+        'divergences': sum(int(sum(c['divergent__'])) for c in post),
+        'draws': sum(len(c['divergent__']) for c in post),
+    }
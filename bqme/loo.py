@@ -0,0 +1,106 @@
+"""
+Leave-one-quantile-out cross-validation from a single fit by Pareto
+smoothed importance sampling (PSIS-LOO), see bqme.psis.
+
+The order-statistics likelihood does not factorize over the quantiles. The
+pointwise log likelihood of quantile m is the conditional density of X[m]
+given the other quantiles, log p(X | theta) - log p(X without m | theta),
+which the stan template emits as `log_lik` in the generated quantities.
+"""
+import warnings
+from typing import NamedTuple, Tuple
+
+import numpy as np
+from scipy.special import gammaln, logsumexp
+
+from bqme.psis import psis, k_threshold
+
+
+class LOO(NamedTuple):
+    """ result of `loo`, pointwise values per quantile """
+    elpd: float  # expected log pointwise predictive density, sum over quantiles
+    se: float  # standard error of elpd
+    p_loo: float  # effective number of parameters
+    elpd_pointwise: np.ndarray  # log p(X[m] | X without m)
+    p_loo_pointwise: np.ndarray  # influence of each quantile on the fit
+    pareto_k: np.ndarray  # reliability of elpd_pointwise, see bqme.psis
+
+
+def pointwise_log_likelihood(model:'QM',
+        samples:np.ndarray,
+        N:int,
+        q:Tuple[float,...],
+        X:Tuple[float,...]
+    ) -> np.ndarray:
+    """
+    log p(X[m] | X without m, theta) for the samples of the model
+    parameters with shape (#parameters, #samples), shape (#samples, M).
+    Numpy counterpart of `log_lik` of the stan template, e.g. for fits
+    without stan fit.
+
+    Only the terms next to quantile m differ between the log likelihood with
+    and without it: the spacings U[m]-U[m-1] and U[m+1]-U[m] merge into
+    U[m+1]-U[m-1], with U[0] = 0 and U[M+1] = 1.
+    """
+    samples = np.asarray(samples, dtype=float)
+    X = np.asarray(X, dtype=float)[:, None]
+    dist = model._distribution._frozen(*samples[:, None, :])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        U = dist.cdf(X)
+        lpdf = dist.logpdf(X)
+        U = np.concatenate([np.zeros((1, U.shape[1])), U, np.ones((1, U.shape[1]))])
+        log_D = np.log(U[1:] - U[:-1])
+        log_D_merged = np.log(U[2:] - U[:-2])
+    # Nq[m]-Nq[m-1] with Nq[0] = 0 and Nq[M+1] = N+1
+    gap = np.diff(np.concatenate([[0.], N * np.asarray(q, dtype=float), [N + 1.]]))
+    a, b = gap[:-1, None], gap[1:, None]
+    lconst = gammaln(a + b) - gammaln(a) - gammaln(b)
+    ll = lconst + (a - 1.) * log_D[:-1] + (b - 1.) * log_D[1:] \
+            - (a + b - 1.) * log_D_merged + lpdf
+    return ll.T
+
+def loo(log_lik:np.ndarray, log_weights:np.ndarray=None, r_eff:float=1.) -> LOO:
+    """
+    PSIS-LOO of the pointwise log likelihood with shape (#samples, M).
+    Warns if the pareto k of a quantile indicates that its elpd is
+    unreliable.
+
+    Parameters
+    ----------
+    log_lik : ndarray
+        pointwise log likelihood, shape (#samples, M)
+    log_weights : ndarray, default: None
+        log weights of the posterior samples, e.g. of a reweighted fit.
+        None means equal weights.
+    r_eff : float, default: 1.
+        relative efficiency of the samples, see bqme.psis.psis
+
+    Examples
+    --------
+    >>> log_lik = np.random.RandomState(0).normal(-1., 0.1, size=(1000, 3))
+    >>> result = loo(log_lik)
+    >>> result.elpd_pointwise.shape
+    (3,)
+    >>> bool(np.all(result.pareto_k < 0.7))
+    True
+    """
+    log_lik = np.asarray(log_lik, dtype=float)
+    S = len(log_lik)
+    if log_weights is None:
+        log_weights = np.full(S, -np.log(S))
+    log_weights = log_weights - logsumexp(log_weights)
+    lppd = logsumexp(log_weights[:, None] + log_lik, axis=0)
+    # importance ratios of the posterior without quantile m
+    smoothed, k = psis(log_weights[:, None] - log_lik, r_eff)
+    elpd = logsumexp(smoothed + log_lik, axis=0)
+    if np.any(k > k_threshold(S)):
+        bad = np.flatnonzero(k > k_threshold(S)).tolist()
+        warnings.warn(f'pareto k of the quantiles {bad} is too large, their loo estimates are unreliable.', RuntimeWarning)
+    return LOO(
+        elpd=float(np.sum(elpd)),
+        se=float(np.sqrt(len(elpd) * np.var(elpd))),
+        p_loo=float(np.sum(lppd - elpd)),
+        elpd_pointwise=elpd,
+        p_loo_pointwise=lppd - elpd,
+        pareto_k=k,
+    )
@@ -1,14 +1,98 @@
 import multiprocessing
-from typing import Dict, Tuple
+import time
+from itertools import count, islice
+from pathlib import Path
+from typing import Dict, List, Tuple, Iterable, Iterator
 
-from pystan import StanModel
+import numpy as np
+from scipy.special import ndtri
 
-from bqme._settings import STAN_TEMPLATE_PATH
+from bqme import diagnostics, instrumentation
+from bqme._settings import STAN_TEMPLATE_PATH, STAN_TEMPLATE_STACKED_PATH
+from bqme.cache import ModelCache, default_cache
 from bqme.distributions import Distribution, Normal, Gamma, Lognormal, Weibull
-from bqme.fit_object import FitObjectSampling, FitObjectOptimizing
+from bqme.fit_object import FitObject, FitObjectSampling, FitObjectOptimizing
+from bqme.fit_object import FitObjectSamplingStacked, FitObjectLaplace
+from bqme.fit_object import FitObjectAdaptive, FitObjectVariational
+from bqme.orderstatistics import OrderStatistics, BATCH_SIZE
+from bqme.orderstatistics import constrain, unconstrain
 
 
-multiprocessing.set_start_method("fork") #mac has diffrerent default
+Dataset = Tuple[int, Tuple[float,...], Tuple[float,...]]
+
+def _set_start_method() -> None:
+    """
+    pystan runs the chains in a multiprocessing pool, which needs fork (mac
+    has a different default). Only set if no start method has been chosen
+    yet, e.g. by the host application.
+    """
+    if multiprocessing.get_start_method(allow_none=True) is None:
+        multiprocessing.set_start_method('fork')
+
+# model used by the forked workers of sampling_batch/optimizing_batch
+_worker_model = None
+
+def _init_worker(model:'QM') -> None:
+    global _worker_model
+    _worker_model = model
+
+def _fit_worker(task:Tuple) -> Tuple[int, object]:
+    """
+    fits a single dataset of a batch. Errors are returned instead of
+    raised, s.t. a failing dataset does not stop the batch.
+    """
+    i, method, (N, q, X), kwargs, max_divergences, transfer = task
+    try:
+        _worker_model._check_domain(X)
+        data_dict = _worker_model._data_dict(N, q, X)
+        kwargs = dict(kwargs)
+        kwargs['init'] = _worker_model._init(kwargs.get('init', 'auto'), q, X,
+                chains=(method == 'sampling'))
+        fit = getattr(_worker_model.model, method)
+        out = None
+        if transfer is not None:
+            # adaptation of the pilot fits, full adaptation on a mismatch
+            out = fit(data=data_dict, **dict(kwargs, **transfer['kwargs']))
+            if diagnostics.divergences(out) > 0 or \
+                    np.min(diagnostics.e_bfmi(out)) < transfer['min_ebfmi']:
+                out = None
+        if out is None:
+            out = fit(data=data_dict, **kwargs)
+        if max_divergences is not None:
+            divergences = diagnostics.divergences(out)
+            if divergences > max_divergences:
+                raise RuntimeError(f'{divergences} divergent transitions after warmup, at most {max_divergences} allowed.')
+    except Exception as e:
+        return i, e
+    return i, out
+
+def _read_elbo(diagnostic_file:str) -> Tuple[np.ndarray, np.ndarray]:
+    """ iterations and ELBO of the diagnostic file of stan's ADVI """
+    rows = []
+    with open(diagnostic_file) as f:
+        for line in f:
+            fields = line.strip().split(',')
+            if line.startswith('#') or len(fields) < 3:
+                continue
+            try:
+                rows.append([float(fields[0]), float(fields[2])])
+            except ValueError:  # header
+                continue
+    rows = np.array(rows).reshape(-1, 2)
+    return rows[:, 0].astype(int), rows[:, 1]
+
+def _linear_fit(u:np.ndarray, y:np.ndarray, fallback:float) -> Tuple[float, float]:
+    """
+    least squares fit of y = a + b*u, returns (a, b). If b cannot be
+    estimated (single quantile) or is not positive, b = fallback.
+    """
+    u, y = np.asarray(u, dtype=float), np.asarray(y, dtype=float)
+    b = 0.
+    if len(u) > 1 and np.var(u) > 0:
+        b = np.mean((u - u.mean()) * (y - y.mean())) / np.var(u)
+    if not b > 0:
+        b = fallback
+    return y.mean() - b * u.mean(), b
 
 
 class QM:
@@ -21,10 +105,21 @@ class QM:
         Keys are internal names for the priors of the model
         e.g. 'mu', 'sigma' for a GaussianQM. Values are the user 
         defined Distributions. Note key must not be identical to value.name.
+    priors_as_data : bool, default: False
+        if True the values of the prior parameters are passed to stan as
+        data instead of being hard coded into the stan code. All models with
+        the same prior families then share one compiled stan program.
     """
-    def __init__(self, parameters_dict: Dict[str, Distribution]) -> None:
+    def __init__(self,
+            parameters_dict: Dict[str, Distribution],
+            priors_as_data: bool = False) -> None:
         self.parameters_dict = self._check_dict(parameters_dict)
+        self.priors_as_data = priors_as_data
         self.model = None
+        self.stacked_model = None
+        self._code = {}
+        self.stats = instrumentation.Stats()  # see bqme.instrumentation
+        self._executor = None  # see async_executor
 
     def __str__(self) -> str:
         return self.__class__.__name__ + '(' +  \
@@ -38,36 +133,68 @@ class QM:
         for key, value in parameters_dict.items():
             if not isinstance(value, Distribution):
                 raise ValueError(f'Input parameter "{key}" of "{self.__class__.__name__}" needs to be a Distribution (see bqme.distributions), but is of type {type(value)}.')
+            if value.shape != ():
+                raise ValueError(f'Input parameter "{key}" of "{self.__class__.__name__}" needs scalar parameters, but has parameters of shape {value.shape}.')
         return parameters_dict
 
-    def _template_replacements(self) -> Dict[str, str]:
+    @property
+    def parameter_names(self) -> List[str]:
+        """ names of the parameters in the stan code, i.e. value.name """
+        return [p.name for p in self.parameters_dict.values()]
+
+    def _template_replacements(self, stacked:bool=False) -> Dict[str, str]:
         """
         returns a dict that contains keys as template variables
         and values are the strings for the variables.
-        Necessary keys: parametersnames, parameters, priors, cdf, lpdf, rng
+        Necessary keys: parametersnames, parameters, priors, cdf, lpdf, rng,
+        hyperparameters
+        If stacked, the parameters are vectors of length K and
+        parametersnames refer to element k.
         """
         distribution_name = self.__class__.__name__.replace("QM", "").lower()
+        size = 'K' if stacked else None
         build = lambda s: '\n    '.join([
-                p.code()[s] for p in self.parameters_dict.values()
+                p.code(self.priors_as_data, size)[s]
+                for p in self.parameters_dict.values()
             ])
+        names = [f'{n}[k]' for n in self.parameter_names] if stacked \
+                else self.parameter_names
         replacements = {
-                'parametersnames'   : ', '.join([
-                        p.name for p in self.parameters_dict.values()
-                    ]),
+                'parametersnames'   : ', '.join(names),
                 'parameters'        : build('parameter'),
                 'priors'            : build('prior'),
                 'cdf'               : f'{distribution_name}_cdf',
                 'lpdf'              : f'{distribution_name}_lpdf',
                 'rng'               : f'{distribution_name}_rng',
+                'hyperparameters'   : '\n    ' + build('data') \
+                                        if self.priors_as_data else '',
             }
         return replacements
 
-    def _stan_code(self) -> str:
-        with open(STAN_TEMPLATE_PATH) as f:
-            code = f.read()
-        for k, v in self._template_replacements().items():
-            code = code.replace(f'${k}$', v)
-        return code
+    def _stan_code(self, stacked:bool=False) -> str:
+        if stacked not in self._code:  # template is rendered once per model
+            start = instrumentation.start()
+            path = STAN_TEMPLATE_STACKED_PATH if stacked else STAN_TEMPLATE_PATH
+            with open(path) as f:
+                code = f.read()
+            for k, v in self._template_replacements(stacked).items():
+                code = code.replace(f'${k}$', v)
+            self._code[stacked] = code
+            instrumentation.stop(self.stats, 'render', start, self)
+        return self._code[stacked]
+
+    def posterior_as_prior(self, fit:FitObject) -> 'QM':
+        """
+        Model of the same family whose priors are moment matched to the
+        posterior samples of fit, in the family of the current priors (see
+        Distribution.moment_match). Prior values are passed as data, s.t.
+        all updated models share one compiled stan program.
+        """
+        samples = np.asarray(fit._get_samples(), dtype=float)
+        samples = samples.reshape(len(samples), -1)
+        priors = [p.__class__.moment_match(s, p.name)
+                for p, s in zip(self.parameters_dict.values(), samples)]
+        return self.__class__(*priors, priors_as_data=True)
 
     def _check_domain(self, X) -> None:
         minn, maxx = self.domain()
@@ -81,27 +208,828 @@ class QM:
         """
         raise NotImplementedError
 
+    def initial_values(self,
+            q:Tuple[float,...],
+            X:Tuple[float,...]
+        ) -> Dict[str, float]:
+        """
+        Initial values of the parameters computed from the observed
+        quantiles. Should be overridden by all subclasses.
+        """
+        raise NotImplementedError
+
+    def _init(self,
+            init:'str or Dict or FitObject',
+            q:Tuple[float,...],
+            X:Tuple[float,...],
+            chains:bool
+        ) -> object:
+        """
+        translates `init` of sampling/optimizing to the init argument of
+        stan. For chains a function is returned that stan calls per chain,
+        otherwise a list with one dict.
+        'auto' : values from `initial_values`
+        FitObject : warm start, median of its samples (or MAP). For chains
+            each chain starts at a random posterior sample.
+        dict : values of the parameters, used unchanged for every chain
+        everything else is passed to stan as is, e.g. 'random' or 0.
+        """
+        if isinstance(init, FitObject):
+            if chains:
+                return lambda: init._init_values(random_draw=True)
+            return [init._init_values()]
+        if isinstance(init, str) and init == 'auto':
+            try:
+                values = self.initial_values(q, X)
+            except NotImplementedError:
+                return 'random'
+            if chains:
+                return lambda: self._jitter(values)
+            return [values]
+        if not isinstance(init, dict):
+            return init
+        if chains:
+            return lambda: dict(init)
+        return [init]
+
+    def _jitter(self, values:Dict[str, float], scale:float=0.1) -> Dict[str, float]:
+        """
+        perturbs values in unconstrained space, s.t. chains started from
+        the same values are dispersed
+        """
+        jittered = {}
+        for name, p in zip(self.parameter_names, self.parameters_dict.values()):
+            lower, upper = p.domain()
+            z = unconstrain(values[name], lower, upper)
+            eps = scale * np.random.randn()
+            if lower == float('-inf') and upper == float('inf'):
+                # relative for unbounded parameters, values at 0 still move
+                eps *= np.maximum(np.abs(z), 1.)
+            jittered[name] = float(constrain(z + eps, lower, upper)[0])
+        return jittered
+
+    def _data_dict(self,
+            N:int,
+            q:Tuple[float,...],
+            X:Tuple[float,...]
+        ) -> Dict:
+        data_dict = {'N':N, 'M':len(q), 'q':q, 'X':X}
+        if self.priors_as_data:
+            for p in self.parameters_dict.values():
+                data_dict.update(p.data())
+        return data_dict
+
     @property
     def code(self) -> str:
         """ returns the final stan code """
         return self._stan_code()
 
-    def compile(self) -> None:
-        self.model = StanModel(model_code=self.code)
+    @property
+    def stacked_code(self) -> str:
+        """ returns the stan code fitting K datasets in one run """
+        return self._stan_code(stacked=True)
 
-    def sampling(self, N:int, q:Tuple[float,...], X:Tuple[float,...]) -> 'StanFit4Model':
+    def compile(self, cache:ModelCache or bool=True, stacked:bool=False) -> None:
+        """
+        Compiles the stan code of the model.
+
+        Parameters
+        ----------
+        cache : ModelCache or bool, default: True
+            if True the default cache (see bqme.cache.default_cache) is used,
+            s.t. a model with identical stan code is compiled only once across
+            processes and restarts. If False the model is always compiled.
+        stacked : bool, default: False
+            if True `stacked_code` is compiled to `stacked_model`, which is
+            used by `sampling_stacked`
+        """
+        from pystan import StanModel  # heavy, only needed for compilation
+        _set_start_method()
+        code = self._stan_code(stacked)
+        start = instrumentation.start()
+        compilations = []
+        def compile_fn():
+            compilations.append(code)
+            return StanModel(model_code=code)
+        if cache is False or cache is None:
+            model = compile_fn()
+        else:
+            if cache is True:
+                cache = default_cache()
+            model = cache.get(code, compile_fn)
+        instrumentation.stop(self.stats, 'compile', start, self,
+                compilations=len(compilations))
+        if stacked:
+            self.stacked_model = model
+        else:
+            self.model = model
+
+    def sampling(self,
+            N:int,
+            q:Tuple[float,...],
+            X:Tuple[float,...],
+            init:'str or Dict or FitObject'='auto',
+            chains:int=4,
+            iter:int=2000,
+            warmup:int=None,
+            thin:int=1,
+            seed:int=None,
+            n_jobs:int=-1,
+            adaptive:bool=False,
+            target_rhat:float=1.01,
+            target_ess:float=400,
+            chunk:int=250,
+            time_budget:float=None,
+            **kwargs
+        ) -> 'FitObjectSampling':
+        """
+        Samples the posterior of the model parameters.
+
+        Parameters
+        ----------
+        N, q, X :
+            number of samples, observed quantile levels and quantile values
+        init : str or Dict or FitObject, default: 'auto'
+            'auto' starts the chains close to `initial_values`, a FitObject
+            of a previous fit starts them at its posterior samples (warm
+            start). A dict of parameter values starts every chain at these
+            values, 'random' and 0 are passed to stan.
+        chains, iter, warmup, thin, seed, n_jobs :
+            passed to StanModel.sampling. warmup defaults to iter // 2, seed
+            to a random seed. With adaptive, iter is the maximum number of
+            iterations per chain.
+        adaptive : bool, default: False
+            if True, after warmup the chains are sampled in chunks of
+            `chunk` draws, continuing with the adapted stepsize and inverse
+            metric, until the R-hat of every model parameter is below
+            `target_rhat` and its bulk and tail ESS exceed `target_ess`
+            (see bqme.diagnostics), `iter` is reached or `time_budget` is
+            used up. Returns a FitObjectAdaptive.
+        target_rhat, target_ess : float, default: 1.01, 400
+            convergence targets of the adaptive mode
+        chunk : int, default: 250
+            draws per chain and chunk of the adaptive mode
+        time_budget : float, default: None
+            seconds after which the adaptive mode stops, checked after each
+            chunk. None means no limit.
+        kwargs :
+            passed to StanModel.sampling, e.g. control
+        """
         self._check_domain(X)
         if self.model is None: self.compile()
-        data_dict = {'N':N, 'M':len(q), 'q':q, 'X':X}
-        samples = self.model.sampling(data=data_dict)
-        return FitObjectSampling(self, samples)
+        data_dict = self._data_dict(N, q, X)
+        init = self._init(init, q, X, chains=True)
+        if warmup is None:
+            warmup = iter // 2
+        if seed is not None:
+            kwargs['seed'] = seed
+        kwargs.update(chains=chains, thin=thin, n_jobs=n_jobs)
+        if adaptive:
+            return self._sampling_adaptive(data_dict, init, iter, warmup,
+                    target_rhat, target_ess, chunk, time_budget, kwargs)
+        start = instrumentation.start()
+        samples = self.model.sampling(data=data_dict, init=init, iter=iter,
+                warmup=warmup, **kwargs)
+        fit = FitObjectSampling(self, samples)
+        if start is not None:
+            instrumentation.stop(fit.stats, 'sampling', start, fit,
+                    **instrumentation.sampler_counters(samples))
+        return fit
+
+    def _sampling_adaptive(self,
+            data_dict:Dict,
+            init:object,
+            iter:int,
+            warmup:int,
+            target_rhat:float,
+            target_ess:float,
+            chunk:int,
+            time_budget:float,
+            kwargs:Dict
+        ) -> 'FitObjectAdaptive':
+        """ sampling in chunks until convergence, see `sampling` """
+        start = time.perf_counter()
+        instrumentation_start = instrumentation.start()
+        names = self.parameter_names
+        draws = []
+        counters = {}
+        iterations = min(iter, warmup + chunk)
+        out = self.model.sampling(data=data_dict, init=init,
+                iter=iterations, warmup=warmup, **kwargs)
+        while True:
+            if instrumentation_start is not None:
+                for name, value in instrumentation.sampler_counters(out).items():
+                    counters[name] = counters.get(name, 0) + value
+            draws.append(diagnostics.chains(out, names))
+            x = np.concatenate(draws, axis=1)
+            convergence = diagnostics.summary(x, names)
+            converged = all(
+                    convergence['rhat'][n] < target_rhat and
+                    convergence['ess_bulk'][n] > target_ess and
+                    convergence['ess_tail'][n] > target_ess
+                    for n in names)
+            seconds = time.perf_counter() - start
+            if converged:
+                stopped = 'converged'
+            elif iterations + chunk > iter:
+                stopped = 'iter'
+            elif time_budget is not None and seconds > time_budget:
+                stopped = 'time_budget'
+            else:
+                # continue the chains with the adapted stepsize and metric
+                fit = FitObjectSampling(self, out)
+                adaptation = fit._adaptation()
+                control = dict(kwargs.get('control') or {},
+                        stepsize=adaptation['stepsize'],
+                        inv_metric=adaptation['inv_metric'],
+                        adapt_engaged=False)
+                chunk_kwargs = dict(kwargs, control=control)
+                if 'seed' in kwargs:
+                    chunk_kwargs['seed'] = kwargs['seed'] + len(draws)
+                out = self.model.sampling(data=data_dict,
+                        init=fit._last_positions(), iter=chunk, warmup=0,
+                        **chunk_kwargs)
+                iterations += chunk
+                continue
+            break
+        convergence.update(converged=converged, stopped=stopped,
+                draws=x.shape[1], iterations=iterations, seconds=seconds)
+        # chain after chain as in the stan fit
+        samples = x.transpose(0, 2, 1).reshape(len(names), -1)
+        fit = FitObjectAdaptive(self, samples,
+                FitObjectSampling(self, out)._adaptation(), convergence)
+        instrumentation.stop(fit.stats, 'sampling', instrumentation_start,
+                fit, **counters)
+        return fit
 
-    def optimizing(self, N:int, q:Tuple[float,...], X:Tuple[float,...]) -> 'StanFit4Model':
+    def optimizing(self,
+            N:int,
+            q:Tuple[float,...],
+            X:Tuple[float,...],
+            backend:str='stan',
+            init:'str or Dict or FitObject'='auto'
+        ) -> 'StanFit4Model':
+        """
+        MAP estimate of the model parameters.
+
+        Parameters
+        ----------
+        N, q, X :
+            number of samples, observed quantile levels and quantile values
+        backend : str, default: 'stan'
+            'stan' optimizes the compiled stan model. 'numpy' optimizes the
+            same log posterior with NumPy/SciPy (see bqme.orderstatistics)
+            and needs no compilation.
+        init : str or Dict or FitObject, default: 'auto'
+            starting point of the optimizer, see `sampling`
+        """
         self._check_domain(X)
+        if backend == 'numpy':
+            start = instrumentation.start()
+            fit = next(self._optimizing_numpy([(N, q, X)], init))[1]
+            if isinstance(fit, Exception):
+                raise fit
+            instrumentation.stop(fit.stats, 'optimizing', start, fit)
+            return fit
         if self.model is None: self.compile()
-        data_dict = {'N':N, 'M':len(q), 'q':q, 'X':X}
-        opt = self.model.optimizing(data=data_dict)
-        return FitObjectOptimizing(self, opt)
+        data_dict = self._data_dict(N, q, X)
+        init = self._init(init, q, X, chains=False)
+        start = instrumentation.start()
+        opt = self.model.optimizing(data=data_dict, init=init)
+        fit = FitObjectOptimizing(self, opt)
+        instrumentation.stop(fit.stats, 'optimizing', start, fit)
+        return fit
+
+    def laplace(self,
+            N:int,
+            q:Tuple[float,...],
+            X:Tuple[float,...],
+            draws:int=1000,
+            init:'str or Dict or FitObject'='auto'
+        ) -> 'FitObjectLaplace':
+        """
+        Laplace approximation of the posterior. The mode and the Hessian of
+        the log posterior (including the log jacobian of the constraints)
+        are computed in unconstrained space with the numpy backend, samples
+        of the resulting gaussian are mapped back through the constraints.
+        Needs no stan compilation.
+
+        Parameters
+        ----------
+        N, q, X :
+            number of samples, observed quantile levels and quantile values
+        draws : int, default: 1000
+            number of approximate posterior samples
+        init : str or Dict or FitObject, default: 'auto'
+            starting point of the optimizer, see `sampling`
+
+        Returns
+        -------
+        fit : FitObjectLaplace
+            fit object with the API of FitObjectSampling
+        """
+        self._check_domain(X)
+        start = instrumentation.start()
+        os = OrderStatistics(self, [(N, q, X)])
+        z0 = self._init_unconstrained(init, q, X)[:, None]
+        z, lp, converged = os.optimize(z0, jacobian=True)
+        if not converged[0]:
+            raise RuntimeError('optimization did not converge.')
+        H = os.hessian(z, jacobian=True)[:, :, 0]
+        try:
+            L = np.linalg.cholesky(-H)
+        except np.linalg.LinAlgError:
+            raise RuntimeError('Hessian at the mode is not negative definite.')
+        # covariance is inv(-H) = inv(L L^T), samples z + L^-T eps
+        eps = np.random.randn(len(z), draws)
+        samples_z = z + np.linalg.solve(L.T, eps)
+        samples = os.constrain(samples_z)[0]
+        covariance = np.linalg.inv(-H)
+        log_evidence = lp[0] + 0.5 * len(z) * np.log(2. * np.pi) \
+                - np.sum(np.log(np.diag(L)))
+        fit = FitObjectLaplace(self, samples, z[:, 0], covariance, log_evidence)
+        instrumentation.stop(fit.stats, 'laplace', start, fit, draws=draws)
+        return fit
+
+    def grid(self,
+            N:int,
+            q:Tuple[float,...],
+            X:Tuple[float,...],
+            size:int=32,
+            refine:int=3,
+            width:float=6.,
+            init:'str or Dict or FitObject'='auto'
+        ) -> 'GridPosterior':
+        """
+        Grid approximation of the posterior (see bqme.grid). The log
+        posterior is evaluated with the numpy backend on a grid in
+        unconstrained space around the mode, extended until it covers the
+        mass and refined where the mass is. Needs no stan compilation.
+
+        Parameters
+        ----------
+        N, q, X :
+            number of samples, observed quantile levels and quantile values
+        size : int, default: 32
+            cells per parameter of the initial grid
+        refine : int, default: 3
+            number of refinement steps, each splits the cells holding more
+            than the average mass of the initial grid
+        width : float, default: 6.
+            half width of the initial grid in standard deviations of the
+            Laplace approximation
+        init : str or Dict or FitObject, default: 'auto'
+            starting point of the optimizer, see `sampling`
+
+        Returns
+        -------
+        posterior : GridPosterior
+            cells with their weights, `fit(draws)` gives a fit object with
+            the API of FitObjectSampling
+        """
+        from bqme.grid import grid_posterior
+        self._check_domain(X)
+        start = instrumentation.start()
+        os = OrderStatistics(self, [(N, q, X)])
+        z0 = self._init_unconstrained(init, q, X)[:, None]
+        z, _, converged = os.optimize(z0, jacobian=True)
+        if not converged[0]:
+            raise RuntimeError('optimization did not converge.')
+        with np.errstate(all='ignore'):
+            variance = np.diag(np.linalg.pinv(-os.hessian(z, jacobian=True)[:, :, 0]))
+        # unit scale if the mode is no proper maximum, the grid is extended anyway
+        scale = np.where(variance > 0., np.sqrt(np.abs(variance)), 1.)
+        posterior = grid_posterior(self, N, q, X, z[:, 0], scale, size=size,
+                refine=refine, width=width)
+        instrumentation.stop(self.stats, 'grid', start, posterior,
+                cells=len(posterior.weights))
+        return posterior
+
+    def variational(self,
+            N:int,
+            q:Tuple[float,...],
+            X:Tuple[float,...],
+            algorithm:str='meanfield',
+            iter:int=10000,
+            output_samples:int=1000,
+            tol_rel_obj:float=0.01,
+            seed:int=None,
+            init:'str or Dict or FitObject'='auto',
+            **kwargs
+        ) -> 'FitObjectVariational':
+        """
+        Approximates the posterior with stan's automatic differentiation
+        variational inference (ADVI).
+
+        Parameters
+        ----------
+        N, q, X :
+            number of samples, observed quantile levels and quantile values
+        algorithm : str, default: 'meanfield'
+            'meanfield' (independent gaussians in unconstrained space) or
+            'fullrank' (gaussian with full covariance)
+        iter : int, default: 10000
+            maximum number of iterations
+        output_samples : int, default: 1000
+            number of approximate posterior samples
+        tol_rel_obj : float, default: 0.01
+            relative change of the ELBO at which ADVI has converged
+        seed : int, default: None
+            passed to stan, defaults to a random seed
+        init : str or Dict or FitObject, default: 'auto'
+            starting point, see `sampling`
+        kwargs :
+            passed to StanModel.vb, e.g. eta, grad_samples or eval_elbo
+
+        Returns
+        -------
+        fit : FitObjectVariational
+            fit object with the API of FitObjectSampling, the ELBO trace and
+            whether ADVI converged before `iter` iterations. A fit that has
+            not converged is no reliable approximation, e.g. sample instead.
+        """
+        import tempfile
+        self._check_domain(X)
+        if self.model is None: self.compile()
+        data_dict = self._data_dict(N, q, X)
+        init = self._init(init, q, X, chains=False)
+        if seed is not None:
+            kwargs['seed'] = seed
+        start = instrumentation.start()
+        with tempfile.TemporaryDirectory() as directory:
+            diagnostic_file = str(Path(directory) / 'diagnostic.csv')
+            vb = self.model.vb(data=data_dict, init=init, algorithm=algorithm,
+                    iter=iter, output_samples=output_samples,
+                    tol_rel_obj=tol_rel_obj, diagnostic_file=diagnostic_file,
+                    **kwargs)
+            elbo_iterations, elbo = _read_elbo(diagnostic_file)
+        names = list(vb['sampler_param_names'])
+        samples = np.array([vb['sampler_params'][names.index(n)]
+                for n in self.parameter_names], dtype=float)
+        # stan stops before iter only if the relative ELBO change is below tol_rel_obj
+        converged = len(elbo_iterations) > 0 and elbo_iterations[-1] < iter
+        fit = FitObjectVariational(self, samples, algorithm, elbo_iterations,
+                elbo, converged)
+        instrumentation.stop(fit.stats, 'variational', start, fit,
+                draws=output_samples)
+        return fit
+
+    def sampling_stacked(self,
+            datasets:List[Dataset],
+            **kwargs
+        ) -> List['FitObjectSamplingStacked']:
+        """
+        Samples the posteriors of K datasets in a single stan run. The
+        stacked model has K independent copies of the parameters, which
+        amortizes the fixed cost of a stan call over many small fits.
+
+        Parameters
+        ----------
+        datasets : List[Tuple[int, Tuple[float,...], Tuple[float,...]]]
+            (N, q, X) triples as passed to `sampling`
+        kwargs :
+            passed to StanModel.sampling
+
+        Returns
+        -------
+        fits : List[FitObjectSamplingStacked]
+            one fit object per dataset with the API of FitObjectSampling
+        """
+        for _, _, X in datasets:
+            self._check_domain(X)
+        if self.stacked_model is None: self.compile(stacked=True)
+        data_dict = self._data_dict_stacked(datasets)
+        samples = self.stacked_model.sampling(data=data_dict, **kwargs)
+        # one extraction shared by all datasets, shape (#parameters, #samples, K)
+        extracted = samples.extract(self.parameter_names)
+        parameters = np.array([extracted[n] for n in self.parameter_names])
+        offsets = np.concatenate([[0], np.cumsum(data_dict['M'])])
+        return [FitObjectSamplingStacked(self, samples, k,
+                    slice(offsets[k], offsets[k+1]), parameters[:, :, k])
+                for k in range(len(datasets))]
+
+    def _data_dict_stacked(self, datasets:List[Dataset]) -> Dict:
+        M = [len(q) for _, q, _ in datasets]
+        data_dict = {
+                'K': len(datasets),
+                'T': sum(M),
+                'N': [N for N, _, _ in datasets],
+                'M': M,
+                'offsets': [1 + int(o) for o in np.cumsum([0] + M[:-1])],
+                'q': np.concatenate([q for _, q, _ in datasets]),
+                'X': np.concatenate([X for _, _, X in datasets]),
+            }
+        if self.priors_as_data:
+            for p in self.parameters_dict.values():
+                data_dict.update(p.data())
+        return data_dict
+
+    def sampling_batch(self,
+            datasets:Iterable[Dataset],
+            processes:int=None,
+            ordered:bool=True,
+            max_divergences:int=None,
+            chunksize:int=1,
+            transfer_adaptation:bool=False,
+            pilot:int=4,
+            transfer_warmup:int=100,
+            min_ebfmi:float=0.3,
+            **kwargs
+        ) -> Iterator[Tuple[int, 'FitObjectSampling' or Exception]]:
+        """
+        Samples the posterior for each (N, q, X) in datasets on a process
+        pool. The model is compiled once and shared with the forked workers.
+
+        Parameters
+        ----------
+        datasets : Iterable[Tuple[int, Tuple[float,...], Tuple[float,...]]]
+            (N, q, X) triples as passed to `sampling`
+        processes : int, default: None
+            number of workers, defaults to os.cpu_count(). If 1, the datasets
+            are fitted in the current process.
+        ordered : bool, default: True
+            if True results are yielded in the order of datasets, otherwise
+            as soon as they are completed
+        max_divergences : int, default: None
+            if given, fits with more divergent transitions are returned as
+            errors
+        chunksize : int, default: 1
+            number of datasets sent to a worker at once
+        transfer_adaptation : bool, default: False
+            if True, only `pilot` datasets (spread over the batch) are
+            sampled with full adaptation. The remaining datasets reuse the
+            median stepsize and inverse metric of the pilot fits with
+            `transfer_warmup` warmup iterations without adaptation. A fit
+            with divergent transitions or an E-BFMI below `min_ebfmi` is
+            repeated with full adaptation.
+        pilot : int, default: 4
+            number of pilot datasets
+        transfer_warmup : int, default: 100
+            warmup iterations of the datasets using the pilot adaptation
+        min_ebfmi : float, default: 0.3
+            smallest E-BFMI (see bqme.diagnostics.e_bfmi) accepted for the
+            pilot adaptation
+        kwargs :
+            passed to StanModel.sampling. n_jobs defaults to 1, since the
+            workers cannot spawn processes for the chains themselves.
+
+        Yields
+        ------
+        (i, fit) : Tuple[int, FitObjectSampling or Exception]
+            index of the dataset and its fit. If the dataset could not be
+            fitted, the raised exception is yielded instead of the fit.
+        """
+        kwargs.setdefault('n_jobs', 1)
+        if transfer_adaptation:
+            return self._sampling_batch_transfer(list(datasets), processes,
+                    ordered, max_divergences, chunksize, pilot,
+                    transfer_warmup, min_ebfmi, kwargs)
+        return self._fit_batch('sampling', datasets, processes, ordered,
+                chunksize, kwargs, max_divergences)
+
+    def _sampling_batch_transfer(self,
+            datasets:List[Dataset],
+            processes:int,
+            ordered:bool,
+            max_divergences:int,
+            chunksize:int,
+            pilot:int,
+            transfer_warmup:int,
+            min_ebfmi:float,
+            kwargs:Dict
+        ) -> Iterator[Tuple[int, 'FitObjectSampling' or Exception]]:
+        """ sampling_batch with the adaptation of pilot fits """
+        n_pilot = min(pilot, len(datasets))
+        pilot_indices = sorted(set(np.linspace(0, len(datasets) - 1, n_pilot).astype(int)))
+        pilot_results = list(self._fit_batch('sampling',
+                [datasets[i] for i in pilot_indices], processes, True,
+                chunksize, kwargs, max_divergences, indices=pilot_indices))
+        adaptations = [fit._adaptation() for _, fit in pilot_results
+                if not isinstance(fit, Exception)]
+        transfer = None
+        if adaptations:
+            iter_ = kwargs.get('iter', 2000)
+            draws = iter_ - kwargs.get('warmup', iter_ // 2)
+            control = dict(kwargs.get('control', None) or {},
+                    stepsize=float(np.median([a['stepsize'] for a in adaptations])),
+                    inv_metric=np.median([a['inv_metric'] for a in adaptations], axis=0),
+                    adapt_engaged=False)
+            transfer = {
+                'kwargs': {'warmup': transfer_warmup, 'iter': transfer_warmup + draws,
+                        'control': control},
+                'min_ebfmi': min_ebfmi,
+            }
+        rest = sorted(set(range(len(datasets))) - set(pilot_indices))
+        results = self._fit_batch('sampling', [datasets[i] for i in rest],
+                processes, ordered, chunksize, kwargs, max_divergences,
+                transfer=transfer, indices=rest)
+        if not ordered:
+            yield from pilot_results
+            yield from results
+            return
+        for i, fit in results:
+            while pilot_results and pilot_results[0][0] < i:
+                yield pilot_results.pop(0)
+            yield i, fit
+        yield from pilot_results
+
+    def optimizing_batch(self,
+            datasets:Iterable[Dataset],
+            processes:int=None,
+            ordered:bool=True,
+            chunksize:int=1,
+            backend:str='stan',
+            **kwargs
+        ) -> Iterator[Tuple[int, 'FitObjectOptimizing' or Exception]]:
+        """
+        MAP estimate for each (N, q, X) in datasets on a process pool.
+        See `sampling_batch` for the parameters. With backend='numpy' the
+        datasets are optimized in vectorized chunks in the current process
+        instead (see `optimizing`).
+        """
+        if backend == 'numpy':
+            return self._optimizing_numpy(datasets, kwargs.get('init', 'auto'))
+        return self._fit_batch('optimizing', datasets, processes, ordered,
+                chunksize, kwargs, None)
+
+    def _optimizing_numpy(self,
+            datasets:Iterable[Dataset],
+            init:'str or Dict or FitObject'='auto'
+        ) -> Iterator[Tuple[int, 'FitObjectOptimizing' or Exception]]:
+        datasets = enumerate(datasets)
+        while True:
+            chunk = list(islice(datasets, BATCH_SIZE))
+            if not chunk:
+                return
+            results, valid = {}, []
+            for i, (N, q, X) in chunk:
+                try:
+                    self._check_domain(X)
+                    valid.append((i, (N, q, X)))
+                except ValueError as e:
+                    results[i] = e
+            if valid:
+                os = OrderStatistics(self, [d for _, d in valid])
+                z0 = np.array([self._init_unconstrained(init, q, X)
+                        for _, (_, q, X) in valid]).T
+                z, _, converged = os.optimize(z0)
+                theta = os.constrain(z)[0]
+                U = os.cdf(theta)
+                log_prob = os.log_likelihood(theta)
+                for k, (i, _) in enumerate(valid):
+                    if not converged[k]:
+                        results[i] = RuntimeError('optimization did not converge.')
+                        continue
+                    opt = {name: np.array(theta[j, k])
+                            for j, name in enumerate(self.parameter_names)}
+                    opt['U'] = U[os.offsets[k]:os.offsets[k+1]]
+                    opt['log_prob'] = np.array(log_prob[k])
+                    results[i] = FitObjectOptimizing(self, opt)
+            for i, _ in chunk:
+                yield i, results[i]
+
+    def _init_unconstrained(self,
+            init:'str or Dict or FitObject',
+            q:Tuple[float,...],
+            X:Tuple[float,...]
+        ) -> np.ndarray:
+        """ init of the numpy backend in unconstrained space """
+        values = self._init(init, q, X, chains=False)
+        if not isinstance(values, list):
+            # stan semantics: 0 or uniform(-2, 2) in unconstrained space
+            P = len(self.parameters_dict)
+            return np.zeros(P) if values in (0, '0') else np.random.uniform(-2, 2, P)
+        return np.array([unconstrain(values[0][name], *p.domain())
+                for name, p in zip(self.parameter_names, self.parameters_dict.values())])
+
+    def async_executor(self,
+            max_workers:int=None,
+            max_pending:int=None
+        ) -> 'AsyncExecutor':
+        """
+        Executor of `asampling` and `aoptimizing`, shared by all async fits
+        of this model. Every fit runs in a forked process, at most
+        `max_workers` at once. Further fits wait for a free slot, if more
+        than `max_pending` are waiting, new fits raise RuntimeError. Called
+        with arguments, the executor is replaced for subsequent fits.
+
+        Parameters
+        ----------
+        max_workers : int, default: None
+            number of fits running at once, defaults to os.cpu_count()
+        max_pending : int, default: None
+            number of fits waiting for a slot, None means no limit
+        """
+        from bqme.aio import AsyncExecutor
+        if self._executor is None or max_workers is not None or max_pending is not None:
+            self._executor = AsyncExecutor(self, max_workers, max_pending)
+        return self._executor
+
+    async def _compile_async(self) -> None:
+        """ compiles without blocking the event loop """
+        import asyncio
+        if self.model is None:
+            await asyncio.get_event_loop().run_in_executor(None, self.compile)
+
+    async def asampling(self,
+            N:int,
+            q:Tuple[float,...],
+            X:Tuple[float,...],
+            init:'str or Dict or FitObject'='auto',
+            timeout:float=None,
+            **kwargs
+        ) -> 'FitObjectSampling':
+        """
+        `sampling` as coroutine, runs on the executor of the model (see
+        `async_executor`) without blocking the event loop. Cancelling the
+        awaiting task or exceeding `timeout` seconds (asyncio.TimeoutError)
+        terminates the fit.
+
+        kwargs are passed to StanModel.sampling. n_jobs defaults to 1, the
+        executor runs fits and not their chains in parallel.
+        """
+        self._check_domain(X)
+        await self._compile_async()
+        kwargs.setdefault('n_jobs', 1)
+        start = instrumentation.start()
+        samples = await self.async_executor().run('sampling', (N, q, X),
+                dict(kwargs, init=init), timeout)
+        fit = FitObjectSampling(self, samples)
+        if start is not None:
+            instrumentation.stop(fit.stats, 'sampling', start, fit,
+                    **instrumentation.sampler_counters(samples))
+        return fit
+
+    async def aoptimizing(self,
+            N:int,
+            q:Tuple[float,...],
+            X:Tuple[float,...],
+            backend:str='stan',
+            init:'str or Dict or FitObject'='auto',
+            timeout:float=None
+        ) -> 'FitObjectOptimizing':
+        """
+        `optimizing` as coroutine, see `asampling`. The numpy backend runs
+        in the default executor of the event loop.
+        """
+        import asyncio
+        self._check_domain(X)
+        loop = asyncio.get_event_loop()
+        if backend == 'numpy':
+            return await asyncio.wait_for(loop.run_in_executor(None,
+                    lambda: self.optimizing(N, q, X, backend='numpy', init=init)),
+                    timeout)
+        await self._compile_async()
+        start = instrumentation.start()
+        opt = await self.async_executor().run('optimizing', (N, q, X),
+                dict(init=init), timeout)
+        fit = FitObjectOptimizing(self, opt)
+        instrumentation.stop(fit.stats, 'optimizing', start, fit)
+        return fit
+
+    def _fit_batch(self,
+            method:str,
+            datasets:Iterable[Dataset],
+            processes:int,
+            ordered:bool,
+            chunksize:int,
+            kwargs:Dict,
+            max_divergences:int,
+            transfer:Dict=None,
+            indices:List[int]=None
+        ) -> Iterator[Tuple[int, object]]:
+        """
+        yields (i, fit or exception), i is the position in datasets or, if
+        given, the corresponding entry of indices
+        """
+        if self.model is None: self.compile()
+        fit_class = {
+                'sampling': FitObjectSampling,
+                'optimizing': FitObjectOptimizing,
+            }[method]
+        if indices is None:
+            indices = count()
+        tasks = ((i, method, dataset, kwargs, max_divergences, transfer)
+                for i, dataset in zip(indices, datasets))
+        if processes == 1:
+            _init_worker(self)
+            results = map(_fit_worker, tasks)
+            pool = None
+        else:
+            # fork shares the compiled model with the workers without pickling
+            ctx = multiprocessing.get_context('fork')
+            pool = ctx.Pool(processes, initializer=_init_worker, initargs=(self,))
+            imap = pool.imap if ordered else pool.imap_unordered
+            results = imap(_fit_worker, tasks, chunksize)
+        try:
+            for i, out in results:
+                if isinstance(out, Exception):
+                    yield i, out
+                else:
+                    yield i, fit_class(self, out)
+        finally:
+            if pool is not None:
+                pool.terminate()
 
 
 class NormalQM(QM):
@@ -114,6 +1042,8 @@ class NormalQM(QM):
         location of the Normal
     sigma : Distribution
         scale of the Normal
+    priors_as_data : bool, default: False
+        pass the prior parameters as stan data (see QM)
 
     Examples
     --------
@@ -123,16 +1053,28 @@ class NormalQM(QM):
     NormalQM(Normal(mu=0.0, sigma=1.0, name="mu"), Gamma(alpha=1.0, beta=1.0, name="sigma"))
     >>> code = model.code
     """
-    def __init__(self, mu:Distribution, sigma:Distribution) -> None:
+    def __init__(self,
+            mu:Distribution,
+            sigma:Distribution,
+            priors_as_data:bool=False) -> None:
         self.mu = mu
         self.sigma = sigma
         self._distribution = Normal #to access corresponding distribution in fit
         parameters_dict = {'mu': self.mu, 'sigma': self.sigma}
-        super().__init__(parameters_dict)
+        super().__init__(parameters_dict, priors_as_data)
 
     def domain(self) -> Tuple[float, float]:
         return (float('-inf'), float('inf'))
 
+    def initial_values(self,
+            q:Tuple[float,...],
+            X:Tuple[float,...]
+        ) -> Dict[str, float]:
+        """ linear regression of X on the standard normal ppf of q """
+        fallback = np.mean(np.abs(X)) or 1.
+        mu, sigma = _linear_fit(ndtri(q), X, fallback)
+        return {self.mu.name: float(mu), self.sigma.name: float(sigma)}
+
 
 class GammaQM(QM):
     """
@@ -144,6 +1086,8 @@ class GammaQM(QM):
         Also called the shape of the Gamma
     beta : Distribution
         Also called the rate of the Gamma
+    priors_as_data : bool, default: False
+        pass the prior parameters as stan data (see QM)
 
     Examples
     --------
@@ -153,16 +1097,29 @@ class GammaQM(QM):
     GammaQM(Gamma(alpha=1.0, beta=1.0, name="alpha"), Gamma(alpha=1.0, beta=1.0, name="beta"))
     >>> code = model.code
     """
-    def __init__(self, alpha:Distribution, beta:Distribution) -> None:
+    def __init__(self,
+            alpha:Distribution,
+            beta:Distribution,
+            priors_as_data:bool=False) -> None:
         self.alpha = alpha
         self.beta = beta
         self._distribution = Gamma #to access corresponding distribution in fit
         parameters_dict = {'alpha': self.alpha, 'beta': self.beta}
-        super().__init__(parameters_dict)
+        super().__init__(parameters_dict, priors_as_data)
 
     def domain(self) -> Tuple[float, float]:
         return (0, float('inf'))
 
+    def initial_values(self,
+            q:Tuple[float,...],
+            X:Tuple[float,...]
+        ) -> Dict[str, float]:
+        """ moment matching of the lognormal fit to the quantiles """
+        mu, sigma = _linear_fit(ndtri(q), np.log(X), 1.)
+        alpha = 1. / np.expm1(sigma**2)
+        beta = alpha / np.exp(mu + sigma**2 / 2.)
+        return {self.alpha.name: float(alpha), self.beta.name: float(beta)}
+
 
 class LognormalQM(QM):
     """
@@ -174,6 +1131,8 @@ class LognormalQM(QM):
         location of the corresponding Normal distribution
     sigma : Distribution
         scale of the corresponding Normal distribution
+    priors_as_data : bool, default: False
+        pass the prior parameters as stan data (see QM)
 
     Examples
     --------
@@ -183,16 +1142,27 @@ class LognormalQM(QM):
     LognormalQM(Normal(mu=1.0, sigma=1.0, name="mu"), Lognormal(mu=1.0, sigma=1.0, name="sigma"))
     >>> code = model.code
     """
-    def __init__(self, mu:Distribution, sigma:Distribution) -> None:
+    def __init__(self,
+            mu:Distribution,
+            sigma:Distribution,
+            priors_as_data:bool=False) -> None:
         self.mu = mu
         self.sigma = sigma
         self._distribution = Lognormal #to access corresponding distribution in fit
         parameters_dict = {'mu': self.mu, 'sigma': self.sigma}
-        super().__init__(parameters_dict)
+        super().__init__(parameters_dict, priors_as_data)
 
     def domain(self) -> Tuple[float, float]:
         return (0, float('inf'))
 
+    def initial_values(self,
+            q:Tuple[float,...],
+            X:Tuple[float,...]
+        ) -> Dict[str, float]:
+        """ linear regression of log(X) on the standard normal ppf of q """
+        mu, sigma = _linear_fit(ndtri(q), np.log(X), 1.)
+        return {self.mu.name: float(mu), self.sigma.name: float(sigma)}
+
 
 class WeibullQM(QM):
     """
@@ -204,6 +1174,8 @@ class WeibullQM(QM):
         Also called the shape of the Weibull
     sigma : Distribution
         Also called the scale of the Weibull
+    priors_as_data : bool, default: False
+        pass the prior parameters as stan data (see QM)
 
     Examples
     --------
@@ -213,12 +1185,25 @@ class WeibullQM(QM):
     WeibullQM(Weibull(alpha=1.0, sigma=1.0, name="alpha"), Weibull(alpha=1.0, sigma=1.0, name="sigma"))
     >>> code = model.code
     """
-    def __init__(self, alpha:Distribution, sigma:Distribution) -> None:
+    def __init__(self,
+            alpha:Distribution,
+            sigma:Distribution,
+            priors_as_data:bool=False) -> None:
         self.alpha = alpha
         self.sigma = sigma
         self._distribution = Weibull #to access corresponding distribution in fit
         parameters_dict = {'alpha': self.alpha, 'sigma': self.sigma}
-        super().__init__(parameters_dict)
+        super().__init__(parameters_dict, priors_as_data)
 
     def domain(self) -> Tuple[float, float]:
         return (0, float('inf'))
+
+    def initial_values(self,
+            q:Tuple[float,...],
+            X:Tuple[float,...]
+        ) -> Dict[str, float]:
+        """ linear regression of log(X) on log(-log(1-q)) """
+        log_sigma, inv_alpha = _linear_fit(np.log(-np.log1p(-np.asarray(q))),
+                np.log(X), 1.)
+        return {self.alpha.name: float(1. / inv_alpha),
+                self.sigma.name: float(np.exp(log_sigma))}
@@ -0,0 +1,338 @@
+"""
+NumPy implementation of the order-statistics log posterior of the stan
+template (see stan_code_template.stan) for many datasets at once, and a
+vectorized MAP optimizer that needs no stan compilation.
+"""
+from typing import List, Tuple
+
+import numpy as np
+from scipy.special import gammaln
+
+# number of datasets optimized together in one vectorized call
+BATCH_SIZE = 1024
+
+
+def constrain(z:np.ndarray, lower:float, upper:float) -> Tuple[np.ndarray, ...]:
+    """
+    maps unconstrained z to (lower, upper) as stan does. Returns the value,
+    its derivative w.r.t. z, log|dvalue/dz| and the derivative of the latter
+    w.r.t. z.
+    """
+    z = np.asarray(z, dtype=float)
+    if lower > float('-inf') and upper < float('inf'):
+        s = 1. / (1. + np.exp(-z))
+        dx = (upper - lower) * s * (1. - s)
+        return lower + (upper - lower) * s, dx, np.log(dx), 1. - 2. * s
+    elif lower > float('-inf'):
+        return lower + np.exp(z), np.exp(z), z, np.ones_like(z)
+    elif upper < float('inf'):
+        return upper - np.exp(z), -np.exp(z), z, np.ones_like(z)
+    return z, np.ones_like(z), np.zeros_like(z), np.zeros_like(z)
+
+def unconstrain(x:np.ndarray, lower:float, upper:float) -> np.ndarray:
+    """ inverse of constrain """
+    if lower > float('-inf') and upper < float('inf'):
+        s = (x - lower) / (upper - lower)
+        return np.log(s) - np.log1p(-s)
+    elif lower > float('-inf'):
+        return np.log(x - lower)
+    elif upper < float('inf'):
+        return np.log(upper - x)
+    return np.asarray(x, dtype=float)
+
+
+class OrderStatistics:
+    """
+    Order-statistics log posterior of a QM model for K datasets.
+
+    The quantiles of all datasets are packed into flat arrays, dataset k
+    occupies the entries offsets[k]:offsets[k+1]. Parameters are passed as
+    arrays of shape (#parameters, K, ...), i.e. additional trailing
+    dimensions evaluate many parameter values per dataset at once.
+
+    Parameters
+    ----------
+    model : QM
+        model defining the likelihood family and the priors
+    datasets : List[Tuple[int, Tuple[float,...], Tuple[float,...]]]
+        (N, q, X) triples
+    """
+    def __init__(self, model:'QM', datasets:List[Tuple]) -> None:
+        self.model = model
+        self.priors = list(model.parameters_dict.values())
+        self.K = len(datasets)
+        sizes = np.array([len(q) for _, q, _ in datasets])
+        self.offsets = np.concatenate([[0], np.cumsum(sizes)])
+        self.seg = np.repeat(np.arange(self.K), sizes)
+        self.N = np.array([N for N, _, _ in datasets], dtype=float)
+        self.q = np.concatenate([np.asarray(q, dtype=float) for _, q, _ in datasets])
+        self.X = np.concatenate([np.asarray(X, dtype=float) for _, _, X in datasets])
+        self.first = np.zeros(len(self.q), dtype=bool)
+        self.first[self.offsets[:-1]] = True
+        self.last = np.zeros(len(self.q), dtype=bool)
+        self.last[self.offsets[1:] - 1] = True
+        # data-only terms, identical to transformed data in the stan template
+        self.Nq = self.N[self.seg] * self.q
+        self.dNq = np.where(self.first, 0., self.Nq - np.roll(self.Nq, 1))
+        lconst = -gammaln(self.Nq) * self.first \
+                - gammaln(self.N[self.seg] - self.Nq + 1.) * self.last \
+                - gammaln(np.where(self.first, 1., self.dNq))
+        self.lconst = gammaln(self.N + 1.) + self._sum(lconst)
+
+    def _sum(self, a:np.ndarray) -> np.ndarray:
+        """ sums the packed entries (first axis) per dataset """
+        return np.add.reduceat(a, self.offsets[:-1], axis=0)
+
+    def _expand(self, a:np.ndarray, ndim:int) -> np.ndarray:
+        """ packed data array broadcastable against (#entries, ...) """
+        return a.reshape(a.shape + (1,) * (ndim - 1))
+
+    def bounds(self) -> List[Tuple[float, float]]:
+        """ constraints of the parameters, given by the domain of the priors """
+        return [p.domain() for p in self.priors]
+
+    def constrain(self, z:np.ndarray) -> Tuple[np.ndarray, ...]:
+        """
+        constrained parameters for z with shape (#parameters, K, ...),
+        see `constrain` for the return values
+        """
+        parts = zip(*[constrain(zi, *b) for zi, b in zip(z, self.bounds())])
+        return tuple(np.array(p) for p in parts)
+
+    def unconstrain(self, theta:np.ndarray) -> np.ndarray:
+        return np.array([unconstrain(t, *b) for t, b in zip(theta, self.bounds())])
+
+    def cdf(self, theta:np.ndarray) -> np.ndarray:
+        """ U of the stan template with shape (#entries, ...) """
+        th = np.asarray(theta, dtype=float)[:, self.seg]
+        X = self._expand(self.X, th.ndim - 1)
+        return self.model._distribution._frozen(*th).cdf(X)
+
+    def log_likelihood(self, theta:np.ndarray, grad:bool=False) -> np.ndarray:
+        """
+        order-statistics log likelihood per dataset (log_prob of the stan
+        template), shape (K, ...). If grad is True, also returns the gradient
+        w.r.t. theta with shape (#parameters, K, ...).
+        """
+        th = np.asarray(theta, dtype=float)[:, self.seg]
+        ndim = th.ndim - 1
+        e = lambda a: self._expand(a, ndim)
+        dist = self.model._distribution
+        first, last, inner = e(self.first), e(self.last), e(~self.first)
+        U, *dU = dist._cdf_grad(e(self.X), *th)
+        lpdf, _, *dlpdf = dist._logpdf_grad(e(self.X), *th)
+        # spacings U[m]-U[m-1] within a dataset, 1 where there is none
+        D = np.where(inner, U - np.roll(U, 1, axis=0), 1.)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ll = np.where(first, (e(self.Nq) - 1.) * np.log(U), 0.) \
+                + np.where(last, (e(self.N[self.seg] - self.Nq)) * np.log1p(-U), 0.) \
+                + (e(self.dNq) - 1.) * np.log(D) * inner \
+                + lpdf
+            ll = self.lconst.reshape((-1,) + (1,) * (ndim - 1)) + self._sum(ll)
+            if not grad:
+                return ll
+            a = (e(self.dNq) - 1.) / D * inner
+            dll_dU = np.where(first, (e(self.Nq) - 1.) / U, 0.) \
+                - np.where(last, e(self.N[self.seg] - self.Nq) / (1. - U), 0.) \
+                + a - np.roll(a, -1, axis=0)
+            g = np.array([self._sum(dll_dU * dUi + dlpdfi)
+                    for dUi, dlpdfi in zip(dU, dlpdf)])
+        return ll, g
+
+    def log_prior(self, theta:np.ndarray, grad:bool=False) -> np.ndarray:
+        """ sum of the prior log densities, shape (K, ...) """
+        theta = np.asarray(theta, dtype=float)
+        terms = [p._logpdf_grad(t, *[v.value for v in p.parameters_dict.values()])
+                for p, t in zip(self.priors, theta)]
+        lp = sum(t[0] for t in terms)
+        if not grad:
+            return lp
+        return lp, np.array([t[1] for t in terms])
+
+    def log_posterior(self,
+            z:np.ndarray,
+            grad:bool=False,
+            jacobian:bool=False
+        ) -> np.ndarray:
+        """
+        log posterior (up to a constant) as function of the unconstrained
+        parameters z. With jacobian=False this is the objective stan
+        optimizes, with jacobian=True the density stan samples.
+        """
+        theta, dtheta, log_jac, dlog_jac = self.constrain(z)
+        if not grad:
+            lp = self.log_likelihood(theta) + self.log_prior(theta)
+            return lp + log_jac.sum(axis=0) if jacobian else lp
+        ll, gll = self.log_likelihood(theta, grad=True)
+        lp, glp = self.log_prior(theta, grad=True)
+        g = (gll + glp) * dtheta
+        if jacobian:
+            return ll + lp + log_jac.sum(axis=0), g + dlog_jac
+        return ll + lp, g
+
+    def _subset(self, k:int) -> 'OrderStatistics':
+        """ order statistics of dataset k alone """
+        o = slice(self.offsets[k], self.offsets[k+1])
+        return OrderStatistics(self.model, [(self.N[k], self.q[o], self.X[o])])
+
+    def _hessian(self, z:np.ndarray, jacobian:bool, step:np.ndarray) -> np.ndarray:
+        """
+        central differences of the analytic gradient with steps of the shape
+        of z. Steps with non-finite gradients are shrunk.
+        """
+        H = np.empty((len(z),) + z.shape)
+        for j in range(len(z)):
+            h = step[j].copy()
+            todo = np.ones(h.shape, dtype=bool)
+            for _ in range(6):
+                zp, zm = z.copy(), z.copy()
+                zp[j] += h
+                zm[j] -= h
+                _, gp = self.log_posterior(zp, grad=True, jacobian=jacobian)
+                _, gm = self.log_posterior(zm, grad=True, jacobian=jacobian)
+                Hj = (gp - gm) / (2. * h)
+                H[:, j] = np.where(todo, Hj, H[:, j])
+                todo &= ~np.all(np.isfinite(Hj), axis=0)
+                if not todo.any():
+                    break
+                h = np.where(todo, 1e-3 * h, h)
+        return 0.5 * (H + np.swapaxes(H, 0, 1))
+
+    def hessian(self,
+            z:np.ndarray,
+            jacobian:bool=False,
+            h:float=1e-5,
+            h_natural:float=1e-3
+        ) -> np.ndarray:
+        """
+        Hessian of the log posterior w.r.t. z by central differences of the
+        analytic gradient, shape (#parameters, #parameters, K, ...).
+
+        The step of z[j] is scaled to its natural scale: first h * max(1, |z[j]|),
+        then h_natural times the standard deviation 1 / sqrt(|H[j, j]|) of
+        this first estimate if that is smaller, e.g. for a location
+        parameter of data on a tiny scale.
+        """
+        z = np.asarray(z, dtype=float)
+        with np.errstate(all='ignore'):
+            step = h * np.maximum(1., np.abs(z))
+            H = self._hessian(z, jacobian, step)
+            curvature = np.abs(np.diagonal(H, axis1=0, axis2=1))
+            sd = 1. / np.sqrt(np.moveaxis(curvature, -1, 0))
+            natural = np.where(np.isfinite(sd) & (sd > 0.), h_natural * sd, step)
+            if np.all(natural >= step):
+                return H
+            return self._hessian(z, jacobian, np.minimum(step, natural))
+
+    def optimize(self,
+            z0:np.ndarray,
+            jacobian:bool=False,
+            max_iter:int=100,
+            tol:float=1e-10,
+            max_step:float=2.
+        ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Maximizes the log posterior for all datasets simultaneously by a
+        damped Newton method with backtracking line search. A dataset has
+        converged when the Newton decrement, the expected increase of the log
+        posterior to the mode, is below tol * (1 + |log posterior|). The
+        steps in z are limited to max_step * max(1, |z|) per parameter.
+        Datasets on which Newton stalls (non-finite Hessian, failed line
+        search, max_iter reached) are optimized with scipy's BFGS in units
+        of their natural scale, and Newton is restarted from there.
+
+        Returns
+        -------
+        z : ndarray
+            unconstrained mode with shape (#parameters, K)
+        lp : ndarray
+            log posterior at the mode with shape (K,)
+        converged : ndarray
+            bool with shape (K,)
+        """
+        with np.errstate(all='ignore'):
+            z = np.array(z0, dtype=float)
+            active = np.ones(self.K, dtype=bool)
+            z, lp, converged = self._newton(z, active, jacobian, max_iter, tol, max_step)
+            retry = ~converged & np.all(np.isfinite(z), axis=0)
+            if retry.any():
+                for k in np.flatnonzero(retry):
+                    z[:, k] = self._subset(k)._bfgs(z[:, k], jacobian)
+                z, lp, converged_retry = self._newton(z, retry, jacobian,
+                        max_iter, tol, max_step)
+                converged |= converged_retry
+            return z, lp, converged
+
+    def _bfgs(self, z:np.ndarray, jacobian:bool) -> np.ndarray:
+        """
+        maximum found by scipy's BFGS from z for a single dataset, in units
+        of the natural scale of the parameters at z
+        """
+        from scipy.optimize import minimize
+        H = self.hessian(z[:, None], jacobian=jacobian)[:, :, 0]
+        scale = 1. / np.sqrt(np.abs(np.diag(H)))
+        scale = np.where(np.isfinite(scale) & (scale > 0.), scale, 1.)
+        def f(u):
+            lp, g = self.log_posterior((z + scale * u)[:, None], grad=True,
+                    jacobian=jacobian)
+            if not np.isfinite(lp[0]) or not np.all(np.isfinite(g)):
+                return np.inf, np.zeros_like(u)
+            return -lp[0], -g[:, 0] * scale
+        result = minimize(f, np.zeros(len(z)), jac=True, method='BFGS')
+        u = result.x if np.all(np.isfinite(result.x)) else np.zeros(len(z))
+        return z + scale * u
+
+    def _newton(self,
+            z:np.ndarray,
+            active:np.ndarray,
+            jacobian:bool,
+            max_iter:int,
+            tol:float,
+            max_step:float
+        ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """ damped Newton on the active datasets, see `optimize` """
+        active = active.copy()
+        lp, g = self.log_posterior(z, grad=True, jacobian=jacobian)
+        active &= np.isfinite(lp) & np.all(np.isfinite(g), axis=0)
+        converged = np.zeros(self.K, dtype=bool)
+        eye = np.eye(len(z))
+        for _ in range(max_iter):
+            if not active.any():
+                break
+            # newton direction of the (absolute value) negative hessian
+            H = np.moveaxis(self.hessian(z, jacobian=jacobian), (0, 1), (-2, -1))
+            active &= np.all(np.isfinite(H), axis=(-2, -1))
+            H[~active] = -eye
+            # in units of the natural scale of the parameters, s.t. the
+            # eigenvalues of badly scaled data are comparable
+            sd = 1. / np.sqrt(np.abs(np.diagonal(H, axis1=-2, axis2=-1)))
+            sd = np.where(np.isfinite(sd) & (sd > 0.), sd, 1.)
+            w, V = np.linalg.eigh(-H * sd[..., :, None] * sd[..., None, :])
+            w = np.maximum(np.abs(w), 1e-8 * np.max(np.abs(w), axis=-1, keepdims=True))
+            gk = (np.moveaxis(np.where(active, g, 0.), 0, -1) * sd)[..., None]
+            d = sd * (V @ ((np.swapaxes(V, -1, -2) @ gk) / w[..., None]))[..., 0]
+            d = np.moveaxis(d, -1, 0)
+            decrement = np.sum(g * d, axis=0)
+            active &= np.all(np.isfinite(d), axis=0) & np.isfinite(decrement)
+            converged |= active & (0.5 * decrement < tol * (1. + np.abs(lp)))
+            active &= ~converged
+            # limit the step relative to z to avoid overflows
+            limit = max_step * np.maximum(1., np.abs(z))
+            d *= np.minimum(1., np.min(limit / np.maximum(np.abs(d), 1e-300), axis=0))
+            t = np.ones(self.K)
+            todo = active.copy()
+            for _ in range(50):
+                if not todo.any():
+                    break
+                z_new = z + t * d
+                lp_new, g_new = self.log_posterior(z_new, grad=True, jacobian=jacobian)
+                ok = np.isfinite(lp_new) & np.all(np.isfinite(g_new), axis=0) \
+                        & (lp_new >= lp + 1e-4 * t * np.sum(g * d, axis=0))
+                accept = todo & ok
+                z[:, accept] = z_new[:, accept]
+                lp[accept], g[:, accept] = lp_new[accept], g_new[:, accept]
+                todo &= ~ok
+                t[todo] *= 0.5
+            # the line search failed, newton stalls
+            active &= ~todo
+        return z, lp, converged
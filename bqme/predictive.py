@@ -0,0 +1,155 @@
+"""
+Posterior predictive distribution p(x|data) of a fit, i.e. the mixture of
+the model distribution over the posterior samples.
+"""
+from typing import List
+
+import numpy as np
+
+# number of (sample, x) pairs evaluated in one broadcasted call, bounds the
+# memory of pdf/cdf for many samples and many x
+CHUNK_SIZE = 2**20
+# number of samples whose quantiles place the points of the ppf table
+SUBSET_SIZE = 64
+
+
+class PosteriorPredictive:
+    """
+    Mixture of `distribution` over the posterior samples.
+
+    In contrast to FitObject.ppf(q, method='mean'), which averages the
+    quantiles of the individual samples, `ppf` is the quantile function of
+    the mixture. It interpolates a table of the mixture cdf, which is built
+    on the first call of `ppf`.
+
+    Parameters
+    ----------
+    distribution : Distribution class
+        distribution of the model, e.g. bqme.distributions.Normal
+    samples : ndarray
+        posterior samples of the parameters, shape (#parameters, #samples)
+    table_size : int, default: 1024
+        number of points of the interpolation table of the mixture cdf
+    eps : float, default: 1e-8
+        the table covers the quantile levels (eps, 1-eps), ppf is clipped
+        to this range
+    weights : ndarray, default: None
+        weights of the samples (e.g. of a reweighted fit), None means equal
+        weights
+
+    Examples
+    --------
+    >>> from bqme.distributions import Normal
+    >>> pp = PosteriorPredictive(Normal, np.array([[-1., 1.], [1., 1.]]))
+    >>> float(pp.cdf(0.))
+    0.5
+    >>> bool(np.isclose(pp.ppf(0.5), 0.))
+    True
+    """
+    def __init__(self,
+            distribution:'Distribution',
+            samples:np.ndarray,
+            table_size:int=1024,
+            eps:float=1e-8,
+            weights:np.ndarray=None
+        ) -> None:
+        self.distribution = distribution
+        samples = np.asarray(samples, dtype=float)
+        self.samples = samples.reshape(len(samples), -1)
+        n = self.samples.shape[1]
+        self.weights = np.full(n, 1. / n) if weights is None \
+                else np.asarray(weights, dtype=float) / np.sum(weights)
+        self.table_size = table_size
+        self.eps = eps
+        self._table = None
+
+    def _mixture(self, fn:str, x:np.ndarray) -> np.ndarray:
+        """ weighted mean of dist.fn(x) over the samples, chunked over x """
+        x = np.asarray(x, dtype=float)
+        flat = x.reshape(-1)
+        n = self.samples.shape[1]
+        chunk = max(1, CHUNK_SIZE // n)
+        frozen = self.distribution._frozen(*self.samples[:, :, None])
+        ret = np.empty(len(flat))
+        for i in range(0, len(flat), chunk):
+            ret[i:i + chunk] = self.weights @ getattr(frozen, fn)(flat[None, i:i + chunk])
+        return ret.reshape(x.shape)
+
+    def pdf(self, x:float or List[float]) -> np.ndarray:
+        return self._mixture('pdf', x)
+
+    def cdf(self, x:float or List[float]) -> np.ndarray:
+        return self._mixture('cdf', x)
+
+    def logpdf(self, x:float or List[float]) -> np.ndarray:
+        with np.errstate(divide='ignore'):
+            return np.log(self.pdf(x))
+
+    def logcdf(self, x:float or List[float]) -> np.ndarray:
+        with np.errstate(divide='ignore'):
+            return np.log(self.cdf(x))
+
+    def _build_table(self) -> None:
+        """
+        x grid and mixture cdf. The quantile of the mixture at level p lies
+        between the smallest and the largest quantile of the samples at p.
+        Grid points are the minimum, median and maximum of these quantiles
+        over a subset of the samples at logit spaced levels, i.e. dense
+        where the mass is and following heavy tails.
+        """
+        from scipy.interpolate import PchipInterpolator
+        from scipy.special import expit, logit
+        n = self.samples.shape[1]
+        full = self.distribution._frozen(*self.samples)
+        lower, upper = full.ppf(self.eps), full.ppf(1. - self.eps)
+        # the samples with the most extreme tails are always in the subset
+        index = np.concatenate([np.linspace(0, n - 1, min(n, SUBSET_SIZE)).astype(int),
+                [np.argmin(lower), np.argmax(upper)]])
+        levels = expit(np.linspace(logit(self.eps), logit(1. - self.eps),
+                self.table_size // 3))
+        quantiles = self.distribution._frozen(*self.samples[:, index, None]).ppf(levels[None])
+        x = np.concatenate([
+                quantiles.min(axis=0), np.median(quantiles, axis=0),
+                quantiles.max(axis=0),
+            ])
+        x = np.unique(x[np.isfinite(x)])
+        F = self.cdf(x)
+        # strictly increasing levels inside (0, 1) for the logit
+        keep = (F > 0.) & (F < 1.) & np.concatenate([[True], np.diff(F) > 0.])
+        x, F = x[keep], F[keep]
+        self._table = (x, F)
+        # monotone cubic interpolation of x over logit(F), in which the
+        # tails of most distributions are close to linear
+        self._interpolator = PchipInterpolator(logit(F), x, extrapolate=False)
+
+    def ppf(self, q:float or List[float], refine:int=0) -> np.ndarray:
+        """
+        quantiles of the posterior predictive by interpolation of the table
+        of the mixture cdf
+
+        Parameters
+        ----------
+        q : float or List[float]
+            quantile levels in (0, 1)
+        refine : int, default: 0
+            number of Newton steps on the mixture cdf after interpolation
+            (bisection if a step leaves the bracket of the table), each
+            evaluates the mixture pdf and cdf at all q
+        """
+        if self._table is None:
+            self._build_table()
+        from scipy.special import logit
+        x_table, F_table = self._table
+        q = np.asarray(q, dtype=float)
+        q_clipped = np.clip(q, F_table[0], F_table[-1])
+        x = self._interpolator(logit(q_clipped))
+        # bracket of the table, safeguards the newton steps
+        i = np.clip(np.searchsorted(F_table, q_clipped), 1, len(F_table) - 1)
+        lo, hi = x_table[i - 1], x_table[i]
+        for _ in range(refine):
+            F = self.cdf(x)
+            lo, hi = np.where(F < q, x, lo), np.where(F < q, hi, x)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                newton = x - (F - q) / self.pdf(x)
+            x = np.where((newton >= lo) & (newton <= hi), newton, 0.5 * (lo + hi))
+        return x
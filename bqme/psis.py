@@ -0,0 +1,112 @@
+"""
+Pareto smoothed importance sampling (PSIS), Vehtari et al. (2017),
+"Practical Bayesian model evaluation using leave-one-out cross-validation
+and WAIC".
+
+The largest importance weights are replaced by the expected order
+statistics of a generalized Pareto distribution fitted to them. The shape
+k of the fit is a diagnostic of the reliability of the weights: estimates
+are reliable for k < `k_threshold` (0.7 for large sample sizes). `psis`
+smooths many sets of weights (columns) at once.
+"""
+from typing import Tuple
+
+import numpy as np
+from scipy.special import logsumexp
+
+
+def tail_length(draws:int, r_eff:float=1.) -> int:
+    """ number of largest weights that are smoothed """
+    return int(np.ceil(min(0.2 * draws, 3. * np.sqrt(draws / r_eff))))
+
+def k_threshold(draws:int) -> float:
+    """ largest reliable pareto k for the number of draws """
+    return min(1. - 1. / np.log10(draws), 0.7)
+
+def _gpd_fit(x:np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    shape k and scale sigma of a generalized Pareto distribution fitted to
+    the positive, ascending sorted exceedances x of shape (M, K) per
+    column, with the empirical Bayes estimate of Zhang & Stephens (2009)
+    and a weakly informative prior on k
+    """
+    M = len(x)
+    m = 30 + int(np.sqrt(M))
+    b = 1. - np.sqrt(m / (np.arange(1, m + 1) - 0.5))
+    b = b[:, None] / (3. * x[int(M / 4. + 0.5) - 1]) + 1. / x[-1]
+    k = np.mean(np.log1p(-b[:, None, :] * x[None]), axis=1)
+    log_likelihood = M * (np.log(-b / k) - k - 1.)
+    weights = 1. / np.sum(np.exp(log_likelihood[None] - log_likelihood[:, None]), axis=1)
+    weights = np.where(weights >= 10. * np.finfo(float).eps, weights, 0.)
+    weights /= np.sum(weights, axis=0)
+    b = np.sum(b * weights, axis=0)
+    k = np.mean(np.log1p(-b * x), axis=0)
+    sigma = -k / b
+    # weakly informative prior, shrinks k towards 0.5
+    k = (M * k + 10. * 0.5) / (M + 10.)
+    return k, sigma
+
+def _gpd_ppf(p:np.ndarray, k:np.ndarray, sigma:np.ndarray) -> np.ndarray:
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = np.where(np.abs(k) < np.finfo(float).eps, -np.log1p(-p),
+                np.expm1(-k * np.log1p(-p)) / k)
+    return sigma * x
+
+def psis(log_weights:np.ndarray, r_eff:float=1.) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pareto smoothed log weights, normalized to sum to one, and the pareto k
+    per column.
+
+    Parameters
+    ----------
+    log_weights : ndarray
+        raw log importance weights with shape (#draws,) or (#draws, K)
+    r_eff : float, default: 1.
+        relative efficiency of the draws, ESS / #draws
+
+    Returns
+    -------
+    log_weights : ndarray
+        smoothed and normalized log weights, same shape as the input
+    k : float or ndarray
+        pareto k per column
+
+    Examples
+    --------
+    >>> log_weights = np.random.RandomState(0).normal(size=(1000, 2))
+    >>> smoothed, k = psis(log_weights)
+    >>> bool(np.allclose(np.exp(smoothed).sum(axis=0), 1.))
+    True
+    >>> bool(np.all(k < 0.7))
+    True
+    """
+    log_weights = np.asarray(log_weights, dtype=float)
+    lw = log_weights.reshape(len(log_weights), -1)
+    lw = lw - np.max(lw, axis=0)
+    S, K = lw.shape
+    M = tail_length(S, r_eff)
+    k = np.full(K, np.inf)
+    if M > 4:
+        order = np.argsort(lw, axis=0)
+        sorted_lw = np.take_along_axis(lw, order, axis=0)
+        cutoff = sorted_lw[-M - 1]
+        exceedances = np.exp(sorted_lw[-M:]) - np.exp(cutoff)
+        # the largest weights of a column are equal, nothing to smooth
+        fit = exceedances[-1] > 0.
+        k[~fit] = -np.inf
+        if fit.any():
+            x = np.maximum(exceedances[:, fit], np.finfo(float).tiny)
+            k_fit, sigma = _gpd_fit(x)
+            p = (np.arange(M) + 0.5)[:, None] / M
+            tail = np.log(_gpd_ppf(p, k_fit, sigma) + np.exp(cutoff[fit]))
+            # smoothed weights are at most the largest raw weight
+            tail = np.minimum(tail, 0.)
+            columns = np.flatnonzero(fit)
+            rows = order[-M:, fit]
+            lw[rows, columns[None, :]] = np.where(np.isfinite(k_fit), tail,
+                    lw[rows, columns[None, :]])
+            k[fit] = k_fit
+    lw = lw - logsumexp(lw, axis=0)
+    if log_weights.ndim == 1:
+        return lw[:, 0], float(k[0])
+    return lw.reshape(log_weights.shape), k
@@ -0,0 +1,251 @@
+"""
+Selection of the best likelihood family for quantile data: all candidate
+models are fitted on a process pool and ranked by a common criterion.
+
+Criteria (higher is better):
+
+- 'laplace': Laplace approximation of the log marginal likelihood (numpy,
+  no stan), see QM.laplace
+- 'grid':    log marginal likelihood of the grid posterior (numpy, no
+  stan), see QM.grid
+- 'map':     log posterior at the MAP estimate (numpy, no stan), datasets
+  of a batch are optimized in vectorized chunks
+- 'loo':     PSIS-LOO elpd of a stan sampling fit, see FitObjectSampling.loo.
+  The models are compiled (or loaded from the cache) once before the
+  workers are forked.
+
+The marginal likelihood criteria depend on the priors, which should be
+set for the data at hand (see `default_families`).
+"""
+import multiprocessing
+import signal
+import threading
+from contextlib import contextmanager
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Tuple
+
+import numpy as np
+
+from bqme.distributions import Normal, Gamma
+from bqme.models import QM, NormalQM, GammaQM, LognormalQM, WeibullQM
+
+CRITERIA = ('laplace', 'grid', 'map', 'loo')
+
+Dataset = Tuple[int, Tuple[float,...], Tuple[float,...]]
+
+
+class Candidate(NamedTuple):
+    """ a fitted family, fit is the raised exception if fitting failed """
+    score: float
+    model: QM
+    fit: object
+
+
+def default_families() -> List[QM]:
+    """ the four built-in families with wide priors """
+    return [
+        NormalQM(Normal(0., 10., name='mu'), Gamma(1., 0.1, name='sigma')),
+        GammaQM(Gamma(1., 0.1, name='alpha'), Gamma(1., 0.1, name='beta')),
+        LognormalQM(Normal(0., 10., name='mu'), Gamma(1., 0.1, name='sigma')),
+        WeibullQM(Gamma(1., 0.1, name='alpha'), Gamma(1., 0.1, name='sigma')),
+    ]
+
+
+# candidate models of the forked workers
+_worker_families = None
+
+@contextmanager
+def _time_limit(seconds:float) -> Iterator[None]:
+    """
+    raises TimeoutError after seconds. A no-op if seconds is None, without
+    SIGALRM or outside the main thread.
+    """
+    if seconds is None or not hasattr(signal, 'SIGALRM') \
+            or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+    def handler(signum, frame):
+        raise TimeoutError(f'the fit exceeded the timeout of {seconds} s.')
+    previous = signal.signal(signal.SIGALRM, handler)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+def _score(score:float) -> float:
+    """ non-finite scores of degenerate fits rank last """
+    score = float(score)
+    return score if np.isfinite(score) else -np.inf
+
+def _init_worker(families:List[QM]) -> None:
+    global _worker_families
+    _worker_families = families
+
+def _log_posterior_map(model:QM, fit:'FitObjectOptimizing') -> float:
+    """ log likelihood plus log prior at the MAP estimate """
+    return float(fit.log_prob) + sum(float(prior.logpdf(fit.opt[name]))
+            for name, prior in zip(model.parameter_names, model.parameters_dict.values()))
+
+def _fit_and_score(model:QM,
+        criterion:str,
+        N:int,
+        q:Tuple[float,...],
+        X:Tuple[float,...],
+        kwargs:Dict
+    ) -> Tuple[float, object]:
+    if criterion == 'laplace':
+        fit = model.laplace(N, q, X, **kwargs)
+        return float(fit.log_evidence), fit
+    if criterion == 'grid':
+        kwargs = dict(kwargs)
+        draws = kwargs.pop('draws', 1000)
+        posterior = model.grid(N, q, X, **kwargs)
+        return posterior.log_evidence, posterior.fit(draws)
+    # 'loo'
+    fit = model.sampling(N, q, X, **kwargs)
+    return fit.loo().elpd, fit
+
+def _select_worker(task:Tuple) -> Tuple[int, List[Tuple[int, float, object]]]:
+    """
+    fits family j to a chunk of datasets. Returns (j, [(i, score, fit)]),
+    the fits without their model, s.t. the compiled model is not sent back.
+    Errors, including TimeoutError of fits exceeding timeout, are returned
+    instead of raised.
+    """
+    j, chunk, criterion, kwargs, timeout = task
+    model = _worker_families[j]
+    if criterion == 'map':
+        try:
+            with _time_limit(timeout):
+                fits = dict(model._optimizing_numpy([d for _, d in chunk],
+                        kwargs.get('init', 'auto')))
+        except Exception as e:
+            fits = {k: e for k in range(len(chunk))}
+        results = []
+        for k, (i, _) in enumerate(chunk):
+            fit = fits[k]
+            score = -np.inf if isinstance(fit, Exception) else _score(_log_posterior_map(model, fit))
+            results.append((i, score, fit))
+    else:
+        results = []
+        for i, (N, q, X) in chunk:
+            try:
+                with _time_limit(timeout):
+                    score, fit = _fit_and_score(model, criterion, N, q, X, kwargs)
+                score = _score(score)
+            except Exception as e:
+                score, fit = -np.inf, e
+            results.append((i, score, fit))
+    for _, _, fit in results:
+        if not isinstance(fit, Exception):
+            fit.model = None
+    return j, results
+
+def select_family_batch(datasets:Iterable[Dataset],
+        families:List[QM]=None,
+        criterion:str='laplace',
+        processes:int=None,
+        chunksize:int=64,
+        timeout:float=None,
+        **kwargs
+    ) -> Iterator[Tuple[int, List[Candidate]]]:
+    """
+    Ranks the families for each (N, q, X) in datasets. Chunks of datasets
+    are fitted per family on a process pool, in the order of datasets.
+
+    Parameters
+    ----------
+    datasets : Iterable[Tuple[int, Tuple[float,...], Tuple[float,...]]]
+        (N, q, X) triples
+    families : List[QM], default: None
+        candidate models, defaults to `default_families()`
+    criterion : str, default: 'laplace'
+        'laplace', 'grid', 'map' or 'loo', see the module docstring
+    processes : int, default: None
+        number of workers, defaults to os.cpu_count(). If 1, everything
+        runs in the current process.
+    chunksize : int, default: 64
+        datasets per task of a worker
+    timeout : float, default: None
+        seconds after which a fit fails with TimeoutError (for 'map' the
+        vectorized fit of a chunk). Needs SIGALRM, a running stan call is
+        only interrupted when it returns.
+    kwargs :
+        passed to the fit of the criterion, e.g. draws for 'laplace',
+        size and draws for 'grid' or chains and iter for 'loo'
+
+    Yields
+    ------
+    (i, candidates) : Tuple[int, List[Candidate]]
+        index of the dataset and the candidates ranked by their score, best
+        first. Families that could not be fitted come last with score -inf
+        and the exception as fit, as do fits with a non-finite score.
+    """
+    if criterion not in CRITERIA:
+        raise ValueError(f'criterion must be one of {CRITERIA}, got "{criterion}".')
+    families = default_families() if families is None else list(families)
+    if criterion == 'loo':
+        kwargs.setdefault('n_jobs', 1)
+        for model in families:
+            if model.model is None: model.compile()
+    datasets = enumerate(datasets)
+    chunks = iter(lambda: list(islice(datasets, chunksize)), [])
+    tasks = ((j, chunk, criterion, kwargs, timeout)
+            for chunk in chunks for j in range(len(families)))
+    if processes == 1:
+        _init_worker(families)
+        results = map(_select_worker, tasks)
+        pool = None
+    else:
+        ctx = multiprocessing.get_context('fork')
+        pool = ctx.Pool(processes, initializer=_init_worker, initargs=(families,))
+        results = pool.imap(_select_worker, tasks)
+    try:
+        # results arrive ordered, all families of a chunk one after another
+        while True:
+            chunk = list(islice(results, len(families)))
+            if not chunk:
+                return
+            candidates = {}
+            for j, fits in chunk:
+                for i, score, fit in fits:
+                    if not isinstance(fit, Exception):
+                        fit.model = families[j]
+                    candidates.setdefault(i, []).append(Candidate(score, families[j], fit))
+            for i, ranked in candidates.items():
+                yield i, sorted(ranked, key=lambda c: -c.score)
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+def select_family(N:int,
+        q:Tuple[float,...],
+        X:Tuple[float,...],
+        families:List[QM]=None,
+        criterion:str='laplace',
+        processes:int=None,
+        timeout:float=None,
+        **kwargs
+    ) -> List[Candidate]:
+    """
+    Fits all families to (N, q, X) concurrently and ranks them, see
+    `select_family_batch` for the parameters.
+
+    Returns
+    -------
+    candidates : List[Candidate]
+        (score, model, fit) ranked by score, best first
+
+    Examples
+    --------
+    >>> ranked = select_family(1000, [0.1, 0.5, 0.9], [0.5, 1.0, 2.0], processes=1)
+    >>> ranked[0].model.__class__.__name__
+    'LognormalQM'
+    """
+    families = default_families() if families is None else list(families)
+    if processes is None:
+        processes = min(len(families), multiprocessing.cpu_count())
+    return next(select_family_batch([(N, q, X)], families, criterion,
+            processes, 1, timeout, **kwargs))[1]
@@ -1,3 +1,6 @@
+import numpy as np
+
+
 class Variable:
     """
     Base class for different kind of variables
@@ -8,11 +11,22 @@ class Variable:
         self.name = name
         self.value = self.approve(value)
 
-    def approve(self, value:float) -> float:
-        if self.lower < value < self.upper:
-            return value
-        else:
-            raise ValueError(f'Input parameter "{self.name}" needs to be in range ({self.lower}, {self.upper}), currently set to {value}.')
+    def approve(self, value:float or np.ndarray) -> float or np.ndarray:
+        """
+        checks the range of value. Arrays are checked elementwise and
+        returned as read-only float arrays, scalars are returned unchanged.
+        """
+        if np.ndim(value) == 0:
+            if self.lower < value < self.upper:
+                return value
+            else:
+                raise ValueError(f'Input parameter "{self.name}" needs to be in range ({self.lower}, {self.upper}), currently set to {value}.')
+        value = np.array(value, dtype=float)
+        inside = (self.lower < value) & (value < self.upper)
+        if not inside.all():
+            raise ValueError(f'Input parameter "{self.name}" needs to be in range ({self.lower}, {self.upper}), {np.size(inside) - np.count_nonzero(inside)} of {np.size(inside)} values are not, e.g. {value[~inside][0]}.')
+        value.flags.writeable = False
+        return value
 
 
 class ContinuousVariable(Variable):
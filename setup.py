@@ -34,7 +34,7 @@ setuptools.setup(
         ],
     },
     package_data={
-        'bqme':['stan_code_template.stan',],
+        'bqme':['stan_code_template.stan', 'stan_code_template_stacked.stan',],
     },
     include_package_data=True,
 )
@@ -0,0 +1,121 @@
+import asyncio
+import time
+
+import pytest
+import numpy as np
+
+from bqme.distributions import Normal, Gamma
+from bqme.models import NormalQM
+
+q, X = [0.25, 0.5, 0.75], [-0.1, 0.3, 0.8]
+
+
+class SleepStanModel:
+    """ optimizing sleeps N milliseconds, negative N raises """
+    def optimizing(self, data, init):
+        if data['N'] < 0:
+            raise RuntimeError('optimization failed')
+        time.sleep(data['N'] / 1000.)
+        return {'mu': np.array(float(data['N'])), 'sigma': np.array(1.)}
+
+
+def sleep_model(**kwargs):
+    model = NormalQM(Normal(0., 1., name='mu'), Gamma(1., 1., name='sigma'))
+    model.model = SleepStanModel()
+    model.async_executor(**kwargs)
+    return model
+
+def test_aoptimizing_concurrent():
+    model = sleep_model(max_workers=4)
+    async def main():
+        return await asyncio.gather(*[model.aoptimizing(N, q, X)
+                for N in [300, 301, 302, 303]])
+    start = time.perf_counter()
+    fits = asyncio.run(main())
+    assert time.perf_counter() - start < 1.
+    assert [float(fit.mu) for fit in fits] == [300., 301., 302., 303.]
+
+def test_aoptimizing_bounded():
+    model = sleep_model(max_workers=1)
+    running = []
+    async def main():
+        tasks = [asyncio.ensure_future(model.aoptimizing(200, q, X))
+                for _ in range(3)]
+        await asyncio.sleep(0.1)
+        running.append(model.async_executor().running)
+        running.append(model.async_executor().pending)
+        await asyncio.gather(*tasks)
+    asyncio.run(main())
+    assert running == [1, 2]
+
+def test_aoptimizing_max_pending():
+    model = sleep_model(max_workers=1, max_pending=1)
+    async def main():
+        tasks = [asyncio.ensure_future(model.aoptimizing(200, q, X))
+                for _ in range(3)]
+        return await asyncio.gather(*tasks, return_exceptions=True)
+    results = asyncio.run(main())
+    assert [isinstance(r, RuntimeError) for r in results] == [False, False, True]
+
+def test_aoptimizing_timeout_and_error():
+    model = sleep_model()
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(model.aoptimizing(5000, q, X, timeout=0.2))
+    assert model.async_executor().running == 0
+    with pytest.raises(RuntimeError, match='optimization failed'):
+        asyncio.run(model.aoptimizing(-1, q, X))
+
+def test_aoptimizing_cancel():
+    model = sleep_model(max_workers=1)
+    async def main():
+        task = asyncio.ensure_future(model.aoptimizing(5000, q, X))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # the slot is free again
+        return await model.aoptimizing(10, q, X, timeout=2.)
+    start = time.perf_counter()
+    assert float(asyncio.run(main()).mu) == 10.
+    assert time.perf_counter() - start < 2.
+
+def test_aoptimizing_numpy():
+    model = NormalQM(Normal(0., 1., name='mu'), Gamma(1., 1., name='sigma'))
+    fit = asyncio.run(model.aoptimizing(1000, q, X, backend='numpy'))
+    assert np.isclose(fit.mu, model.optimizing(1000, q, X, backend='numpy').mu)
+
+@pytest.mark.slow
+def test_asampling(gamma_compiled_model):
+    async def main():
+        return await asyncio.gather(*[gamma_compiled_model.asampling(
+                1000, [0.25, 0.5, 0.75], [0.1 * s, 1.0 * s, 1.4 * s],
+                iter=500, chains=2) for s in [1., 1.1]])
+    fits = asyncio.run(main())
+    assert all(fit.alpha.shape == (500,) for fit in fits)
+
+def test_terminate_does_not_block_loop():
+    import multiprocessing
+    import signal
+    from bqme.aio import _join
+    def ignore_sigterm():
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        time.sleep(10.)
+    process = multiprocessing.get_context('fork').Process(target=ignore_sigterm)
+    process.start()
+    time.sleep(0.2)
+    process.terminate()
+    ticks = []
+    async def tick():
+        while True:
+            ticks.append(time.perf_counter())
+            await asyncio.sleep(0.05)
+    async def main():
+        ticker = asyncio.ensure_future(tick())
+        await _join(process, terminated=True, grace=0.5)
+        ticker.cancel()
+    start = time.perf_counter()
+    asyncio.run(main())
+    # the process was killed after the grace period, the loop kept running
+    assert not process.is_alive()
+    assert time.perf_counter() - start < 3.
+    assert len(ticks) >= 5
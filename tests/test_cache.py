@@ -0,0 +1,73 @@
+import os
+import time
+
+import pytest
+
+from bqme.cache import ModelCache
+from bqme.distributions import Normal, Gamma
+from bqme.models import NormalQM
+
+
+def test_cache_store_load(tmp_path):
+    cache = ModelCache(tmp_path, max_bytes=10**6)
+    path = tmp_path / ('key' + cache.suffix)
+    assert cache._load(path) is None
+    cache._store(path, {'a': 1})
+    assert cache._load(path) == {'a': 1}
+
+def test_cache_corrupted_file(tmp_path):
+    cache = ModelCache(tmp_path)
+    path = tmp_path / ('key' + cache.suffix)
+    path.write_bytes(b'not a pickle')
+    assert cache._load(path) is None
+
+def test_cache_lru_eviction(tmp_path):
+    cache = ModelCache(tmp_path, max_bytes=2500)
+    now = time.time()
+    for i, key in enumerate(['old', 'middle', 'new']):
+        path = tmp_path / (key + cache.suffix)
+        path.write_bytes(b'0' * 1000)
+        os.utime(path, (now + i, now + i))
+    cache._evict()
+    remaining = sorted(p.stem for p in tmp_path.glob('*' + cache.suffix))
+    assert remaining == ['middle', 'new']
+    assert cache.size() == 2000
+
+def test_cache_eviction_removes_locks(tmp_path):
+    cache = ModelCache(tmp_path, max_bytes=1500)
+    now = time.time()
+    for i, key in enumerate(['old', 'new']):
+        path = tmp_path / (key + cache.suffix)
+        path.write_bytes(b'0' * 1000)
+        os.utime(path, (now + i, now + i))
+        with cache._lock(key):
+            pass
+    with cache._lock('compiling'):
+        cache._evict()
+        locks = sorted(p.name for p in tmp_path.glob('.*.lock'))
+    # the lock of a key that is being compiled is kept
+    assert locks == ['.compiling.lock', '.evict.lock', '.new.lock']
+    cache.clear()
+    assert sorted(p.name for p in tmp_path.glob('.*.lock')) == ['.evict.lock']
+
+def test_cache_keeps_most_recent(tmp_path):
+    cache = ModelCache(tmp_path, max_bytes=10)
+    (tmp_path / ('big' + cache.suffix)).write_bytes(b'0' * 1000)
+    cache._evict()
+    assert cache.size() == 1000
+
+def test_code_memoized():
+    model = NormalQM(Normal(0., 1., name='mu'), Gamma(1., 1., name='sigma'))
+    assert model.code is model.code
+
+@pytest.mark.slow
+def test_cache_compile_once(tmp_path):
+    cache = ModelCache(tmp_path)
+    model = NormalQM(Normal(0., 1., name='mu'), Gamma(1., 1., name='sigma'))
+    model.compile(cache=cache)
+    files = list(tmp_path.glob('*' + cache.suffix))
+    assert [f.stem for f in files] == [cache.key(model.code)]
+    # a fresh cache on the same directory loads the pickled model
+    model2 = NormalQM(Normal(0., 1., name='mu'), Gamma(1., 1., name='sigma'))
+    model2.compile(cache=ModelCache(tmp_path))
+    assert model2.model.model_code == model.model.model_code
@@ -0,0 +1,31 @@
+import numpy as np
+
+from bqme import diagnostics
+
+
+def ar1(rho, n=2000, chains=4, seed=0):
+    rng = np.random.RandomState(seed)
+    x = np.zeros((n, chains))
+    x[0] = rng.normal(size=chains)
+    for t in range(1, n):
+        x[t] = rho * x[t - 1] + np.sqrt(1. - rho**2) * rng.normal(size=chains)
+    return x
+
+def test_ess_iid_and_autocorrelated():
+    assert 0.9 < diagnostics.ess_bulk(ar1(0.)) / 8000 < 1.1
+    # ess of an AR(1) chain is n (1 - rho) / (1 + rho)
+    assert 0.8 < diagnostics.ess_bulk(ar1(0.9)) / (8000 * 0.1 / 1.9) < 1.2
+    assert diagnostics.ess_tail(ar1(0.9)) < diagnostics.ess_tail(ar1(0.))
+
+def test_rhat():
+    x = ar1(0.)
+    assert diagnostics.rhat(x) < 1.01
+    assert diagnostics.rhat(x + [0., 0., 0., 1.]) > 1.05
+    # a chain with a different scale is detected by the folded draws
+    assert diagnostics.rhat(x * [1., 1., 1., 3.]) > 1.05
+
+def test_summary():
+    x = np.array([ar1(0., seed=0), ar1(0.5, seed=1)])
+    summary = diagnostics.summary(x, ['mu', 'sigma'])
+    assert list(summary) == ['rhat', 'ess_bulk', 'ess_tail']
+    assert summary['ess_bulk']['mu'] > summary['ess_bulk']['sigma']
@@ -31,6 +31,21 @@ def test_normal_code():
         }
     assert code == exp_out
 
+def test_normal_code_priors_as_data():
+    mu = Normal(0., 1., name='mu')
+    exp_out = {
+            'parameter': 'real mu;',
+            'prior': 'mu ~ normal(mu_mu, mu_sigma);',
+            'data': 'real mu_mu;\n    real<lower=0.0> mu_sigma;',
+        }
+    assert mu.code(priors_as_data=True) == exp_out
+    assert mu.data() == {'mu_mu': 0., 'mu_sigma': 1.}
+
+def test_gamma_code_vector():
+    code = Gamma(1, 1., name='beta').code(size='K')
+    assert code['parameter'] == 'vector<lower=0>[K] beta;'
+    assert code['prior'] == 'beta ~ gamma(1, 1.0);'
+
 @pytest.mark.slow
 def test_normal_parameters():
     model_stan = pystan.StanModel(model_code=code('normal'))
@@ -140,3 +155,43 @@ def test_distribution_scipy(bqme_dist, scipy_dist):
     assert all( bqme_dist.logcdf(x) == scipy_dist.logcdf(x) )
     assert all( bqme_dist.ppf(q) == scipy_dist.ppf(q) )
 
+
+### array parameters
+
+@pytest.mark.parametrize("name", ['pdf', 'cdf', 'logpdf', 'logcdf'])
+@pytest.mark.parametrize("cls,a,b", [
+        (Normal, [-1., 0., 2.], 1.5),
+        (Gamma, [0.5, 1., 3.], [1., 2., 0.5]),
+        (Lognormal, [-1., 0., 2.], [0.5, 1., 2.]),
+        (Weibull, 2., [0.5, 1., 3.]),
+    ])
+def test_array_parameters(cls, a, b, name):
+    dist = cls(a, b, name='d')
+    assert dist.shape == (3,)
+    x = np.array([0.3, 1., 2.5, 4.])
+    out = getattr(dist, name)(x[:, None])
+    assert out.shape == (4, 3)
+    for k, (ak, bk) in enumerate(np.broadcast(a, b)):
+        assert np.allclose(out[:, k], getattr(cls(ak, bk, name='d'), name)(x))
+    # plain broadcasting of x with the same shape as the parameters
+    assert np.allclose(getattr(dist, name)(x[:3]), np.diag(out[:3]))
+
+def test_array_parameters_ppf():
+    dist = Gamma([0.5, 1., 3.], 2., name='d')
+    q = np.array([0.1, 0.5, 0.9])[:, None]
+    assert np.allclose(dist.cdf(dist.ppf(q)), np.broadcast_to(q, (3, 3)))
+
+def test_array_parameters_domain():
+    with pytest.raises(ValueError):
+        Gamma([1., -1.], 1., name='d')
+    with pytest.raises(ValueError):
+        Normal([0., 1.], [1., 2., 3.], name='d')
+
+def test_array_parameters_no_stan_code():
+    dist = Normal([0., 1.], 1., name='mu')
+    with pytest.raises(ValueError):
+        dist.code()
+    from bqme.models import NormalQM
+    with pytest.raises(ValueError):
+        NormalQM(dist, Gamma(1., 1., name='sigma'))
+    assert Normal(0., 1., name='mu').shape == ()
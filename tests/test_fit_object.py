@@ -1,7 +1,68 @@
 import pytest
 import numpy as np
 
+from bqme.distributions import Normal, Gamma
 from bqme.fit_object import FitObjectSampling, FitObjectOptimizing
+from bqme.models import NormalQM
+
+
+class StanFitLike:
+    """ minimal stand-in for pystan's StanFit4Model with fixed draws """
+    def __init__(self, **draws):
+        self.draws = draws
+        self.n_extract = 0
+
+    def extract(self, pars):
+        self.n_extract += 1
+        pars = [pars] if isinstance(pars, str) else pars
+        return {p: self.draws[p] for p in pars}
+
+    # two chains, the second half of the draws is the second chain
+    def get_stepsize(self):
+        return [0.4, 0.6]
+
+    def get_inv_metric(self, as_dict=False):
+        return [np.array([1., 2.]), np.array([3., 4.])]
+
+    def get_last_position(self):
+        n = len(next(iter(self.draws.values())))
+        return [{p: v[i] for p, v in self.draws.items()} for i in [n // 2 - 1, n - 1]]
+
+def sampling_fit(n=200, seed=0):
+    rng = np.random.RandomState(seed)
+    model = NormalQM(Normal(0., 1., name='mu'), Gamma(1., 1., name='sigma'))
+    stan_obj = StanFitLike(mu=rng.normal(0., 0.1, n),
+            sigma=rng.gamma(10., 0.1, n))
+    return FitObjectSampling(model, stan_obj)
+
+@pytest.mark.parametrize("name", ['pdf', 'cdf', 'logpdf', 'logcdf', 'ppf'])
+def test_fitObjectSampling_vectorized(name):
+    fit = sampling_fit()
+    x = np.linspace(0.1, 0.9, 7)
+    expected = np.array([
+            getattr(Normal(mu, sigma, name='a'), name)(x)
+            for mu, sigma in zip(fit.mu, fit.sigma)
+        ])
+    full = getattr(fit, name)(x, method='full')
+    assert full.shape == (200, 7)
+    assert np.allclose(full, expected)
+    assert np.allclose(getattr(fit, name)(x, method='mean'),
+            expected.mean(axis=0))
+    assert np.allclose(getattr(fit, name)(x, method='median'),
+            np.median(expected, axis=0))
+    assert getattr(fit, name)(0.5, method='mean').shape == ()
+
+def test_fitObjectSampling_extract_once():
+    fit = sampling_fit()
+    assert fit.stan_obj.n_extract == 0
+    mu = fit.mu
+    fit.cdf([0.1, 0.2])
+    fit.ppf(0.3)
+    assert fit.stan_obj.n_extract == 1
+    assert np.all(mu == fit.stan_obj.draws['mu'])
+    assert fit._get_samples().shape == (2, 200)
+    with pytest.raises(ValueError):
+        mu[0] = 1.  # cached samples are read-only
 
 @pytest.mark.slow
 def test_fitObjectSampling(normal_compiled_model):
@@ -46,3 +107,158 @@ def test_NormalQM_optimizing(normal_compiled_model):
     assert fit.cdf(3.) > 0.9
     assert fit.ppf(.9) > 0.
 
+
+### compact storage
+
+def test_detach():
+    fit = sampling_fit(n=200)
+    compact = fit.detach(dtype=np.float32, thin=2)
+    assert compact.stan_obj is None
+    assert not hasattr(compact, '__dict__')
+    assert compact.mu.dtype == np.float32 and compact.mu.shape == (100,)
+    assert np.allclose(compact.mu, fit.mu[::2])
+    assert np.allclose(compact.cdf([0.1, 0.5]), fit.detach(thin=2).cdf([0.1, 0.5]),
+            atol=1e-6)
+    with pytest.raises(AttributeError):
+        compact.U
+
+def test_detach_pickle():
+    import pickle
+    compact = sampling_fit().detach()
+    loaded = pickle.loads(pickle.dumps(compact))
+    assert np.all(loaded.sigma == compact.sigma)
+    assert loaded.model.parameter_names == ['mu', 'sigma']
+
+@pytest.mark.parametrize("filename", ['fits.npz', 'fits.npy'])
+def test_save_load(tmp_path, filename):
+    from bqme.fit_object import save_fits, load_fits, load_fit
+    fits = [sampling_fit(seed=k) for k in range(3)]
+    save_fits(tmp_path / filename, fits)
+    loaded = load_fits(tmp_path / filename)
+    assert len(loaded) == 3
+    assert str(loaded[0].model) == str(fits[0].model)
+    for fit, fit_loaded in zip(fits, loaded):
+        assert np.all(fit.mu == fit_loaded.mu)
+        assert np.allclose(fit.ppf([0.2, 0.8]), fit_loaded.ppf([0.2, 0.8]))
+    fits[1].save(tmp_path / ('single' + filename[4:]))
+    assert np.all(load_fit(tmp_path / ('single' + filename[4:])).mu == fits[1].mu)
+
+def test_save_compressed(tmp_path):
+    from bqme.fit_object import save_fits, load_fit
+    fit = sampling_fit()
+    fit.save(tmp_path / 'fit.npz', compressed=True)
+    assert np.all(load_fit(tmp_path / 'fit.npz').mu == fit.mu)
+    with pytest.raises(ValueError):
+        save_fits(tmp_path / 'fit', [fit], compressed=True)
+
+def test_load_mmap(tmp_path):
+    from bqme.fit_object import save_fits, load_fits
+    fits = [sampling_fit(seed=k).detach(dtype=np.float32) for k in range(5)]
+    save_fits(tmp_path / 'fits', fits)
+    loaded = load_fits(tmp_path / 'fits', model=fits[0].model, mmap_mode='r')
+    assert isinstance(loaded[0]._get_samples().base, np.memmap)
+    assert np.all(loaded[4].sigma == fits[4].sigma)
+    assert loaded[2].pdf([0.1, 0.2]).shape == (2,)
+    with pytest.raises(ValueError):
+        load_fits(tmp_path / 'fits',
+                model=NormalQM(Normal(0., 1., name='a'), Gamma(1., 1., name='b')))
+
+### online update
+
+class StanModelLike:
+    """ records the arguments of sampling """
+    def sampling(self, data, init, **kwargs):
+        self.data, self.init, self.kwargs = data, init, kwargs
+        return StanFitLike(mu=np.zeros(10), sigma=np.ones(10))
+
+def test_update_reuses_adaptation():
+    fit = sampling_fit(n=200)
+    fit.model.model = StanModelLike()
+    new = fit.update(100, [0.25, 0.5, 0.75], [-0.1, 0.3, 0.8])
+    kwargs = fit.model.model.kwargs
+    assert kwargs['chains'] == 2 and kwargs['warmup'] == 0 and kwargs['iter'] == 100
+    assert kwargs['control']['stepsize'] == 0.5
+    assert np.all(kwargs['control']['inv_metric'] == [2., 3.])
+    assert kwargs['control']['adapt_engaged'] is False
+    assert fit.model.model.init == fit._last_positions()
+    assert new.model is fit.model
+    # with warmup stan adapts, starting at the values of the fit
+    fit.update(100, [0.25, 0.5, 0.75], [-0.1, 0.3, 0.8], warmup=50, draws=10)
+    kwargs = fit.model.model.kwargs
+    assert kwargs['iter'] == 60 and 'adapt_engaged' not in kwargs['control']
+
+def test_update_detached():
+    fit = sampling_fit(n=200)
+    detached = fit.detach()
+    assert detached.adaptation['stepsize'] == 0.5
+    assert np.all(detached.adaptation['inv_metric'] == [2., 3.])
+    fit.model.model = StanModelLike()
+    detached.update(100, [0.25, 0.5, 0.75], [-0.1, 0.3, 0.8])
+    assert fit.model.model.kwargs['control']['stepsize'] == 0.5
+    assert callable(fit.model.model.init)  # random draws of the samples
+
+def test_update_carry_prior():
+    fit = sampling_fit(n=200)
+    model = fit.model.posterior_as_prior(fit)
+    assert model.priors_as_data
+    assert np.isclose(model.mu.mu.value, fit.mu.mean())
+    assert np.isclose(model.mu.sigma.value, fit.mu.std())
+    assert np.isclose(model.sigma.alpha.value / model.sigma.beta.value, fit.sigma.mean())
+    assert model.code == NormalQM(Normal(1., 1., name='mu'), Gamma(2., 1., name='sigma'),
+            priors_as_data=True).code
+
+@pytest.mark.slow
+def test_update(normal_compiled_model):
+    fit = normal_compiled_model.sampling(100, [0.25, 0.5, 0.75], [-0.1, 0.3, 0.8])
+    new = fit.update(100, [0.25, 0.5, 0.75], [0.0, 0.4, 0.9])
+    assert new.mu.shape == (4000,)
+    assert abs(new.mu.mean() - 0.4) < 0.1
+    new = fit.update(100, [0.25, 0.5, 0.75], [0.0, 0.4, 0.9], carry_prior=True)
+    assert new.model.priors_as_data
+
+def reweight_data():
+    return 20, [0.25, 0.5, 0.75], [-0.1, 0.3, 0.8]
+
+def test_reweight_matches_refit():
+    data = reweight_data()
+    old = NormalQM(Normal(0., 1., name='mu'), Gamma(1., 1., name='sigma'))
+    new = NormalQM(Normal(0.5, 2., name='mu'), Gamma(2., 1., name='sigma'))
+    np.random.seed(0)
+    fit = old.grid(*data).fit(draws=20000)
+    reweighted = fit.reweight(new)
+    assert reweighted.model is new
+    assert reweighted.pareto_k < 0.7
+    assert np.isclose(reweighted.weights.sum(), 1.)
+    expected = new.grid(*data).mean()
+    assert np.isclose(np.average(reweighted.mu, weights=reweighted.weights),
+            expected['mu'], atol=0.02)
+    # pdf, cdf, ... honor the weights
+    x = [0., 0.5]
+    full = reweighted.cdf(x, method='full')
+    assert np.allclose(reweighted.cdf(x), full.mean(axis=0), atol=0.02)
+    assert np.allclose(reweighted.cdf(x), new.grid(*data).fit(draws=20000).cdf(x),
+            atol=0.01)
+    pp = reweighted.posterior_predictive()
+    assert np.allclose(pp.cdf(x), reweighted.cdf(x))
+
+def test_reweight_warns():
+    data = reweight_data()
+    old = NormalQM(Normal(0., 1., name='mu'), Gamma(1., 1., name='sigma'))
+    far = NormalQM(Normal(3., 0.1, name='mu'), Gamma(1., 1., name='sigma'))
+    fit = old.grid(*data).fit(draws=4000)
+    with pytest.warns(RuntimeWarning, match='pareto k'):
+        fit.reweight(far)
+    other = NormalQM(Normal(0., 1., name='mu'), Normal(1., 1., name='sigma'))
+    with pytest.raises(ValueError):
+        fit.reweight(other)
+
+def test_weighted_detach():
+    from bqme.fit_object import FitObjectWeighted
+    model = NormalQM(Normal(0., 1., name='mu'), Gamma(1., 1., name='sigma'))
+    samples = np.array([[0., 1., 2., 3.], [1., 1., 1., 1.]])
+    fit = FitObjectWeighted(model, samples, [0., 0., 1., 3.])
+    assert fit.effective_sample_size() == 1.6
+    assert fit._init_values() == {'mu': 3., 'sigma': 1.}
+    assert set(fit.detach().mu) <= {2., 3.}
+    assert np.isclose(fit.cdf(1.), 0.25 * Normal._frozen(2., 1.).cdf(1.)
+            + 0.75 * Normal._frozen(3., 1.).cdf(1.))
@@ -0,0 +1,47 @@
+import numpy as np
+
+from bqme.distributions import Normal, Gamma
+from bqme.models import NormalQM, GammaQM
+from bqme.grid import grid_posterior
+
+q, X = [0.25, 0.5, 0.75], [0.1, 1.0, 1.4]
+
+
+def gamma_model():
+    return GammaQM(Gamma(1., 1., name='alpha'), Gamma(1., 1., name='beta'))
+
+def test_grid_matches_dense_grid():
+    model = gamma_model()
+    posterior = model.grid(100, q, X)
+    assert np.isclose(np.sum(posterior.weights), 1.)
+    dense = grid_posterior(model, 100, q, X, np.zeros(2), np.ones(2),
+            size=300, refine=0, width=4.)
+    for name, value in dense.mean().items():
+        assert np.isclose(posterior.mean()[name], value, rtol=1e-2)
+    assert np.isclose(posterior.log_evidence, dense.log_evidence, atol=1e-2)
+
+def test_grid_extends_to_the_mass():
+    # a far too narrow initial grid is extended until it covers the mass
+    model = gamma_model()
+    narrow = grid_posterior(model, 100, q, X, np.zeros(2), np.full(2, 0.01),
+            size=32, refine=0, width=1., max_expand=20)
+    wide = grid_posterior(model, 100, q, X, np.zeros(2), np.ones(2),
+            size=32, refine=0, width=6.)
+    assert np.isclose(narrow.log_evidence, wide.log_evidence, atol=0.05)
+
+def test_grid_close_to_laplace():
+    model = NormalQM(Normal(0., 1., name='mu'), Gamma(1., 1., name='sigma'))
+    N, q_, X_ = 10000, [0.1, 0.5, 0.9], [-1., 0.1, 1.2]
+    posterior = model.grid(N, q_, X_)
+    np.random.seed(0)
+    laplace = model.laplace(N, q_, X_, draws=20000)
+    assert np.isclose(posterior.mean()['mu'], laplace.mu.mean(), atol=1e-3)
+    assert np.isclose(posterior.log_evidence, laplace.log_evidence, atol=0.05)
+
+def test_grid_fit():
+    posterior = gamma_model().grid(100, q, X)
+    fit = posterior.fit(draws=500)
+    assert fit.alpha.shape == fit.beta.shape == (500,)
+    assert np.all(fit.alpha > 0.)
+    assert np.isclose(fit.alpha.mean(), posterior.mean()['alpha'], rtol=0.1)
+    assert fit.cdf([0.5, 1.]).shape == (2,)
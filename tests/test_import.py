@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import bqme
+
+
+def _run(code:str) -> str:
+    """ runs code in a fresh interpreter, s.t. sys.modules is clean """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(bqme.__file__)))
+    env = dict(os.environ, PYTHONPATH=root + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    out = subprocess.run([sys.executable, '-c', code], env=env,
+            stdout=subprocess.PIPE, check=True)
+    return out.stdout.decode().strip()
+
+def test_import_bqme_is_lightweight():
+    code = 'import sys, bqme; print(sorted(m for m in ("numpy", "scipy", "pystan") if m in sys.modules))'
+    assert _run(code) == '[]'
+
+def test_import_models_does_not_load_backends():
+    code = ('import sys, multiprocessing, bqme.models; '
+            'from bqme import NormalQM, Normal, Gamma; '
+            'NormalQM(Normal(0., 1., name="mu"), Gamma(1., 1., name="sigma")).code; '
+            'print("pystan" in sys.modules, "scipy.stats" in sys.modules, '
+            'multiprocessing.get_start_method(allow_none=True))')
+    assert _run(code) == 'False False None'
+
+def test_lazy_attributes():
+    from bqme.models import NormalQM
+    assert bqme.NormalQM is NormalQM
+    assert 'WeibullQM' in dir(bqme)
+    with pytest.raises(AttributeError):
+        bqme.NotAModel
+
+def test_import_models_without_fcntl():
+    # fcntl does not exist on windows, the cache imports it on first lock
+    code = 'import sys; sys.modules["fcntl"] = None; import bqme.models, bqme.cache; print("ok")'
+    assert _run(code) == 'ok'
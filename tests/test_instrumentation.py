@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from bqme import instrumentation
+from bqme.distributions import Normal, Gamma
+from bqme.models import NormalQM
+from tests.test_fit_object import sampling_fit
+
+
+@pytest.fixture
+def events():
+    events = []
+    instrumentation.register(events.append)
+    instrumentation.enable()
+    yield events
+    instrumentation.disable()
+    instrumentation.unregister(events.append)
+
+def test_disabled_records_nothing():
+    fit = sampling_fit()
+    fit.cdf([0.1, 0.2])
+    assert fit.stats.timings == {} and fit.stats.counters == {}
+
+def test_fit_stages(events):
+    fit = sampling_fit(n=200)
+    fit.cdf([0.1, 0.2, 0.3])
+    fit.pdf(0.5, method='full')
+    assert set(fit.stats.timings) == {'extract', 'evaluate'}
+    assert fit.stats.counters == {'extract_calls': 1, 'evaluations': 800}
+    assert [e.stage for e in events] == ['extract', 'evaluate', 'evaluate']
+    assert all(e.source is fit and e.seconds >= 0. for e in events)
+
+def test_laplace_stages(events):
+    model = NormalQM(Normal(0., 1., name='mu'), Gamma(1., 1., name='sigma'))
+    fit = model.laplace(100, [0.25, 0.5, 0.75], [-0.1, 0.3, 0.8], draws=50)
+    assert fit.stats.counters == {'draws': 50}
+    assert events[-1].stage == 'laplace'
+    fit = model.optimizing(100, [0.25, 0.5, 0.75], [-0.1, 0.3, 0.8],
+            backend='numpy')
+    assert list(fit.stats.timings) == ['optimizing']
+
+def test_sampler_counters():
+    class StanFitLike:
+        def get_sampler_params(self, inc_warmup):
+            n = 4 if inc_warmup else 2
+            return [{'n_leapfrog__': np.full(n, 3.), 'divergent__': np.ones(n)}
+                    for _ in range(2)]
+    assert instrumentation.sampler_counters(StanFitLike()) == {
+            'gradient_evaluations': 24,
+            'warmup_gradient_evaluations': 12,
+            'divergences': 4,
+            'draws': 4,
+        }
+
+@pytest.mark.slow
+def test_sampling_stages(normal_compiled_model, events):
+    fit = normal_compiled_model.sampling(100, [0.25, 0.5, 0.75], [-0.1, 0.3, 0.8])
+    assert fit.stats.counters['draws'] == 4000
+    assert fit.stats.counters['gradient_evaluations'] > 0
+    assert 'sampling' in fit.stats.timings
@@ -0,0 +1,78 @@
+import pytest
+import numpy as np
+
+from bqme.distributions import Normal, Gamma
+from bqme.fit_object import FitObjectSampling
+from bqme.models import NormalQM
+from bqme.orderstatistics import OrderStatistics
+from bqme.loo import loo, pointwise_log_likelihood
+from tests.test_fit_object import StanFitLike
+
+N, q, X = 200, [0.1, 0.25, 0.5, 0.75, 0.9], [-1.2, -0.6, 0.05, 0.7, 1.3]
+
+
+def normal_model():
+    return NormalQM(Normal(0., 1., name='mu'), Gamma(1., 1., name='sigma'))
+
+def test_loo_matches_exact_cross_validation():
+    model = normal_model()
+    np.random.seed(0)
+    result = model.grid(N, q, X).fit(draws=4000).loo(N, q, X)
+    assert np.all(result.pareto_k < 0.7)
+    # log p(X[m] | X without m) is the ratio of the evidences
+    log_evidence = model.grid(N, q, X).log_evidence
+    for m in range(len(q)):
+        exact = log_evidence - model.grid(N, np.delete(q, m), np.delete(X, m)).log_evidence
+        assert np.isclose(result.elpd_pointwise[m], exact, atol=0.05)
+    assert np.isclose(result.elpd, np.sum(result.elpd_pointwise))
+    assert np.all(result.p_loo_pointwise > -0.01)
+
+def test_pointwise_log_likelihood_is_likelihood_difference():
+    model = normal_model()
+    samples = np.array([[0., 0.1, -0.2], [1., 1.1, 0.8]])
+    full = OrderStatistics(model, [(N, q, X)]).log_likelihood(samples[:, None, :])[0]
+    log_lik = pointwise_log_likelihood(model, samples, N, q, X)
+    for m in range(len(q)):
+        os = OrderStatistics(model, [(N, np.delete(q, m), np.delete(X, m))])
+        reduced = os.log_likelihood(samples[:, None, :])[0]
+        assert np.allclose(log_lik[:, m], full - reduced)
+    # a single quantile, the likelihood without it is 1
+    assert np.allclose(pointwise_log_likelihood(model, samples, N, q[:1], X[:1])[:, 0],
+            OrderStatistics(model, [(N, q[:1], X[:1])]).log_likelihood(samples[:, None, :])[0])
+
+def test_loo_uses_stan_log_lik():
+    model = normal_model()
+    np.random.seed(0)
+    samples = model.grid(N, q, X).sample(draws=1000)
+    log_lik = pointwise_log_likelihood(model, samples, N, q, X)
+    fit = FitObjectSampling(model, StanFitLike(mu=samples[0], sigma=samples[1],
+            log_lik=log_lik))
+    from_stan = fit.loo()
+    from_numpy = fit.loo(N, q, X)
+    assert np.allclose(from_stan.elpd_pointwise, from_numpy.elpd_pointwise)
+    assert np.allclose(from_stan.pareto_k, from_numpy.pareto_k)
+
+def test_loo_single_quantile_and_warning():
+    model = normal_model()
+    samples = np.array([[0., 0.1], [1., 1.1]])
+    log_lik = pointwise_log_likelihood(model, samples, 10, [0.5], [0.1])
+    assert log_lik.shape == (2, 1)
+    with pytest.raises(ValueError):
+        model.grid(N, q, X).fit(draws=100).loo()
+    # an outlying quantile dominates the importance ratios
+    np.random.seed(0)
+    X_outlier = X[:-1] + [4.]
+    fit = model.grid(N, q, X_outlier).fit(draws=4000)
+    with pytest.warns(RuntimeWarning, match='pareto k of the quantiles'):
+        result = fit.loo(N, q, X_outlier)
+    assert result.pareto_k[4] > 0.7
+    assert np.argmax(result.p_loo_pointwise) == 4
+
+@pytest.mark.slow
+def test_loo_stan(normal_compiled_model):
+    fit = normal_compiled_model.sampling(N, q, X, iter=1000, chains=2)
+    log_lik = fit._extract('log_lik')['log_lik']
+    expected = pointwise_log_likelihood(normal_compiled_model,
+            fit._get_samples(), N, q, X)
+    assert np.allclose(log_lik, expected)
+    assert fit.loo().elpd_pointwise.shape == (5,)
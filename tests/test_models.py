@@ -1,4 +1,6 @@
 import pytest
+import numpy as np
+from scipy.stats import norm, lognorm, weibull_min
 
 from bqme.distributions import Normal, Gamma, Lognormal, Weibull
 from bqme.models import QM, NormalQM, GammaQM, LognormalQM, WeibullQM
@@ -51,6 +53,18 @@ def test_normal_code():
         code_hard_coded = f.read()
     assert code == code_hard_coded
 
+def test_normal_priors_as_data():
+    model1 = NormalQM(Normal(0., 1., name='mu'), Gamma(1., 1.2, name='sigma'),
+            priors_as_data=True)
+    model2 = NormalQM(Normal(1., 2., name='mu'), Gamma(2., 1., name='sigma'),
+            priors_as_data=True)
+    assert model1.code == model2.code
+    assert 'mu ~ normal(mu_mu, mu_sigma);' in model1.code
+    assert 'real<lower=0.0> sigma_beta;' in model1.code
+    data_dict = model2._data_dict(100, [0.5], [0.1])
+    assert data_dict['mu_mu'] == 1.
+    assert data_dict['sigma_alpha'] == 2.
+
 @pytest.mark.slow
 def test_normal_sampling(normal_compiled_model):
     N, q, X = 1000, [0.25, 0.5, 0.75], [-0.1, 0.0, 0.1]
@@ -99,6 +113,17 @@ def test_gamma_optimizing(gamma_compiled_model):
     opt = gamma_compiled_model.optimizing(N, q, X)
     assert opt.alpha > 0.
 
+@pytest.mark.slow
+def test_gamma_single_quantile(gamma_compiled_model):
+    from bqme.orderstatistics import OrderStatistics
+    N, q, X = 1000, [0.5], [1.0]
+    fit = gamma_compiled_model.sampling(N, q, X, iter=1000, chains=2)
+    draws = fit._extract(['log_prob', 'log_lik'])
+    expected = OrderStatistics(gamma_compiled_model, [(N, q, X)]).log_likelihood(
+            fit._get_samples()[:, None, :])[0]
+    assert np.allclose(draws['log_prob'], expected)
+    assert np.allclose(draws['log_lik'][:, 0], draws['log_prob'])
+
 ### LognormalQM tests
 
 def test_lognormal_code():
@@ -166,3 +191,307 @@ def test_weibull_optimizing(weibull_compiled_model):
     N, q, X = 1000, [0.25, 0.5, 0.75], [0.1, 1.0, 1.4]
     opt = weibull_compiled_model.optimizing(N, q, X)
     assert opt.alpha > 0.
+
+### batch fitting
+
+@pytest.mark.slow
+def test_sampling_batch(gamma_compiled_model):
+    datasets = [
+        (1000, [0.25, 0.5, 0.75], [0.1, 1.0, 1.4]),
+        (1000, [0.25, 0.5, 0.75], [-0.1, 1.0, 1.4]), #-0.1 is invalid
+        (100, [0.5, 0.9], [1.0, 2.0]),
+    ]
+    results = list(gamma_compiled_model.sampling_batch(datasets, processes=2,
+            iter=500, chains=2))
+    assert [i for i, _ in results] == [0, 1, 2]
+    assert isinstance(results[1][1], ValueError)
+    assert results[0][1].alpha.mean() > 0.
+    assert results[2][1].alpha.shape == (500,)
+
+@pytest.mark.slow
+def test_optimizing_batch_unordered(gamma_compiled_model):
+    datasets = [(1000, [0.25, 0.5, 0.75], [0.1, 1.0, 1.4])] * 4
+    results = dict(gamma_compiled_model.optimizing_batch(datasets,
+            ordered=False))
+    assert sorted(results) == [0, 1, 2, 3]
+    assert all(fit.alpha > 0. for fit in results.values())
+
+class TransferStanModel:
+    """
+    records the sampling calls. Fits use the data N as stepsize and
+    diverge if sampled with the transferred adaptation and N == 13.
+    """
+    def __init__(self):
+        self.calls = []
+
+    def sampling(self, data, init, **kwargs):
+        from tests.test_fit_object import StanFitLike
+        self.calls.append((data['N'], kwargs))
+        transferred = 'stepsize' in kwargs.get('control', {})
+        diverge = transferred and data['N'] == 13
+        fit = StanFitLike(mu=np.zeros(8), sigma=np.ones(8))
+        fit.get_stepsize = lambda: [float(data['N'])] * 2
+        fit.get_sampler_params = lambda inc_warmup: [{
+                'divergent__': np.full(4, float(diverge)),
+                'energy__': np.array([0., 1., 0., 1.]),
+            }] * 2
+        return fit
+
+def test_sampling_batch_transfer_adaptation():
+    model = NormalQM(Normal(0., 1., name='mu'), Gamma(1., 1., name='sigma'))
+    model.model = TransferStanModel()
+    datasets = [(N, [0.25, 0.5, 0.75], [-0.1, 0.3, 0.8]) for N in [10, 11, 12, 13, 14]]
+    results = list(model.sampling_batch(datasets, processes=1,
+            transfer_adaptation=True, pilot=2, iter=1000, transfer_warmup=50))
+    assert [i for i, _ in results] == [0, 1, 2, 3, 4]
+    calls = model.model.calls
+    # pilots (first and last dataset) with full adaptation
+    assert [N for N, _ in calls[:2]] == [10, 14]
+    assert all('control' not in kwargs for _, kwargs in calls[:2])
+    transferred = calls[2][1]
+    assert transferred['control']['stepsize'] == 12.
+    assert transferred['control']['adapt_engaged'] is False
+    assert transferred['warmup'] == 50 and transferred['iter'] == 550
+    # the diverging dataset is repeated with full adaptation
+    assert [N for N, _ in calls[2:]] == [11, 12, 13, 13]
+    assert 'control' not in calls[-1][1]
+
+@pytest.mark.slow
+def test_sampling_batch_transfer_stan(gamma_compiled_model):
+    datasets = [(1000, [0.25, 0.5, 0.75], [0.1 * s, 1.0 * s, 1.4 * s])
+            for s in [0.9, 1., 1.1, 1.2, 1.3]]
+    results = list(gamma_compiled_model.sampling_batch(datasets, processes=2,
+            transfer_adaptation=True, pilot=2, chains=2))
+    assert [i for i, _ in results] == [0, 1, 2, 3, 4]
+    assert all(fit.alpha.shape == (2000,) for _, fit in results)
+
+def test_e_bfmi():
+    from bqme.diagnostics import e_bfmi
+    fit = TransferStanModel().sampling({'N': 1}, None)
+    assert np.allclose(e_bfmi(fit), 3. / 1.)
+
+class ChunkStanModel:
+    """
+    records the sampling calls. Chains are iid normal draws, shifted
+    by offsets per chain.
+    """
+    def __init__(self, offsets):
+        self.offsets = np.asarray(offsets)
+        self.calls = []
+        self.rng = np.random.RandomState(0)
+
+    def sampling(self, data, init, **kwargs):
+        from tests.test_fit_object import StanFitLike
+        self.calls.append(kwargs)
+        n = (kwargs['iter'] - kwargs['warmup']) // kwargs['thin']
+        draws = {p: self.rng.normal(size=(n, kwargs['chains'])) + self.offsets
+                for p in ['mu', 'sigma']}
+        fit = StanFitLike(mu=draws['mu'].T.ravel(), sigma=draws['sigma'].T.ravel())
+        fit.extract = lambda pars, permuted=True: {p: draws[p] for p in pars}
+        return fit
+
+def test_sampling_controls():
+    model = NormalQM(Normal(0., 1., name='mu'), Gamma(1., 1., name='sigma'))
+    model.model = ChunkStanModel([0., 0.])
+    model.sampling(100, [0.25, 0.5, 0.75], [-0.1, 0.3, 0.8], chains=2,
+            iter=600, thin=2, seed=3, n_jobs=1)
+    assert model.model.calls[0] == dict(chains=2, iter=600, warmup=300,
+            thin=2, seed=3, n_jobs=1)
+
+def test_sampling_adaptive_converged():
+    model = NormalQM(Normal(0., 1., name='mu'), Gamma(1., 1., name='sigma'))
+    model.model = ChunkStanModel([0., 0., 0., 0.])
+    fit = model.sampling(100, [0.25, 0.5, 0.75], [-0.1, 0.3, 0.8],
+            adaptive=True, chunk=250)
+    assert len(model.model.calls) == 1
+    assert model.model.calls[0]['iter'] == 1250
+    assert fit.convergence['converged'] and fit.convergence['stopped'] == 'converged'
+    assert fit.mu.shape == (1000,)
+    assert fit.convergence['rhat']['mu'] < 1.01
+
+def test_sampling_adaptive_not_converged():
+    model = NormalQM(Normal(0., 1., name='mu'), Gamma(1., 1., name='sigma'))
+    model.model = ChunkStanModel([0., 0., 0., 1.])
+    fit = model.sampling(100, [0.25, 0.5, 0.75], [-0.1, 0.3, 0.8],
+            adaptive=True, chunk=250, seed=1)
+    calls = model.model.calls
+    assert len(calls) == 4
+    # the chains are continued with the adaptation of the first chunk
+    assert all(c['warmup'] == 0 and c['iter'] == 250 for c in calls[1:])
+    assert calls[1]['control']['stepsize'] == 0.5
+    assert calls[1]['control']['adapt_engaged'] is False
+    assert [c['seed'] for c in calls] == [1, 2, 3, 4]
+    assert not fit.convergence['converged']
+    assert fit.convergence['stopped'] == 'iter'
+    assert fit.convergence['iterations'] == 2000
+    assert fit.mu.shape == (4000,)
+    # time budget
+    model.model.calls = []
+    fit = model.sampling(100, [0.25, 0.5, 0.75], [-0.1, 0.3, 0.8],
+            adaptive=True, time_budget=0.)
+    assert len(model.model.calls) == 1
+    assert fit.convergence['stopped'] == 'time_budget'
+
+@pytest.mark.slow
+def test_sampling_adaptive_stan(gamma_compiled_model):
+    fit = gamma_compiled_model.sampling(1000, [0.25, 0.5, 0.75],
+            [0.1, 1.0, 1.4], adaptive=True, chunk=200)
+    assert fit.convergence['converged']
+    assert fit.convergence['iterations'] < 2000
+
+class VBStanModel:
+    """ writes an ELBO trace of `iterations` and returns gaussian draws """
+    def __init__(self, iterations):
+        self.iterations = iterations
+
+    def vb(self, data, init, diagnostic_file, **kwargs):
+        self.kwargs = kwargs
+        with open(diagnostic_file, 'w') as f:
+            f.write('# adaptation\niter,time_in_seconds,ELBO\n0,0,0\n')
+            for i in range(100, self.iterations + 1, 100):
+                f.write(f'{i},0.01,{-100. / i}\n')
+        rng = np.random.RandomState(0)
+        n = kwargs['output_samples']
+        return {
+            'sampler_param_names': ['mu', 'sigma', 'lp__'],
+            'sampler_params': [rng.normal(0.3, 0.1, n),
+                    rng.gamma(10., 0.1, n), np.zeros(n)],
+        }
+
+def test_variational():
+    model = NormalQM(Normal(0., 1., name='mu'), Gamma(1., 1., name='sigma'))
+    model.model = VBStanModel(500)
+    fit = model.variational(100, [0.25, 0.5, 0.75], [-0.1, 0.3, 0.8],
+            algorithm='fullrank', output_samples=200, seed=2)
+    assert model.model.kwargs['algorithm'] == 'fullrank'
+    assert model.model.kwargs['seed'] == 2
+    assert fit.mu.shape == fit.sigma.shape == (200,)
+    assert fit.converged
+    assert list(fit.elbo_iterations) == [0, 100, 200, 300, 400, 500]
+    assert fit.elbo[-1] == -0.2
+    assert fit.cdf([0., 1.]).shape == (2,)
+    model.model = VBStanModel(10000)
+    fit = model.variational(100, [0.25, 0.5, 0.75], [-0.1, 0.3, 0.8])
+    assert not fit.converged
+
+@pytest.mark.slow
+def test_variational_stan(gamma_compiled_model):
+    fit = gamma_compiled_model.variational(1000, [0.25, 0.5, 0.75],
+            [0.1, 1.0, 1.4], seed=1)
+    assert fit.alpha.shape == (1000,)
+    assert len(fit.elbo) > 1
+
+### stacked datasets
+
+def test_stacked_code():
+    mu = Normal(0., 1., name='mu')
+    sigma = Gamma(1., 1.2, name='sigma')
+    code = NormalQM(mu, sigma).stacked_code
+    assert 'vector[K] mu;\n    vector<lower=0>[K] sigma;' in code
+    assert 'mu ~ normal(0.0, 1.0);' in code
+    assert 'U[m] = normal_cdf(X[m], mu[k], sigma[k]);' in code
+
+def test_stacked_data_dict():
+    model = NormalQM(Normal(0., 1., name='mu'), Gamma(1., 1.2, name='sigma'))
+    datasets = [(100, [0.25, 0.5, 0.75], [-0.1, 0.3, 0.8]), (50, [0.5], [0.1])]
+    data_dict = model._data_dict_stacked(datasets)
+    assert data_dict['K'] == 2
+    assert data_dict['T'] == 4
+    assert data_dict['M'] == [3, 1]
+    assert data_dict['offsets'] == [1, 4]
+    assert list(data_dict['X']) == [-0.1, 0.3, 0.8, 0.1]
+
+@pytest.mark.slow
+def test_sampling_stacked():
+    model = NormalQM(Normal(0., 1., name='mu'), Gamma(1., 1.2, name='sigma'))
+    datasets = [(1000, [0.25, 0.5, 0.75], [-0.1, 0.0, 0.1]),
+            (1000, [0.25, 0.5, 0.75], [0.9, 1.0, 1.1]),
+            (100, [0.5], [2.0])]
+    fits = model.sampling_stacked(datasets)
+    assert len(fits) == 3
+    assert -0.01 < fits[0].mu.mean() < 0.01
+    assert 0.99 < fits[1].mu.mean() < 1.01
+    assert fits[1].U.shape == (fits[1].mu.shape[0], 3)
+    assert fits[2].U.shape == (fits[2].mu.shape[0], 1)
+    assert fits[1].cdf(1.0) > 0.4
+
+### initial values
+
+q_init = [0.1, 0.25, 0.5, 0.75, 0.9]
+
+@pytest.mark.parametrize("model, scipy_dist, expected", [
+    (NormalQM(Normal(0., 1., name='mu'), Gamma(1., 1., name='sigma')),
+        norm(loc=3e-6, scale=2e-6), {'mu': 3e-6, 'sigma': 2e-6}),
+    (LognormalQM(Normal(0., 1., name='mu'), Gamma(1., 1., name='sigma')),
+        lognorm(s=0.5, scale=np.exp(2.)), {'mu': 2., 'sigma': 0.5}),
+    (WeibullQM(Gamma(1., 1., name='alpha'), Gamma(1., 1., name='sigma')),
+        weibull_min(c=7., scale=3e-5), {'alpha': 7., 'sigma': 3e-5}),
+])
+def test_initial_values(model, scipy_dist, expected):
+    values = model.initial_values(q_init, scipy_dist.ppf(q_init))
+    assert values.keys() == expected.keys()
+    assert all(np.isclose(values[k], v) for k, v in expected.items())
+
+def test_initial_values_gamma():
+    model = GammaQM(Gamma(1., 1., name='alpha'), Gamma(1., 1., name='beta'))
+    values = model.initial_values(q_init, [1e-6, 2e-6, 3e-6, 4e-6, 6e-6])
+    assert values['alpha'] > 0. and values['beta'] > 1e5
+    # single quantile
+    values = model.initial_values([0.5], [3.])
+    assert values['alpha'] > 0. and values['beta'] > 0.
+
+def test_init():
+    model = NormalQM(Normal(0., 1., name='mu'), Gamma(1., 1., name='sigma'))
+    X = [1., 2., 3., 4., 5.]
+    assert model._init('auto', q_init, X, chains=False) == \
+            [model.initial_values(q_init, X)]
+    assert model._init('random', q_init, X, chains=True) == 'random'
+    assert model._init({'mu': 1., 'sigma': 2.}, q_init, X, chains=False) == \
+            [{'mu': 1., 'sigma': 2.}]
+    chain_init = model._init('auto', q_init, X, chains=True)()
+    assert chain_init.keys() == {'mu', 'sigma'}
+    assert chain_init['sigma'] > 0.
+    # dicts are used unchanged for every chain
+    assert model._init({'mu': 1., 'sigma': 2.}, q_init, X, chains=True)() == \
+            {'mu': 1., 'sigma': 2.}
+
+def test_jitter_at_zero():
+    model = NormalQM(Normal(0., 1., name='mu'), Gamma(1., 1., name='sigma'))
+    np.random.seed(0)
+    inits = [model._jitter({'mu': 0., 'sigma': 1.}) for _ in range(4)]
+    assert len({init['mu'] for init in inits}) == 4
+    assert len({init['sigma'] for init in inits}) == 4
+
+def test_init_warm_start():
+    model = NormalQM(Normal(0., 1., name='mu'), Gamma(1., 1., name='sigma'))
+    N, q, X = 1000, q_init, [-0.9, -0.4, 0.1, 0.6, 1.1]
+    fit = model.optimizing(N, q, X, backend='numpy')
+    assert model._init(fit, q, X, chains=False) == \
+            [{'mu': float(fit.mu), 'sigma': float(fit.sigma)}]
+    fit2 = model.optimizing(N, q, X, backend='numpy', init=fit)
+    assert np.isclose(fit.mu, fit2.mu)
+
+### laplace approximation
+
+def test_laplace():
+    from bqme.orderstatistics import OrderStatistics
+    model = NormalQM(Normal(0., 1., name='mu'), Gamma(1., 1.2, name='sigma'))
+    N, q, X = 100, [0.25, 0.5, 0.75], [-0.1, 0.3, 0.8]
+    np.random.seed(0)
+    fit = model.laplace(N, q, X, draws=4000)
+    assert fit.mu.shape == fit.sigma.shape == (4000,)
+    assert np.all(fit.sigma > 0.)
+    assert fit.cdf([0., 3.], method='full').shape == (4000, 2)
+    with pytest.raises(AttributeError):
+        fit.U
+    # posterior moments and evidence by brute force integration on a grid
+    os = OrderStatistics(model, [(N, q, X)])
+    mu, sigma = np.meshgrid(np.linspace(-1., 1.5, 501),
+            np.linspace(0.05, 2., 500), indexing='ij')
+    theta = np.array([mu, sigma])[:, None]
+    lp = (os.log_likelihood(theta) + os.log_prior(theta))[0]
+    w = np.exp(lp - lp.max())
+    area = (mu[1, 0] - mu[0, 0]) * (sigma[0, 1] - sigma[0, 0])
+    assert np.isclose(fit.mu.mean(), np.sum(w * mu) / w.sum(), atol=0.01)
+    assert np.isclose(fit.log_evidence, lp.max() + np.log(w.sum() * area),
+            atol=0.05)
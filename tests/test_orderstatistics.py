@@ -0,0 +1,129 @@
+import pytest
+import numpy as np
+from scipy.optimize import minimize
+from scipy.special import gammaln
+
+from bqme.distributions import Normal, Gamma, Lognormal, Weibull
+from bqme.models import NormalQM, GammaQM, LognormalQM, WeibullQM
+from bqme.fit_object import FitObjectOptimizing
+from bqme.orderstatistics import OrderStatistics
+
+models = [
+    NormalQM(Normal(0., 1., name='mu'), Gamma(1., 1.2, name='sigma')),
+    GammaQM(Gamma(1., 1., name='alpha'), Gamma(1., 1., name='beta')),
+    LognormalQM(Normal(1., 1., name='mu'), Lognormal(1., 1., name='sigma')),
+    WeibullQM(Weibull(1., 1., name='alpha'), Weibull(1., 1., name='sigma')),
+]
+
+datasets = [
+    (100, [0.25, 0.5, 0.75], [0.3, 0.6, 1.1]),
+    (1000, [0.1, 0.9], [0.2, 2.0]),
+    (50, [0.3], [0.7]),
+]
+
+def log_likelihood_loop(dist, theta, N, q, X):
+    """ straight transcription of the likelihood in the stan template """
+    U = dist._frozen(*theta).cdf(np.array(X))
+    M = len(q)
+    lpdf = gammaln(N+1) - gammaln(N*q[0]) - gammaln(N-N*q[M-1]+1)
+    lpdf += (N*q[0]-1)*np.log(U[0])
+    lpdf += (N-N*q[M-1])*np.log(1-U[M-1])
+    for m in range(1, M):
+        lpdf += -gammaln(N*q[m]-N*q[m-1])
+        lpdf += (N*q[m]-N*q[m-1]-1)*np.log(U[m]-U[m-1])
+    return lpdf + dist._frozen(*theta).logpdf(np.array(X)).sum()
+
+@pytest.mark.parametrize("model", models)
+def test_log_likelihood(model):
+    os = OrderStatistics(model, datasets)
+    theta = np.array([[1.2, 0.8, 1.5], [0.9, 1.3, 0.6]])
+    expected = [log_likelihood_loop(model._distribution, theta[:, k], *d)
+            for k, d in enumerate(datasets)]
+    assert np.allclose(os.log_likelihood(theta), expected)
+    # trailing dimensions evaluate several parameters per dataset
+    theta2 = np.stack([theta, 1.1 * theta], axis=-1)
+    assert np.allclose(os.log_likelihood(theta2)[:, 1],
+            os.log_likelihood(1.1 * theta))
+
+@pytest.mark.parametrize("model", models)
+@pytest.mark.parametrize("jacobian", [False, True])
+def test_log_posterior_gradient(model, jacobian):
+    os = OrderStatistics(model, datasets)
+    z = os.unconstrain(np.array([[1.2, 0.8, 1.5], [0.9, 1.3, 0.6]]))
+    _, g = os.log_posterior(z, grad=True, jacobian=jacobian)
+    h = 1e-6
+    for j in range(len(z)):
+        zp, zm = z.copy(), z.copy()
+        zp[j] += h
+        zm[j] -= h
+        numeric = (os.log_posterior(zp, jacobian=jacobian)
+                - os.log_posterior(zm, jacobian=jacobian)) / (2. * h)
+        assert np.allclose(g[j], numeric, rtol=1e-5, atol=1e-6)
+
+@pytest.mark.parametrize("model", models[1:])
+def test_optimize(model):
+    os = OrderStatistics(model, datasets)
+    z, lp, converged = os.optimize(np.zeros((2, os.K)))
+    assert converged.all()
+    for k, dataset in enumerate(datasets):
+        single = OrderStatistics(model, [dataset])
+        f = lambda x: -single.log_posterior(x.reshape(2, 1))[0]
+        res = minimize(f, np.zeros(2), method='Nelder-Mead',
+                options={'xatol': 1e-10, 'fatol': 1e-12, 'maxiter': 5000})
+        assert np.allclose(z[:, k], res.x, atol=1e-4)
+        assert np.isclose(lp[k], -res.fun)
+
+def test_optimizing_numpy():
+    model = models[1]
+    N, q, X = 1000, [0.25, 0.5, 0.75], [0.1, 1.0, 1.4]
+    fit = model.optimizing(N, q, X, backend='numpy')
+    assert isinstance(fit, FitObjectOptimizing)
+    assert fit.alpha > 0.
+    assert fit.U.shape == (3,)
+    assert np.isclose(fit.cdf(1.0), fit.U[1])
+    results = list(model.optimizing_batch([(N, q, X), (N, q, [-0.1, 1.0, 1.4])],
+            backend='numpy'))
+    assert [i for i, _ in results] == [0, 1]
+    assert np.isclose(results[0][1].alpha, fit.alpha)
+    assert isinstance(results[1][1], ValueError)
+
+@pytest.mark.slow
+def test_optimizing_numpy_equals_stan(gamma_compiled_model):
+    N, q, X = 1000, [0.25, 0.5, 0.75], [0.1, 1.0, 1.4]
+    fit_stan = gamma_compiled_model.optimizing(N, q, X)
+    fit_numpy = gamma_compiled_model.optimizing(N, q, X, backend='numpy')
+    assert np.isclose(fit_stan.alpha, fit_numpy.alpha, rtol=1e-3)
+    assert np.isclose(fit_stan.beta, fit_numpy.beta, rtol=1e-3)
+    assert np.isclose(fit_stan.log_prob, fit_numpy.log_prob, rtol=1e-4)
+
+def scipy_mode(os, z0):
+    """ mode by scipy's BFGS in units of the natural scale at z0 """
+    scale = 1. / np.sqrt(np.abs(np.diag(os.hessian(z0[:, None])[:, :, 0])))
+    f = lambda u: -os.log_posterior((z0 + scale * u)[:, None])[0]
+    res = minimize(f, np.zeros(len(z0)), method='Nelder-Mead',
+            options={'xatol': 1e-10, 'fatol': 1e-10, 'maxiter': 5000})
+    return -res.fun
+
+@pytest.mark.parametrize("dataset", [
+    # microsecond scale, non-finite gradients of an absolute hessian step
+    (45624, (0.0103705, 0.6548194), (1.6005650e-06, 2.3690386e-06)),
+    (16557, (0.168, 0.454, 0.615, 0.707, 0.864),
+            (4.6314e-06, 4.6577e-06, 4.6631e-06, 4.6769e-06, 4.6778e-06)),
+    # large scale, far from the initial steps
+    (9283, (0.2, 0.7), (4000., 9000.)),
+])
+def test_optimize_badly_scaled(dataset):
+    model = NormalQM(Normal(0., 10., name='mu'), Gamma(1., 1., name='sigma'))
+    os = OrderStatistics(model, [dataset])
+    z0 = model._init_unconstrained('auto', *dataset[1:])[:, None]
+    z, lp, converged = os.optimize(z0)
+    assert converged[0]
+    assert lp[0] >= scipy_mode(os, z[:, 0]) - 1e-6 * abs(lp[0])
+    fit = model.optimizing(*dataset, backend='numpy')
+    assert np.isclose(fit.log_prob, os.log_likelihood(os.constrain(z)[0])[0])
+
+def test_optimize_non_finite():
+    # a non-finite start stops the dataset instead of looping forever
+    os = OrderStatistics(models[0], datasets[:2])
+    z, _, converged = os.optimize(np.array([[np.nan, 0.], [0., 0.]]))
+    assert list(converged) == [False, True]
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from bqme.distributions import Normal, Gamma, Lognormal, Weibull
+from bqme.fit_object import FitObjectOptimizing
+from bqme.models import NormalQM
+from bqme.predictive import PosteriorPredictive
+
+
+def random_samples(distribution, n=500, seed=0):
+    rng = np.random.RandomState(seed)
+    if distribution is Normal:
+        return np.array([rng.normal(0., 1., n), rng.gamma(5., 0.2, n)])
+    return np.array([rng.gamma(5., 0.3, n), rng.gamma(5., 0.2, n)])
+
+@pytest.mark.parametrize("distribution", [Normal, Gamma, Lognormal, Weibull])
+def test_mixture(distribution):
+    samples = random_samples(distribution)
+    pp = PosteriorPredictive(distribution, samples)
+    x = np.array([0.2, 0.7, 1.5])
+    expected = np.mean([distribution(a, b, name='x').cdf(x)
+            for a, b in samples.T], axis=0)
+    assert np.allclose(pp.cdf(x), expected)
+    expected = np.mean([distribution(a, b, name='x').pdf(x)
+            for a, b in samples.T], axis=0)
+    assert np.allclose(pp.pdf(x), expected)
+
+@pytest.mark.parametrize("distribution", [Normal, Gamma, Lognormal, Weibull])
+def test_ppf(distribution):
+    pp = PosteriorPredictive(distribution, random_samples(distribution))
+    q = np.linspace(0.001, 0.999, 3000)
+    x = pp.ppf(q)
+    assert x.shape == q.shape
+    assert np.all(np.diff(x) > 0.)
+    assert np.allclose(pp.cdf(x), q, atol=1e-4)
+    q = np.array([1e-6, 0.05, 0.5, 0.95, 1. - 1e-6])
+    assert np.allclose(pp.cdf(pp.ppf(q, refine=2)), q, rtol=1e-8, atol=1e-12)
+
+def test_ppf_single_sample():
+    # the mixture of a single sample is the distribution itself
+    fit = FitObjectOptimizing(
+            NormalQM(Normal(0., 1., name='mu'), Gamma(1., 1., name='sigma')),
+            {'mu': np.array(0.3), 'sigma': np.array(1.4)})
+    pp = fit.posterior_predictive()
+    q = np.array([0.01, 0.3, 0.5, 0.99])
+    assert np.allclose(pp.ppf(q), Normal(0.3, 1.4, name='x').ppf(q), atol=1e-5)
@@ -0,0 +1,39 @@
+import numpy as np
+from scipy.stats import norm
+
+from bqme.psis import psis, tail_length, k_threshold
+
+
+def importance_log_weights(scale, draws=4000, seed=0):
+    """ N(0, 1) draws for the target N(0, scale) """
+    x = np.random.RandomState(seed).normal(size=draws)
+    return norm.logpdf(x, 0., scale) - norm.logpdf(x)
+
+def test_psis_normalized_and_columns():
+    lw = np.stack([importance_log_weights(1.2), importance_log_weights(3.)], axis=1)
+    smoothed, k = psis(lw)
+    assert smoothed.shape == lw.shape
+    assert np.allclose(np.exp(smoothed).sum(axis=0), 1.)
+    # columns are smoothed independently
+    for j in range(2):
+        smoothed_j, k_j = psis(lw[:, j])
+        assert np.allclose(smoothed_j, smoothed[:, j])
+        assert np.isclose(k_j, k[j])
+
+def test_psis_pareto_k():
+    _, k_light = psis(importance_log_weights(1.2))
+    _, k_heavy = psis(importance_log_weights(3.))
+    assert k_light < k_threshold(4000) < k_heavy
+    # equal weights have nothing to smooth
+    smoothed, k = psis(np.zeros(100))
+    assert k == -np.inf and np.allclose(smoothed, -np.log(100))
+
+def test_psis_smooths_only_the_tail():
+    lw = importance_log_weights(1.5)
+    smoothed, _ = psis(lw)
+    M = tail_length(len(lw))
+    order = np.argsort(lw)
+    shift = smoothed - lw
+    # the bulk is only renormalized
+    assert np.allclose(shift[order[:-M]], shift[order[0]])
+    assert not np.allclose(shift[order[-M:]], shift[order[0]])
@@ -0,0 +1,87 @@
+import pytest
+import numpy as np
+from scipy.stats import gamma, norm, weibull_min
+
+from bqme.distributions import Normal, Gamma
+from bqme.fit_object import FitObjectLaplace
+from bqme.models import NormalQM, GammaQM
+from bqme.selection import select_family, select_family_batch, default_families
+
+q = [0.05, 0.25, 0.5, 0.75, 0.95]
+datasets = [
+    (1000, q, list(gamma(3.).ppf(q))),
+    (1000, q, list(norm(5., 1.).ppf(q))),
+    (1000, q, list(weibull_min(1.5).ppf(q))),
+]
+
+
+def names(candidates):
+    return [c.model.__class__.__name__ for c in candidates]
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_select_family(processes):
+    ranked = select_family(*datasets[0], processes=processes)
+    assert names(ranked)[0] == 'GammaQM'
+    assert sorted(names(ranked)) == ['GammaQM', 'LognormalQM', 'NormalQM', 'WeibullQM']
+    scores = [c.score for c in ranked]
+    assert scores == sorted(scores, reverse=True)
+    best = ranked[0]
+    assert isinstance(best.fit, FitObjectLaplace)
+    assert best.fit.model is best.model
+    assert np.isclose(best.score, best.fit.log_evidence)
+
+def test_select_family_domain_errors():
+    ranked = select_family(1000, [0.25, 0.5, 0.75], [-0.5, 0.1, 0.6], processes=1)
+    assert names(ranked)[0] == 'NormalQM'
+    assert all(c.score == -np.inf and isinstance(c.fit, ValueError) for c in ranked[1:])
+
+@pytest.mark.parametrize("criterion", ['laplace', 'grid', 'map'])
+def test_select_family_batch(criterion):
+    results = list(select_family_batch(datasets * 3, criterion=criterion,
+            processes=2, chunksize=2))
+    assert [i for i, _ in results] == list(range(9))
+    best = [names(candidates)[0] for _, candidates in results]
+    assert best == ['GammaQM', 'NormalQM', 'WeibullQM'] * 3
+
+def test_select_family_custom_families():
+    families = [
+        NormalQM(Normal(5., 1., name='mu'), Gamma(2., 2., name='sigma')),
+        GammaQM(Gamma(1., 0.1, name='alpha'), Gamma(1., 0.1, name='beta')),
+    ]
+    ranked = select_family(*datasets[1], families=families, criterion='map',
+            processes=1)
+    assert ranked[0].model is families[0]
+    assert ranked[0].fit.mu > 4.
+    with pytest.raises(ValueError):
+        select_family(*datasets[1], criterion='aic')
+    assert len(default_families()) == 4
+
+@pytest.mark.slow
+def test_select_family_loo():
+    ranked = select_family(*datasets[1], criterion='loo', iter=1000, chains=2)
+    assert names(ranked)[0] == 'NormalQM'
+
+def test_select_family_badly_scaled():
+    # microsecond scale data, used to hang the numpy optimizer
+    ranked = select_family(45624, (0.0103705, 0.6548194),
+            (1.6005650e-06, 2.3690386e-06), processes=1)
+    assert len(ranked) == 4
+    assert all(np.isfinite(c.score) or isinstance(c.fit, Exception) for c in ranked)
+
+def test_select_family_timeout_and_nan(monkeypatch):
+    import time
+    from types import SimpleNamespace
+    import bqme.selection
+    def fit_and_score(model, criterion, N, q, X, kwargs):
+        if isinstance(model, NormalQM):
+            time.sleep(5.)
+        if isinstance(model, GammaQM):
+            return np.nan, SimpleNamespace()
+        return 1., SimpleNamespace()
+    monkeypatch.setattr(bqme.selection, '_fit_and_score', fit_and_score)
+    start = time.perf_counter()
+    ranked = select_family(*datasets[0], processes=1, timeout=0.2)
+    assert time.perf_counter() - start < 2.
+    assert [c.score for c in ranked] == [1., 1., -np.inf, -np.inf]
+    assert names(ranked)[2:] == ['NormalQM', 'GammaQM']
+    assert isinstance(ranked[2].fit, TimeoutError)
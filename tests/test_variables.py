@@ -19,3 +19,13 @@ def test_PositiveContinuousVariable_expected_fail():
     with pytest.raises(ValueError):
         PositiveContinuousVariable(-1., name='sigma')
 
+
+def test_variable_array():
+    sigma = PositiveContinuousVariable([1., 2., 3.], name='sigma')
+    assert sigma.value.shape == (3,)
+    with pytest.raises(ValueError):
+        sigma.value[0] = 2.  # read-only
+    with pytest.raises(ValueError):
+        PositiveContinuousVariable([[1., -1.], [2., 3.]], name='sigma')
+    with pytest.raises(ValueError):
+        ContinuousVariable([0., float('nan')], name='mu')